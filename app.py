@@ -1,9 +1,18 @@
+import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from settings import settings
 from services.card_fill_service import CardFillService
+from services.async_card_fill_service import AsyncCardFillService
 from services.cache_service import CacheService
 from services.graph_service import GraphService
+from services.reference_data_cache import ReferenceDataCache
+from services.budget_usage_store import BudgetUsageStore
+from services.fill_ingest_queue import FillIngestQueue
+from services.report_cache import ReportCache
+from services.sql_stats import SqlStats
+from services.bounded_executor import BoundedExecutor, ExecutorOverloadedError, ExecutorStats, OffloadedService
+from services.db_pool import PoolStats
 from entities import AppMode
 
 
@@ -14,9 +23,46 @@ class App:
         self.bot = Bot(settings.telegram_token)
         self.dp = Dispatcher()
 
-        self.card_fill_service = CardFillService()
-        self.cache_service = CacheService()
-        self.graph_service = GraphService()
+        self.db_executor = BoundedExecutor(
+            "db", settings.db_executor_workers, settings.db_executor_max_queue
+        )
+        self.redis_executor = BoundedExecutor(
+            "redis", settings.redis_executor_workers, settings.redis_executor_max_queue
+        )
+        self.cpu_executor = BoundedExecutor(
+            "cpu", settings.cpu_executor_workers, settings.cpu_executor_max_queue
+        )
+
+        self.sql_stats = SqlStats(slow_update_ms=settings.slow_update_ms)
+        cache_service = CacheService()
+        self.reference_data = ReferenceDataCache(rdb=cache_service.rdb, ttl=settings.reference_data_ttl)
+        report_cache = ReportCache(
+            cache_service.rdb,
+            ttl=settings.report_cache_ttl,
+            past_year_ttl=settings.report_cache_past_year_ttl,
+        )
+        self.sync_card_fill_service = CardFillService(
+            reference_data=self.reference_data,
+            budget_usage=BudgetUsageStore(cache_service.rdb),
+            report_cache=report_cache,
+            sql_stats=self.sql_stats,
+        )
+        self.card_fill_service = AsyncCardFillService(
+            self.sync_card_fill_service, sql_stats=self.sql_stats, redis_executor=self.redis_executor
+        )
+        self.cache_service = OffloadedService(cache_service, self.redis_executor)
+        self.report_cache = OffloadedService(report_cache, self.redis_executor)
+        self.graph_service = OffloadedService(GraphService(), self.cpu_executor)
+        self.fill_ingest_queue = (
+            FillIngestQueue(
+                cache_service.rdb,
+                max_attempts=settings.fill_queue_max_attempts,
+                retry_after=settings.fill_queue_retry_after,
+                key_ttl=settings.fill_ingest_key_ttl,
+            )
+            if settings.fill_write_behind
+            else None
+        )
 
     @classmethod
     def _init_logger(cls) -> logging.Logger:
@@ -24,6 +70,27 @@ class App:
         logging.basicConfig(level=level)
         return logging.getLogger(__name__)
 
+    def executor_stats(self) -> list[ExecutorStats]:
+        return [executor.stats() for executor in (self.db_executor, self.redis_executor, self.cpu_executor)]
+
+    def pool_stats(self) -> list[PoolStats]:
+        stats = (
+            self.sync_card_fill_service.pool_stats(),
+            self.sync_card_fill_service.replica_pool_stats(),
+            self.card_fill_service.pool_stats(),
+            self.card_fill_service.replica_pool_stats(),
+        )
+        return [s for s in stats if s is not None]
+
+    async def refresh_reference_data(self) -> None:
+        """Picks up reference data versions bumped on other replicas, reading redis off the event loop."""
+        while True:
+            await asyncio.sleep(settings.reference_data_version_check_interval)
+            try:
+                await self.redis_executor.run(self.reference_data.refresh_versions)
+            except ExecutorOverloadedError:
+                self.logger.warning("Skipped a reference data version refresh, the redis executor is overloaded")
+
     async def start(self) -> None:
         if settings.app_mode == AppMode.WEBHOOK:
             raise NotImplementedError
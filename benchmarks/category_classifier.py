@@ -0,0 +1,82 @@
+"""
+Compares CategoryClassifier with StoredCategory.by_desc, which recompiles every
+alias of every category for each description.
+
+    python -m benchmarks.category_classifier --categories 300 --aliases 10
+"""
+
+import argparse
+import random
+import time
+from model import StoredCategory
+from entities import Category
+from services.category_classifier import CategoryClassifier
+
+
+def make_categories(count: int, aliases_per_category: int) -> list[Category]:
+    categories = []
+    for i in range(count):
+        aliases = []
+        for j in range(aliases_per_category):
+            word = f"товар{i}x{j}"
+            # every fifth alias is a prefix pattern, the rest are plain words
+            aliases.append(f"{word}.*" if j % 5 == 0 else word)
+        categories.append(Category(code=f"C{i}", name=f"Категория {i}", aliases=tuple(aliases), emoji_name=""))
+    categories.append(Category(code="OTHER", name="Другое", aliases=(), emoji_name=""))
+    return categories
+
+
+def make_descriptions(categories: list[Category], count: int, rnd: random.Random) -> list[str]:
+    descriptions = []
+    for _ in range(count):
+        roll = rnd.random()
+        category = rnd.choice(categories[:-1])
+        alias = rnd.choice(category.aliases).rstrip(".*")
+        if roll < 0.5:
+            descriptions.append(alias)
+        elif roll < 0.8:
+            descriptions.append(f"{alias.upper()} и еще что-то")
+        else:
+            descriptions.append(f"неизвестно {rnd.randint(0, 10**6)}")
+    return descriptions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--categories", type=int, default=300)
+    parser.add_argument("--aliases", type=int, default=10)
+    parser.add_argument("--descriptions", type=int, default=200)
+    args, _ = parser.parse_known_args()
+
+    rnd = random.Random(42)
+    categories = make_categories(args.categories, args.aliases)
+    descriptions = make_descriptions(categories, args.descriptions, rnd)
+    stored = [
+        StoredCategory(code=c.code, name=c.name, aliases=",".join(c.aliases), emoji_name=c.emoji_name)
+        for c in categories
+    ]
+    stored_default = stored[-1]
+
+    started = time.perf_counter()
+    expected = [StoredCategory.by_desc(d, stored, stored_default).code for d in descriptions]
+    by_desc_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    classifier = CategoryClassifier(categories, categories[-1])
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = [classifier.classify(d).code for d in descriptions]
+    classify_seconds = time.perf_counter() - started
+
+    assert expected == actual
+    per_desc = lambda seconds: seconds / len(descriptions) * 1e6
+    print(f"aliases: {sum(len(c.aliases) for c in categories)}, descriptions: {len(descriptions)}")
+    print(f"StoredCategory.by_desc: {per_desc(by_desc_seconds):.1f} us/description")
+    print(f"classifier build:       {build_seconds * 1000:.1f} ms once")
+    print(f"classifier.classify:    {per_desc(classify_seconds):.1f} us/description")
+    print(f"speedup:                {by_desc_seconds / classify_seconds:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
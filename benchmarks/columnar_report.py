@@ -0,0 +1,98 @@
+"""
+Compares summing a year of fills per month and category with Python dict loops
+and with MonthMatrix, and the category report served from the rollup table
+and from the columnar fill store.
+
+    python -m benchmarks.columnar_report --fills 100000
+"""
+
+import argparse
+import time
+from collections import defaultdict
+import numpy as np
+from entities import Month, Quarter, FillScope
+from services.card_fill_service import CardFillService
+from services.columnar_report import ColumnarFillStore, FillColumns
+from services.reference_data_cache import ReferenceDataCache
+from benchmarks.data import create_database
+
+
+def dict_loop_sums(months: list[int], codes: list[str], amounts: list[float]) -> dict:
+    """Month, quarter and year sums per category as the reports computed them before MonthMatrix."""
+    monthly_data: dict[Month, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    quarter_data: dict[Quarter, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    year_data: dict[str, float] = defaultdict(float)
+    for month_number, code, amount in zip(months, codes, amounts):
+        month = Month(month_number)
+        monthly_data[month][code] += amount
+        quarter_data[Quarter.from_month(month)][code] += amount
+        year_data[code] += amount
+    return {
+        code: (monthly_data[Month.march][code], quarter_data[Quarter.q1][code], year_data[code]) for code in year_data
+    }
+
+
+def matrix_sums(columns: FillColumns, codes: list[str], year: int) -> dict:
+    matrix = columns.year_matrix(year, columns.category_id, len(codes))
+    month, quarter, total = matrix.month(Month.march), matrix.quarter(Quarter.q1), matrix.year()
+    return {codes[g]: (month[g], quarter[g], total[g]) for g in matrix.present()}
+
+
+def _best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def _assert_close(expected: dict, actual: dict) -> None:
+    assert expected.keys() == actual.keys()
+    for code, sums in expected.items():
+        assert np.allclose(sums, actual[code]), code
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fills", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args, _ = parser.parse_known_args()
+
+    year = 2024
+    months = [Month.march]
+    scope = FillScope(scope_id=1, scope_type="GROUP", chat_id=-1)
+    engine = create_database(args.fills, year=year)
+    rollup_service = CardFillService(db_engine=engine)
+    store = ColumnarFillStore(ReferenceDataCache())
+    columnar_service = CardFillService(db_engine=engine, fill_columns=store)
+
+    with columnar_service.db_session() as db_session:
+        columns = store.columns(db_session, scope.scope_id)
+    codes = store.category_codes
+    fill_months = (columns.month_index % 12 + 1).tolist()
+    fill_codes = [codes[c] for c in columns.category_id.tolist()]
+    fill_amounts = columns.amount.tolist()
+    _assert_close(dict_loop_sums(fill_months, fill_codes, fill_amounts), matrix_sums(columns, codes, year))
+
+    loops = _best_of(args.repeat, lambda: dict_loop_sums(fill_months, fill_codes, fill_amounts))
+    matrix = _best_of(args.repeat, lambda: matrix_sums(columns, codes, year))
+    rollup_report = _best_of(args.repeat, lambda: rollup_service.get_monthly_report_by_category(months, year, scope))
+    columnar_report = _best_of(
+        args.repeat, lambda: columnar_service.get_monthly_report_by_category(months, year, scope)
+    )
+    with rollup_service.db_session() as db_session:
+        cold_load = _best_of(1, lambda: ColumnarFillStore(ReferenceDataCache()).columns(db_session, scope.scope_id))
+
+    print(f"fills: {args.fills}")
+    print("sums over in-memory fills")
+    print(f"  dict loops:      {loops * 1000:.1f} ms")
+    print(f"  MonthMatrix:     {matrix * 1000:.1f} ms ({loops / matrix:.0f}x)")
+    print("get_monthly_report_by_category")
+    print(f"  rollup table:    {rollup_report * 1000:.1f} ms")
+    print(f"  columnar, warm:  {columnar_report * 1000:.1f} ms")
+    print(f"  columnar load:   {cold_load * 1000:.1f} ms once per scope, after every edit and every ttl")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import random
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import StaticPool
+from services.card_fill_service import CardFillService
+from model import (
+    Base,
+    StoredCardFill,
+    StoredCategory,
+    StoredFillScope,
+    StoredTelegramUser,
+    StoredBudget,
+    StoredIncome,
+)
+
+
+CATEGORIES = [
+    ("FOOD", "Продукты", "еда,продукты,магнит,пятерочка,перекресток,лента,вкусвилл,ашан,дикси,рынок", ":shopping_cart:"),
+    ("RESTAURANT", "Рестораны", "макдак,кофе.*,ресторан,бургер,кфс,шаурма,суши,пицца,бар,обед", ":fork_and_knife:"),
+    ("TAXI", "Такси", "такси,яндекс такси,uber,ситимобил,bolt", ":taxi:"),
+    ("TRANSPORT", "Транспорт", "метро,автобус,электричка,тройка,бензин,заправка,парковка", ":bus:"),
+    ("HOME", "Дом", "икеа,леруа,дом,хозтовары,ремонт,мебель", ":house:"),
+    ("UTILITIES", "Коммуналка", "квартплата,свет,интернет,связь,мобильный,газ", ":light_bulb:"),
+    ("HEALTH", "Здоровье", "аптека,врач,анализы,стоматолог.*,лекарства", ":pill:"),
+    ("CLOTHES", "Одежда", "одежда,обувь,zara,uniqlo,кроссовки", ":t-shirt:"),
+    ("FUN", "Развлечения", "кино,театр,концерт,книги,игры,подписка.*", ":performing_arts:"),
+    ("TRAVEL", "Путешествия", "отель,билеты,авиа.*,ржд,виза", ":airplane:"),
+    ("OTHER", "Другое", "", ":red_question_mark:"),
+]
+
+
+def create_database(
+    fills: int, year: int = 2024, users: int = 3, scope_id: int = 1, seed: int = 42, uri: Optional[str] = None
+) -> Engine:
+    """Creates a database with one scope and `fills` random fills over `year`, in-memory SQLite unless `uri` is given."""
+    engine = create_engine(uri) if uri else create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    rnd = random.Random(seed)
+    start = datetime(year, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(StoredCategory),
+            [dict(code=code, name=name, aliases=aliases, emoji_name=emoji) for code, name, aliases, emoji in CATEGORIES],
+        )
+        conn.execute(insert(StoredFillScope), [dict(scope_id=scope_id, scope_type="GROUP", chat_id=-1)])
+        conn.execute(
+            insert(StoredTelegramUser),
+            [dict(user_id=user_id, is_bot=False, username=f"user{user_id}") for user_id in range(1, users + 1)],
+        )
+        conn.execute(
+            insert(StoredBudget),
+            [dict(fill_scope=scope_id, category_code="RESTAURANT", monthly_limit=20000)],
+        )
+        conn.execute(
+            insert(StoredCardFill),
+            [
+                dict(
+                    user_id=rnd.randint(1, users),
+                    fill_date=start + timedelta(minutes=rnd.randrange(365 * 24 * 60)),
+                    amount=round(rnd.uniform(50, 5000), 2),
+                    description="",
+                    category_code=rnd.choice(CATEGORIES)[0],
+                    fill_scope=scope_id,
+                    is_netted=False,
+                )
+                for _ in range(fills)
+            ],
+        )
+    CardFillService(db_engine=engine).rebuild_rollup()
+    return engine
+
+
+# Descriptions of fills no alias matches, and of incomes
+OTHER_DESCRIPTIONS = ["подарок", "штраф", "перевод", "разное", "цветы", "", "комиссия банка"]
+INCOME_DESCRIPTIONS = ["зарплата", "аванс", "фриланс", "кешбэк", "проценты по вкладу", ""]
+# (category_code, monthly_limit, quarter_limit, year_limit) of every scope
+BUDGETS = [
+    ("FOOD", 60000, None, 700000),
+    ("RESTAURANT", 20000, None, None),
+    ("TAXI", None, 15000, None),
+    ("FUN", 10000, 25000, None),
+]
+INSERT_BATCH_SIZE = 20_000
+
+
+def create_dataset(
+    fills: int,
+    incomes: int = 0,
+    scopes: int = 3,
+    users: int = 20,
+    year: int = 2024,
+    seed: int = 42,
+    uri: Optional[str] = None,
+) -> Engine:
+    """Creates scopes, users, categories, budgets, fills and incomes over `year` and the year before.
+
+    Scope 1 is a group chat with every user, the others alternate between
+    private chats of one user and smaller groups. Fill descriptions are drawn
+    from category aliases, so classification and by_desc see realistic text.
+    With `uri` the schema is created in that database, which must have no
+    fills yet; otherwise an in-memory SQLite database is used.
+    """
+    engine = create_engine(uri) if uri else create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        if conn.scalar(select(func.count()).select_from(StoredCardFill)):
+            raise ValueError(f"Database {engine.url!r} already has fills, use an empty one")
+
+    rnd = random.Random(seed)
+    scope_rows, members = _scopes(scopes, users)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(StoredCategory),
+            [dict(code=code, name=name, aliases=aliases, emoji_name=emoji) for code, name, aliases, emoji in CATEGORIES],
+        )
+        conn.execute(insert(StoredFillScope), scope_rows)
+        conn.execute(
+            insert(StoredTelegramUser),
+            [
+                dict(user_id=user_id, is_bot=False, first_name=f"User {user_id}", username=f"user{user_id}")
+                for user_id in range(1, users + 1)
+            ],
+        )
+        conn.execute(
+            insert(StoredBudget),
+            [
+                dict(
+                    fill_scope=scope["scope_id"],
+                    category_code=code,
+                    monthly_limit=monthly,
+                    quarter_limit=quarter,
+                    year_limit=year_limit,
+                )
+                for scope in scope_rows
+                for code, monthly, quarter, year_limit in BUDGETS
+            ],
+        )
+        _insert_batched(conn, StoredCardFill, (_fill_row(rnd, members, year) for _ in range(fills)))
+        _insert_batched(conn, StoredIncome, (_income_row(rnd, members, year) for _ in range(incomes)))
+    CardFillService(db_engine=engine).rebuild_rollup()
+    return engine
+
+
+def _scopes(count: int, users: int) -> tuple[list[dict], dict[int, list[int]]]:
+    scope_rows = [dict(scope_id=1, scope_type="GROUP", chat_id=-1)]
+    members = {1: list(range(1, users + 1))}
+    for scope_id in range(2, count + 1):
+        if scope_id % 2 == 0:
+            user_id = (scope_id - 2) % users + 1
+            scope_rows.append(dict(scope_id=scope_id, scope_type="PRIVATE", chat_id=user_id))
+            members[scope_id] = [user_id]
+        else:
+            scope_rows.append(dict(scope_id=scope_id, scope_type="GROUP", chat_id=-scope_id))
+            members[scope_id] = [user_id for user_id in range(1, users + 1) if user_id % count == scope_id % count] or [1]
+    return scope_rows, members
+
+
+def _fill_row(rnd: random.Random, members: dict[int, list[int]], year: int) -> dict:
+    scope_id = rnd.choice(list(members))
+    code, _, aliases, _ = rnd.choice(CATEGORIES)
+    words = [alias.replace(".*", rnd.choice(["", "ня", "ы"])) for alias in aliases.split(",") if alias]
+    description = rnd.choice(words or OTHER_DESCRIPTIONS)
+    if rnd.random() < 0.3:
+        description = f"{description} {rnd.choice(['утро', 'с друзьями', 'домой', 'на неделю'])}"
+    return dict(
+        user_id=rnd.choice(members[scope_id]),
+        fill_date=_random_date(rnd, year),
+        amount=round(min(rnd.lognormvariate(6.5, 1.1), 200_000), 2),
+        description=description,
+        category_code=code,
+        fill_scope=scope_id,
+        is_netted=False,
+    )
+
+
+def _income_row(rnd: random.Random, members: dict[int, list[int]], year: int) -> dict:
+    scope_id = rnd.choice(list(members))
+    return dict(
+        user_id=rnd.choice(members[scope_id]),
+        income_date=_random_date(rnd, year),
+        amount=round(rnd.uniform(5_000, 250_000), 2),
+        description=rnd.choice(INCOME_DESCRIPTIONS),
+        fill_scope=scope_id,
+    )
+
+
+def _random_date(rnd: random.Random, year: int) -> datetime:
+    return datetime(year - 1, 1, 1) + timedelta(minutes=rnd.randrange(730 * 24 * 60))
+
+
+def _insert_batched(conn: Connection, table: type[Base], rows: Iterable[dict]) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            conn.execute(insert(table), batch)
+            batch = []
+    if batch:
+        conn.execute(insert(table), batch)
@@ -0,0 +1,114 @@
+"""
+Measures memory and aggregation time of report rows built with fresh entity objects
+per fill, as to_entity_fill did before, against interned slotted entities.
+
+    python -m benchmarks.entity_memory --fills 100000
+"""
+
+import argparse
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Optional
+from sqlalchemy.orm import Session, joinedload, selectinload
+from model import StoredCardFill, _split_aliases
+from entities import Fill
+from benchmarks.data import create_database
+
+
+@dataclass(frozen=True)
+class LegacyFillScope:
+    scope_id: Optional[int]
+    scope_type: str
+    chat_id: int
+    report_scopes: Optional[tuple[int]] = None
+
+
+@dataclass(frozen=True)
+class LegacyCategory:
+    code: str
+    name: str
+    aliases: tuple[str]
+    emoji_name: str
+
+
+@dataclass(frozen=True)
+class LegacyUser:
+    id: int
+    is_bot: bool
+    first_name: str
+    last_name: str
+    username: str
+    language_code: str
+
+
+def legacy_fill(stored: StoredCardFill) -> Fill:
+    """to_entity_fill with a new scope, category and user object for every fill."""
+    category = stored.category
+    user = stored.user
+    scope = stored.scope
+    return Fill(
+        id=stored.fill_id,
+        user=LegacyUser(user.user_id, user.is_bot, user.first_name, user.last_name, user.username, user.language_code),
+        fill_date=stored.fill_date,
+        amount=stored.amount,
+        description=stored.description,
+        category=LegacyCategory(category.code, category.name, tuple(category.get_aliases()), category.emoji_name),
+        scope=LegacyFillScope(scope.scope_id, scope.scope_type, scope.chat_id),
+        is_netted=stored.is_netted,
+    )
+
+
+def _build(stored_fills: list[StoredCardFill], to_entity: Callable[[StoredCardFill], Fill]) -> tuple[list[Fill], float, int]:
+    """Entities, build seconds and bytes still allocated by them."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    fills = [to_entity(f) for f in stored_fills]
+    seconds = time.perf_counter() - started
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return fills, seconds, allocated
+
+
+def _aggregate(fills: list[Fill]) -> float:
+    started = time.perf_counter()
+    data: dict = defaultdict(lambda: defaultdict(float))
+    for fill in fills:
+        data[fill.category][fill.user] += fill.amount
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fills", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=50)
+    args, _ = parser.parse_known_args()
+
+    engine = create_database(args.fills, users=args.users)
+    with Session(engine) as db_session:
+        stored_fills = (
+            db_session.query(StoredCardFill)
+            .options(joinedload(StoredCardFill.user), selectinload(StoredCardFill.category), selectinload(StoredCardFill.scope))
+            .all()
+        )
+        _split_aliases.cache_clear()
+
+        results = {}
+        for name, to_entity in (("fresh objects", legacy_fill), ("interned", StoredCardFill.to_entity_fill)):
+            fills, build_seconds, allocated = _build(stored_fills, to_entity)
+            results[name] = (build_seconds, allocated, _aggregate(fills))
+            del fills
+
+    print(f"fills: {args.fills}, users: {args.users}")
+    for name, (build_seconds, allocated, aggregate_seconds) in results.items():
+        print(
+            f"{name:14} build {build_seconds * 1000:7.1f} ms, {allocated / 2**20:6.1f} MiB, "
+            f"aggregate {aggregate_seconds * 1000:6.1f} ms"
+        )
+    (before_build, before_bytes, before_agg), (after_build, after_bytes, after_agg) = results.values()
+    print(f"memory: {before_bytes / after_bytes:.1f}x less, aggregation: {before_agg / after_agg:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares get_monthly_report_by_category with the original implementation that
+loaded every fill of the year and summed in Python.
+
+    python -m benchmarks.monthly_report_by_category --fills 100000
+"""
+
+import argparse
+import time
+from collections import defaultdict
+from sqlalchemy import extract
+from model import StoredCardFill
+from services.card_fill_service import CardFillService
+from entities import Month, Quarter, Category, FillScope, CategorySumOverPeriod
+from benchmarks.data import create_database
+
+
+def row_by_row_report(
+    service: CardFillService, months: list[Month], year: int, scope: FillScope
+) -> dict[Month, list[CategorySumOverPeriod]]:
+    """The report as it was computed before aggregation moved into SQL."""
+    with service.db_session() as db_session:
+        fills: list[StoredCardFill] = (
+            db_session.query(StoredCardFill)
+            .filter(StoredCardFill.fill_scope.in_([scope.scope_id]))
+            .filter(extract("year", StoredCardFill.fill_date) == year)
+            .all()
+        )
+
+        monthly_data: dict[Month, dict[Category, float]] = defaultdict(lambda: defaultdict(float))
+        quarter_data: dict[Quarter, dict[Category, float]] = defaultdict(lambda: defaultdict(float))
+        year_data: dict[Category, float] = defaultdict(float)
+        for fill in fills:
+            fill_month = Month(fill.fill_date.month)
+            fill_quarter = Quarter.from_month(fill_month)
+            fill_category = fill.category.to_entity_category()
+            monthly_data[fill_month][fill_category] += fill.amount
+            quarter_data[fill_quarter][fill_category] += fill.amount
+            year_data[fill_category] += fill.amount
+
+        ret: dict[Month, list[CategorySumOverPeriod]] = defaultdict(list)
+        budgets = {budget.category.code: budget for budget in service.list_budgets(scope)}
+        for month in months:
+            quarter = Quarter.from_month(month)
+            for category in year_data.keys():
+                budget = budgets.get(category.code)
+                ret[month].append(
+                    CategorySumOverPeriod(
+                        category=category,
+                        month=month,
+                        quarter=quarter,
+                        year=year,
+                        amount=monthly_data[month].get(category, 0),
+                        monthly_limit=budget.monthly_limit if budget else None,
+                        quarter_amount=quarter_data[quarter].get(category, 0),
+                        quarter_limit=budget.quarter_limit if budget else None,
+                        year_amount=year_data.get(category, 0),
+                        year_limit=budget.year_limit if budget else None,
+                    )
+                )
+        return ret
+
+
+def _best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def _assert_same(expected: dict, actual: dict) -> None:
+    assert expected.keys() == actual.keys()
+    for month, rows in expected.items():
+        actual_by_code = {r.category.code: r for r in actual[month]}
+        assert {r.category.code for r in rows} == actual_by_code.keys()
+        for e in rows:
+            a = actual_by_code[e.category.code]
+            for field in ("amount", "quarter_amount", "year_amount"):
+                assert abs(getattr(e, field) - getattr(a, field)) < 1e-6, (month, e.category.code, field)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fills", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args, _ = parser.parse_known_args()
+
+    year = 2024
+    months = [Month.march]
+    scope = FillScope(scope_id=1, scope_type="GROUP", chat_id=-1)
+    service = CardFillService(db_engine=create_database(args.fills, year=year))
+
+    _assert_same(row_by_row_report(service, months, year, scope), service.get_monthly_report_by_category(months, year, scope))
+
+    before = _best_of(args.repeat, lambda: row_by_row_report(service, months, year, scope))
+    after = _best_of(args.repeat, lambda: service.get_monthly_report_by_category(months, year, scope))
+    print(f"fills: {args.fills}")
+    print(f"row by row:  {before * 1000:.1f} ms")
+    print(f"current:     {after * 1000:.1f} ms")
+    print(f"speedup:     {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
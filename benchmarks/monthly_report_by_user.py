@@ -0,0 +1,122 @@
+"""
+Compares get_monthly_report_by_user and get_debt_monthly_report_by_user with the
+original implementations, which loaded every fill of the months as an ORM object
+and lazy-loaded its user before summing in Python.
+
+    python -m benchmarks.monthly_report_by_user --fills 100000 --users 50
+"""
+
+import argparse
+import time
+from collections import defaultdict
+from sqlalchemy import event, extract
+from model import StoredCardFill
+from services.card_fill_service import CardFillService
+from entities import Month, User, FillScope, UserSumOverPeriod, UserSumOverPeriodWithBalance
+from benchmarks.data import create_database
+
+
+def _row_by_row_sums(service: CardFillService, months: list[Month], year: int, filters: list) -> dict[Month, dict[User, float]]:
+    with service.db_session() as db_session:
+        fills: list[StoredCardFill] = (
+            db_session.query(StoredCardFill)
+            .filter(*filters)
+            .filter(extract("year", StoredCardFill.fill_date) == year)
+            .filter(extract("month", StoredCardFill.fill_date).in_([m.value for m in months]))
+            .all()
+        )
+        data: dict[Month, dict[User, float]] = defaultdict(lambda: defaultdict(float))
+        for fill in fills:
+            data[Month(fill.fill_date.month)][fill.user.to_entity_user()] += fill.amount
+        return data
+
+
+def row_by_row_report(
+    service: CardFillService, months: list[Month], year: int, scope: FillScope
+) -> dict[Month, list[UserSumOverPeriod]]:
+    """get_monthly_report_by_user as it was before aggregation moved into SQL."""
+    data = _row_by_row_sums(service, months, year, [StoredCardFill.fill_scope.in_([scope.scope_id])])
+    ret: dict[Month, list[UserSumOverPeriod]] = defaultdict(list)
+    for month, mdata in data.items():
+        for user, amount in mdata.items():
+            ret[month].append(UserSumOverPeriod(user=user, amount=amount))
+    return ret
+
+
+def row_by_row_debt_report(
+    service: CardFillService, months: list[Month], year: int, scope: FillScope
+) -> dict[Month, list[UserSumOverPeriodWithBalance]]:
+    """get_debt_monthly_report_by_user as it was before aggregation moved into SQL."""
+    data = _row_by_row_sums(
+        service, months, year, [StoredCardFill.fill_scope == scope.scope_id, StoredCardFill.is_netted.is_(False)]
+    )
+    ret: dict[Month, list[UserSumOverPeriodWithBalance]] = defaultdict(list)
+    for month, mdata in data.items():
+        month_total = sum(mdata.values())
+        for user, amount in mdata.items():
+            ret[month].append(
+                UserSumOverPeriodWithBalance(user=user, amount=amount, balance=amount - month_total / len(mdata))
+            )
+    return ret
+
+
+def _measure(engine, repeat: int, fn) -> tuple[float, int]:
+    """Best wall time of repeat runs and the number of statements one run executes."""
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", count)
+    fn()
+    event.remove(engine, "before_cursor_execute", count)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), len(statements)
+
+
+def _assert_same(expected: dict, actual: dict) -> None:
+    assert expected.keys() == actual.keys()
+    for month, rows in expected.items():
+        actual_by_user = {r.user.id: r for r in actual[month]}
+        assert {r.user.id for r in rows} == actual_by_user.keys()
+        for e in rows:
+            a = actual_by_user[e.user.id]
+            assert abs(e.amount - a.amount) < 1e-6, (month, e.user.id)
+            if isinstance(e, UserSumOverPeriodWithBalance):
+                assert abs(e.balance - a.balance) < 1e-6, (month, e.user.id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fills", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args, _ = parser.parse_known_args()
+
+    year = 2024
+    months = [Month.february, Month.march, Month.april]
+    scope = FillScope(scope_id=1, scope_type="GROUP", chat_id=-1)
+    engine = create_database(args.fills, year=year, users=args.users)
+    service = CardFillService(db_engine=engine)
+
+    print(f"fills: {args.fills}, users: {args.users}, months: {len(months)}")
+    for name, before_fn, after_fn in (
+        ("by user", row_by_row_report, service.get_monthly_report_by_user),
+        ("debt", row_by_row_debt_report, service.get_debt_monthly_report_by_user),
+    ):
+        _assert_same(before_fn(service, months, year, scope), after_fn(months, year, scope))
+        before, before_queries = _measure(engine, args.repeat, lambda: before_fn(service, months, year, scope))
+        after, after_queries = _measure(engine, args.repeat, lambda: after_fn(months, year, scope))
+        print(f"{name}:")
+        print(f"  row by row:  {before * 1000:.1f} ms, {before_queries} queries")
+        print(f"  current:     {after * 1000:.1f} ms, {after_queries} queries")
+        print(f"  speedup:     {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
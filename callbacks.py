@@ -21,3 +21,7 @@ class Callback(Enum):
 
 class ChangeCategoryCallback(CallbackData, prefix="change_category"):
     category_code: str
+
+
+class DeleteListedFillCallback(CallbackData, prefix="delete_listed_fill"):
+    fill_id: int
@@ -9,6 +9,7 @@ from parsers.month import MonthMessage, MonthMessageParser
 from parsers.fill import (
     FillMessage,
     FillMessageParser,
+    MultiFillMessage,
     NetBalancesMessage,
     NetBalancesMessageParser,
 )
@@ -17,10 +18,13 @@ from parsers.command import ServiceCommandMessage, ServiceCommandMessageParser
 from handlers.base import BaseMessageHandler, BaseCallbackHandler
 from handlers.fill import (
     FillMessageHandler,
+    MultiFillMessageHandler,
     NetBalancesMessageHandler,
     ShowCategoryCallbackHandler,
     ChangeCategoryCallbackHandler,
     DeleteFillCallbackHandler,
+    DeleteListedFillCallbackHandler,
+    FillIngestWorker,
 )
 from handlers.months import MonthsMessageHandler
 from handlers.report import (
@@ -32,13 +36,16 @@ from handlers.report import (
 )
 from handlers.budget import BudgetMessageHandler
 from handlers.command import ServiceCommandMessageHandler
+from handlers.middleware import SqlStatsMiddleware, HandlerNameMiddleware
 from parsers.income import IncomeMessage, IncomeMessageParser
 from handlers.income import IncomeMessageHandler, DeleteIncomeCallbackHandler
+from services.bounded_executor import ExecutorOverloadedError
 
 
 class CardFillingBot:
     message_handlers: dict[ParsedMessage, Type[BaseMessageHandler]] = {
         FillMessage: FillMessageHandler,
+        MultiFillMessage: MultiFillMessageHandler,
         IncomeMessage: IncomeMessageHandler,
         MonthMessage: MonthsMessageHandler,
         NetBalancesMessage: NetBalancesMessageHandler,
@@ -50,6 +57,7 @@ class CardFillingBot:
         ShowCategoryCallbackHandler,
         ChangeCategoryCallbackHandler,
         DeleteFillCallbackHandler,
+        DeleteListedFillCallbackHandler,
         DeleteIncomeCallbackHandler,
         MyFillsCurrentYearCallbackHandler,
         MyIncomeCurrentYearCallbackHandler,
@@ -61,11 +69,18 @@ class CardFillingBot:
     def __init__(self, app: App) -> None:
         self.app = app
         self.message_parsers = self._init_message_parsers(self.app)
+        self.app.dp.update.outer_middleware(SqlStatsMiddleware(self.app.sql_stats))
         self.app.dp.callback_query.middleware(CallbackAnswerMiddleware())
+        self.app.dp.callback_query.middleware(HandlerNameMiddleware(self.app.sql_stats))
         self.app.dp.message()(self.message_handler)
         self._register_callback_handlers(self.app)
+        self._fill_ingest_task: Optional[asyncio.Task] = None
+        self._reference_data_task: Optional[asyncio.Task] = None
 
     async def start(self) -> None:
+        self._reference_data_task = asyncio.create_task(self.app.refresh_reference_data())
+        if self.app.fill_ingest_queue is not None:
+            self._fill_ingest_task = asyncio.create_task(FillIngestWorker(self.app).run())
         await self.app.start()
 
     @property
@@ -79,11 +94,11 @@ class CardFillingBot:
     @classmethod
     def _init_message_parsers(cls, app: App) -> list[MessageParser]:
         return [
-            IncomeMessageParser(app.card_fill_service),
-            FillMessageParser(app.card_fill_service),
+            IncomeMessageParser(app.sync_card_fill_service),
+            FillMessageParser(app.sync_card_fill_service),
             MonthMessageParser(),
-            NetBalancesMessageParser(app.card_fill_service),
-            BudgetMessageParser(app.card_fill_service),
+            NetBalancesMessageParser(app.sync_card_fill_service),
+            BudgetMessageParser(app.sync_card_fill_service),
             ServiceCommandMessageParser(),
         ]
 
@@ -102,6 +117,11 @@ class CardFillingBot:
             ),
         )
 
+    async def overloaded_handler(self, message: Message) -> None:
+        await self.bot.send_message(
+            chat_id=message.chat.id, text="Бот перегружен. Повторите через минуту."
+        )
+
     async def error_handler(self, message: Message) -> None:
         await self.bot.send_message(
             chat_id=message.chat.id, text="Произошла ошибка обработки. Попробуйте позже."
@@ -112,13 +132,18 @@ class CardFillingBot:
         for parser in self.message_parsers:
             parsed_message: Optional[ParsedMessage] = None
             try:
-                parsed_message = parser.parse(message)
+                parsed_message = await self.app.db_executor.run(parser.parse, message)
+            except ExecutorOverloadedError:
+                self.logger.warning(f"Parsing dropped: {self.app.executor_stats()}")
+                await self.overloaded_handler(message)
+                return
             except:
                 self.logger.exception(f"Parser {parser} failed")
 
             if parsed_message:
                 self.logger.info(f"Handling message {parsed_message}")
                 handler_cls = self.message_handlers[type(parsed_message)]
+                self.app.sql_stats.name_handler(handler_cls.__name__)
                 try:
                     await handler_cls(app).handle(parsed_message)
                 except:
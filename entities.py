@@ -1,6 +1,7 @@
-from typing import Optional, TypeVar
+from typing import ClassVar, Optional, TypeVar
 from dataclasses import dataclass
-from datetime import datetime
+from weakref import WeakValueDictionary
+from datetime import datetime, date
 from enum import Enum, unique
 from emoji import emojize
 from aiogram.types import User as TelegramapiUser
@@ -15,6 +16,52 @@ class AppMode(Enum):
 @unique
 class ServiceCommandType(Enum):
     DUMP = 'dump'
+    IMPORT = 'import'
+    STATS = 'stats'
+
+
+@unique
+class DumpTable(Enum):
+    FILLS = 'fills'
+    INCOME = 'income'
+
+
+@dataclass(frozen=True)
+class DumpOptions:
+    tables: tuple[DumpTable, ...]
+    scope_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+
+@dataclass(frozen=True)
+class ImportOptions:
+    mapping: Optional[str] = None
+    scope_id: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class ImportedFill:
+    line: int
+    scope_id: int
+    user_id: int
+    fill_date: datetime
+    amount: float
+    description: str
+    currency: Optional[str] = None
+    category_code: Optional[str] = None
+    is_netted: bool = False
+
+
+@dataclass(frozen=True)
+class ImportReport:
+    processed: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    skipped: int = 0
+    duplicate_lines: tuple[int, ...] = ()
+    errors: tuple[tuple[int, str], ...] = ()
 
 
 @unique
@@ -76,21 +123,55 @@ class Quarter(Enum):
                 raise ValueError(f'Unexpected month value {month}')
 
 
-@dataclass(frozen=True)
+# FillScope, Category and User are slotted and hashed by primary key. Their interned()
+# factories hand out one shared instance per key for as long as it is referenced anywhere,
+# so report rows for the same category or user share it and dict lookups hit the identity
+# check. A row whose other fields changed replaces the shared instance.
+
+
+@dataclass(frozen=True, slots=True, weakref_slot=True)
 class FillScope:
     scope_id: Optional[int]
     scope_type: str
     chat_id: int
     report_scopes: Optional[list[int]] = None
 
+    _interned: ClassVar[WeakValueDictionary] = WeakValueDictionary()
 
-@dataclass(frozen=True)
+    def __hash__(self) -> int:
+        return hash(self.scope_id)
+
+    @classmethod
+    def interned(
+        cls, scope_id: int, scope_type: str, chat_id: int, report_scopes: Optional[list[int]] = None
+    ) -> 'FillScope':
+        scope = cls._interned.get(scope_id)
+        if scope is None or (scope.scope_type, scope.chat_id, scope.report_scopes) != (scope_type, chat_id, report_scopes):
+            scope = cls(scope_id=scope_id, scope_type=scope_type, chat_id=chat_id, report_scopes=report_scopes)
+            cls._interned[scope_id] = scope
+        return scope
+
+
+@dataclass(frozen=True, slots=True, weakref_slot=True)
 class Category:
     code: str
     name: str
     aliases: tuple[str]
     emoji_name: str
 
+    _interned: ClassVar[WeakValueDictionary] = WeakValueDictionary()
+
+    def __hash__(self) -> int:
+        return hash(self.code)
+
+    @classmethod
+    def interned(cls, code: str, name: str, aliases: tuple[str], emoji_name: str) -> 'Category':
+        category = cls._interned.get(code)
+        if category is None or (category.name, category.aliases, category.emoji_name) != (name, aliases, emoji_name):
+            category = cls(code=code, name=name, aliases=aliases, emoji_name=emoji_name)
+            cls._interned[code] = category
+        return category
+
     def get_emoji(self) -> str:
         return emojize(self.emoji_name)
 
@@ -98,14 +179,44 @@ class Category:
 TUser = TypeVar('TUser', bound='User')
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True, weakref_slot=True)
 class User:
     id: int
     is_bot: bool
     first_name: str
-    last_name: str
-    username: str
-    language_code: str
+    last_name: Optional[str]
+    username: Optional[str]
+    language_code: Optional[str]
+
+    _interned: ClassVar[WeakValueDictionary] = WeakValueDictionary()
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    @classmethod
+    def interned(
+        cls,
+        id: int,
+        is_bot: bool,
+        first_name: str,
+        last_name: Optional[str],
+        username: Optional[str],
+        language_code: Optional[str],
+    ) -> 'User':
+        user = cls._interned.get(id)
+        if user is None or (user.is_bot, user.first_name, user.last_name, user.username, user.language_code) != (
+            is_bot, first_name, last_name, username, language_code
+        ):
+            user = cls(
+                id=id,
+                is_bot=is_bot,
+                first_name=first_name,
+                last_name=last_name,
+                username=username,
+                language_code=language_code,
+            )
+            cls._interned[id] = user
+        return user
 
     @classmethod
     def from_telegramapi(cls: TUser, telegramapi_user: TelegramapiUser) -> TUser:
@@ -190,6 +301,35 @@ class CategorySumOverPeriod:
     year_limit: Optional[float]
 
 
+@dataclass(frozen=True)
+class FillBudgetStatus:
+    fill: Fill
+    budget: Optional[Budget]
+    usage: CategorySumOverPeriod
+
+
+@dataclass(frozen=True)
+class RollupDrift:
+    scope_id: int
+    year: int
+    month: int
+    category_code: str
+    user_id: int
+    is_netted: bool
+    expected_amount: float
+    actual_amount: float
+    expected_count: int
+    actual_count: int
+
+
+@dataclass(frozen=True)
+class NettingBatch:
+    batch_id: Optional[str]
+    scope_id: int
+    netted_at: datetime
+    fill_count: int
+
+
 @dataclass(frozen=True)
 class SummaryOverPeriod:
     by_user: tuple[UserSumOverPeriod]
@@ -13,7 +13,9 @@ from entities import (
     Budget,
     UserSumOverPeriodWithBalance,
     Income,
+    ImportReport,
 )
+from services.sql_stats import HandlerStats, StatementStats
 
 
 month_names = {
@@ -258,17 +260,83 @@ def format_monthly_report_group(
 
 
 def format_fill_confirmed(
-    fill: Fill, budget: Optional[Budget], current_category_usage: Optional[float]
+    fill: Fill, budget: Optional[Budget], current_category_usage: Optional[CategorySumOverPeriod]
 ) -> str:
     reply_text = f"Принято {fill.amount} {BASE_CURRENCY_ALIAS}. от @{fill.user.username}"
     if fill.description:
         reply_text += f": {fill.description}"
     reply_text += f", категория: {fill.category.get_emoji()} {fill.category.name}."
-    limit = None
-    if budget:
-        limit = budget.monthly_limit or budget.quarter_limit or budget.year_limit
-        if limit:
-            reply_text += f"\nИспользовано {current_category_usage.amount:.0f} из {limit:.0f}."
+    if budget and current_category_usage:
+        # usage is compared with the limit of the same period: month, else quarter, else year
+        for limit, used in (
+            (budget.monthly_limit, current_category_usage.amount),
+            (budget.quarter_limit, current_category_usage.quarter_amount),
+            (budget.year_limit, current_category_usage.year_amount),
+        ):
+            if limit:
+                reply_text += f"\nИспользовано {used:.0f} из {limit:.0f}."
+                break
+    return reply_text
+
+
+def format_fill_queued(fill: Fill) -> str:
+    currency = fill.currency.value if fill.currency else f"{BASE_CURRENCY_ALIAS}."
+    reply_text = f"Принято {fill.amount} {currency} от @{fill.user.username}"
+    if fill.description:
+        reply_text += f": {fill.description}"
+    return reply_text + ". Сохраняю..."
+
+
+def format_fill_not_saved(fill: Fill) -> str:
+    reply_text = f"Не удалось сохранить запись {fill.amount}"
+    if fill.description:
+        reply_text += f" ({fill.description})"
+    return reply_text + ". Отправьте ее еще раз."
+
+
+def format_fills_confirmed(fills: list[Fill]) -> str:
+    if not fills:
+        return "Все записи удалены."
+    reply_text = f"Принято записей: {len(fills)} от @{fills[0].user.username}"
+    for fill in fills:
+        reply_text += f"\n{fill.category.get_emoji()} {fill.amount} {BASE_CURRENCY_ALIAS}."
+        if fill.description:
+            reply_text += f" {fill.description}"
+    reply_text += f"\nИтого: {sum(fill.amount for fill in fills):.2f} {BASE_CURRENCY_ALIAS}."
+    return reply_text
+
+
+def format_import_report(report: ImportReport, done: bool = False) -> str:
+    reply_text = "Импорт завершен" if done else "Импорт..."
+    reply_text += (
+        f"\nСтрок обработано: {report.processed}, добавлено: {report.imported}, "
+        f"дубликатов: {report.duplicates}, с ошибками: {report.invalid}"
+    )
+    if report.skipped:
+        reply_text += f", пропущено: {report.skipped}"
+    if done and report.duplicate_lines:
+        reply_text += f"\nДубликаты в строках: {', '.join(map(str, report.duplicate_lines))}"
+        if report.duplicates > len(report.duplicate_lines):
+            reply_text += " ..."
+    if done:
+        for line, error in report.errors:
+            reply_text += f"\nСтрока {line}: {error}"
+    return reply_text
+
+
+def format_sql_stats(handlers: list[HandlerStats], statements: list[StatementStats]) -> str:
+    if not handlers and not statements:
+        return "Запросов пока не было"
+    reply_text = "Обработчики: обновлений, запросов (макс. за обновление), строк, мс в sql, мс на обновление (макс.)"
+    for h in handlers:
+        reply_text += (
+            f"\n{h.handler}: {h.updates}, {h.statements} ({h.max_statements}), {h.rows}, "
+            f"{h.sql_ms:.0f}, {h.update_avg_ms:.0f} ({h.update_max_ms:.0f})"
+        )
+    reply_text += "\n\nЗапросы: выполнений, строк, мс всего (макс.)"
+    for st in statements:
+        fingerprint = st.fingerprint if len(st.fingerprint) <= 200 else st.fingerprint[:200] + "..."
+        reply_text += f"\n{st.count}, {st.rows}, {st.total_ms:.0f} ({st.max_ms:.1f}): {fingerprint}"
     return reply_text
 
 
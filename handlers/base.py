@@ -20,6 +20,10 @@ class _BHandler:
     def card_fill_service(self):
         return self.app.card_fill_service
 
+    @property
+    def report_cache(self):
+        return self.app.report_cache
+
     @property
     def graph_service(self):
         return self.app.graph_service
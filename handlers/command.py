@@ -1,42 +1,151 @@
-import csv
-import io
-from aiogram.types import BufferedInputFile
+import asyncio
+import time
+from dataclasses import replace
+from tempfile import SpooledTemporaryFile
+from typing import IO, Callable, Optional
 from handlers.base import BaseMessageHandler
-from parsers.command import ServiceCommandType, ServiceCommandMessage
-from entities import Fill
+from parsers.command import (
+    ServiceCommandType,
+    ServiceCommandMessage,
+    DUMP_USAGE,
+    IMPORT_USAGE,
+    parse_dump_options,
+    parse_import_options,
+)
+from entities import DumpOptions, DumpTable, ImportReport, User
+from formatters import format_import_report, format_sql_stats
+from services.csv_export import SpooledInputFile, write_csv_gz
+from services.fill_import import IMPORT_REPORT_SAMPLE, FillImportReader, ImportMapping
 from settings import settings
 
 
+# Progress of an import is shown by editing one message at most this often, in seconds
+IMPORT_PROGRESS_INTERVAL = 3.0
+
+# /stats lists the statements with the most total time, a telegram message holds about ten of them
+STATS_TOP_STATEMENTS = 10
+
+
 class ServiceCommandMessageHandler(BaseMessageHandler[ServiceCommandMessage]):
     async def handle(self, message: ServiceCommandMessage) -> None:
+        if message.original_message.from_user.id != settings.admin_user_id:
+            await self.bot.send_message(
+                chat_id=message.original_message.chat.id,
+                text='No..',
+            )
+            return
         if message.data == ServiceCommandType.DUMP:
-            if message.original_message.from_user.id == settings.admin_user_id:
-                fills = self.card_fill_service.get_all_fills()
+            await self._handle_dump(message)
+        elif message.data == ServiceCommandType.IMPORT:
+            await self._handle_import(message)
+        elif message.data == ServiceCommandType.STATS:
+            await self._handle_stats(message)
+
+    async def _handle_dump(self, message: ServiceCommandMessage) -> None:
+        try:
+            options = parse_dump_options(message.arguments)
+        except ValueError:
+            await self.bot.send_message(
+                chat_id=message.original_message.chat.id,
+                text=f'Usage: {DUMP_USAGE}',
+            )
+            return
+        for table in options.tables:
+            # The export blocks on the database cursor, so it runs in the db executor
+            dump = await self.app.db_executor.run(self._dump, table, options)
+            try:
                 await self.bot.send_document(
                     chat_id=message.original_message.chat.id,
-                    document=BufferedInputFile(self._to_csv(fills), filename='dump.csv'),
-                )
-            else:
-                await self.bot.send_message(
-                    chat_id=message.original_message.chat.id,
-                    text='No..',
+                    document=SpooledInputFile(dump, filename=f'{table.value}.csv.gz'),
                 )
+            finally:
+                dump.close()
 
-    def _to_csv(self, fills: list[Fill]) -> bytes:
-        with io.StringIO() as iobuf:
-            writer = csv.writer(iobuf)
-            writer.writerow(('fill_id', 'scope_id', 'user_id', 'fill_date', 'amount', 'category_code', 'description', 'is_netted'))
-            for fill in fills:
-                writer.writerow(
-                    (
-                        fill.id,
-                        fill.scope.scope_id,
-                        fill.user.id,
-                        fill.fill_date.isoformat(),
-                        fill.amount,
-                        fill.category.code,
-                        fill.description,
-                        fill.is_netted,
-                    )
+    def _dump(self, table: DumpTable, options: DumpOptions) -> IO[bytes]:
+        card_fill_service = self.app.sync_card_fill_service
+        if table == DumpTable.FILLS:
+            columns = card_fill_service.FILL_EXPORT_COLUMNS
+            rows = card_fill_service.iter_fill_export_rows(options.scope_id, options.date_from, options.date_to)
+        else:
+            columns = card_fill_service.INCOME_EXPORT_COLUMNS
+            rows = card_fill_service.iter_income_export_rows(options.scope_id, options.date_from, options.date_to)
+        return write_csv_gz(columns, rows, settings.export_spool_max_size)
+
+    async def _handle_import(self, message: ServiceCommandMessage) -> None:
+        chat_id = message.original_message.chat.id
+        document = message.original_message.document
+        try:
+            options = parse_import_options(message.arguments)
+            if document is None:
+                raise ValueError('No file attached')
+            mapping = None
+            if options.mapping is not None:
+                mapping = ImportMapping.from_dict(settings.import_mappings[options.mapping])
+        except (ValueError, KeyError):
+            mappings = ', '.join(settings.import_mappings) or 'none configured'
+            await self.bot.send_message(chat_id=chat_id, text=f'Usage: {IMPORT_USAGE}\nMappings: {mappings}')
+            return
+
+        scope_id = options.scope_id
+        if scope_id is None and mapping is not None:
+            scope_id = (await self.card_fill_service.get_scope(chat_id)).scope_id
+        user = User.from_telegramapi(message.original_message.from_user)
+        progress_message = await self.bot.send_message(chat_id=chat_id, text=format_import_report(ImportReport()))
+        loop = asyncio.get_running_loop()
+        last_progress = time.monotonic()
+
+        def on_progress(report: ImportReport) -> None:
+            # Called from the db executor thread, so the edit is handed over to the event loop
+            nonlocal last_progress
+            if time.monotonic() - last_progress < IMPORT_PROGRESS_INTERVAL:
+                return
+            last_progress = time.monotonic()
+            asyncio.run_coroutine_threadsafe(
+                self.bot.edit_message_text(
+                    chat_id=chat_id, message_id=progress_message.message_id, text=format_import_report(report)
+                ),
+                loop,
+            )
+
+        with SpooledTemporaryFile(max_size=settings.export_spool_max_size) as file:
+            await self.bot.download(document, destination=file)
+            try:
+                report = await self.app.db_executor.run(self._import, file, mapping, scope_id, user, on_progress)
+            except ValueError as e:
+                await self.bot.edit_message_text(
+                    chat_id=chat_id, message_id=progress_message.message_id, text=f'Импорт не выполнен: {e}'
                 )
-            return iobuf.getvalue().encode()
+                return
+        await self.bot.edit_message_text(
+            chat_id=chat_id, message_id=progress_message.message_id, text=format_import_report(report, done=True)
+        )
+
+    def _import(
+        self,
+        file: IO[bytes],
+        mapping: Optional[ImportMapping],
+        scope_id: Optional[int],
+        user: User,
+        on_progress: Callable[[ImportReport], None],
+    ) -> ImportReport:
+        reader = FillImportReader(file, mapping, scope_id, user.id if mapping is not None else None)
+        report = self.app.sync_card_fill_service.import_fills(
+            reader, users=[user] if mapping is not None else (), on_progress=on_progress
+        )
+        # Rows the reader could not parse or skipped never reach the service
+        return replace(
+            report,
+            processed=report.processed + reader.invalid + reader.skipped,
+            invalid=report.invalid + reader.invalid,
+            skipped=reader.skipped,
+            errors=tuple(sorted(reader.errors + list(report.errors)))[:IMPORT_REPORT_SAMPLE],
+        )
+
+    async def _handle_stats(self, message: ServiceCommandMessage) -> None:
+        sql_stats = self.app.sql_stats
+        await self.bot.send_message(
+            chat_id=message.original_message.chat.id,
+            text=format_sql_stats(sql_stats.handler_stats(), sql_stats.statement_stats(limit=STATS_TOP_STATEMENTS)),
+        )
+        if 'reset' in message.arguments:
+            sql_stats.reset()
@@ -1,43 +1,185 @@
-from typing import Any, Optional
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from handlers.base import BaseMessageHandler, BaseCallbackHandler
-from parsers.fill import FillMessage, NetBalancesMessage
-from formatters import format_fill_confirmed
-from callbacks import ChangeCategoryCallback, Callback
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, ClassVar, Optional
+import redis
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
+from handlers.base import BaseMessageHandler, BaseCallbackHandler, _BHandler
+from parsers.fill import FillMessage, MultiFillMessage, NetBalancesMessage
+from formatters import (
+    format_fill_confirmed,
+    format_fill_not_saved,
+    format_fill_queued,
+    format_fills_confirmed,
+    RED_CROSS,
+)
+from callbacks import ChangeCategoryCallback, DeleteListedFillCallback, Callback
+from entities import Fill
+from services.card_fill_service import FillBudgetStatus
+from services.bounded_executor import ExecutorOverloadedError
+from services.fill_ingest_queue import QueuedFill
+from services.reference_data_cache import CategorySnapshot
+from settings import settings
+
+
+def _fill_keyboard() -> InlineKeyboardMarkup:
+    change_category_button = InlineKeyboardButton(
+        text="Сменить категорию", callback_data=Callback.SHOW_CATEGORY.value
+    )
+    delete_fill_button = InlineKeyboardButton(
+        text="Удалить", callback_data=Callback.DELETE_FILL.value
+    )
+    return InlineKeyboardMarkup(inline_keyboard=[[change_category_button], [delete_fill_button]])
 
 
 class FillMessageHandler(BaseMessageHandler[FillMessage]):
     async def handle(self, message: FillMessage) -> None:
-        fill = message.data
-        fill = self.card_fill_service.handle_new_fill(fill)
-        budget = self.card_fill_service.get_budget_for_category(fill.category, fill.scope)
-        current_category_usage = (
-            self.card_fill_service.get_current_budget_usage_for_category(
-                fill.category, fill.scope
+        chat_id = message.original_message.chat.id
+        provisional_message: Optional[Message] = None
+        if self.app.fill_ingest_queue is not None:
+            queue = self.app.fill_ingest_queue
+            key = f"{chat_id}_{message.original_message.message_id}"
+            try:
+                claimed = await self.app.redis_executor.run(queue.claim_key, key)
+            except (redis.RedisError, ExecutorOverloadedError):
+                self.app.logger.exception("Could not claim fill key, saving the fill right away")
+            else:
+                if not claimed:
+                    return  # the same update delivered again, its fill is queued already
+                try:
+                    provisional_message = await self.bot.send_message(
+                        chat_id=chat_id, text=format_fill_queued(message.data)
+                    )
+                    await self.app.redis_executor.run(
+                        queue.enqueue, key, message.data, chat_id, provisional_message.message_id
+                    )
+                    return
+                except Exception as e:
+                    # A claim without a queued fill would make a redelivered update look like a duplicate
+                    await self._release_claim(key)
+                    if not isinstance(e, (redis.RedisError, ExecutorOverloadedError)):
+                        raise
+                    self.app.logger.exception("Could not queue fill, saving it right away")
+
+        status = await self.card_fill_service.handle_new_fill_with_budget_status(message.data)
+        fill = status.fill
+        reply_text = format_fill_confirmed(fill, status.budget, status.usage)
+
+        if provisional_message is None:
+            sent_message = await self.bot.send_message(chat_id=chat_id, text=reply_text, reply_markup=_fill_keyboard())
+        else:
+            sent_message = await self.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=provisional_message.message_id,
+                text=reply_text,
+                reply_markup=_fill_keyboard(),
             )
-        )
-        reply_text = format_fill_confirmed(fill, budget, current_category_usage)
+        await self.cache_service.set_fill_for_message(sent_message, fill)
+
+    async def _release_claim(self, key: str) -> None:
+        try:
+            await self.app.redis_executor.run(self.app.fill_ingest_queue.release_key, key)
+        except (redis.RedisError, ExecutorOverloadedError):
+            self.app.logger.exception(f"Could not release fill key {key}, a redelivered update will be dropped")
 
-        change_category_button = InlineKeyboardButton(
-            text="Сменить категорию", callback_data=Callback.SHOW_CATEGORY.value
-        )
-        delete_fill_button = InlineKeyboardButton(
-            text="Удалить", callback_data=Callback.DELETE_FILL.value
-        )
 
-        inline_keyboard = [[change_category_button], [delete_fill_button]]
+class FillIngestWorker(_BHandler):
+    """Saves fills queued by FillMessageHandler in write-behind mode and edits their confirmations."""
+
+    async def run(self) -> None:
+        queue = self.app.fill_ingest_queue
+        await self.app.redis_executor.run(queue.ensure_group)
+        purged_at = 0.0
+        while True:
+            if time.monotonic() - purged_at >= settings.fill_ingest_key_purge_interval:
+                purged_at = time.monotonic()
+                try:
+                    await self.card_fill_service.purge_ingest_keys(timedelta(seconds=settings.fill_ingest_key_ttl))
+                except Exception:
+                    self.app.logger.exception("Could not purge fill ingest keys")
+            try:
+                saved = await self.process_batch()
+            except Exception:
+                self.app.logger.exception("Fill ingest batch failed")
+                saved = 0
+            if not saved:
+                await asyncio.sleep(settings.fill_queue_poll_interval)
+
+    async def process_batch(self) -> int:
+        queue = self.app.fill_ingest_queue
+        entries = await self.app.redis_executor.run(queue.read, settings.fill_queue_batch_size)
+        if not entries:
+            return 0
+        statuses = await self._save(entries)
+        saved = [entry for entry in entries if entry.key in statuses]
+        for entry in saved:
+            status = statuses[entry.key]
+            if status is None:
+                continue  # saved by an earlier delivery and deleted since
+            try:
+                message = await self.bot.edit_message_text(
+                    chat_id=entry.chat_id,
+                    message_id=entry.message_id,
+                    text=format_fill_confirmed(status.fill, status.budget, status.usage),
+                    reply_markup=_fill_keyboard(),
+                )
+                await self.cache_service.set_fill_for_message(message, status.fill)
+            except Exception:
+                self.app.logger.exception(f"Could not confirm queued fill {entry.key}")
+        await self.app.redis_executor.run(queue.ack, saved)
+        return len(saved)
+
+    async def _save(self, entries: list[QueuedFill]) -> dict[str, Optional[FillBudgetStatus]]:
+        """Statuses of saved entries; a failed batch is retried one entry at a time so a bad fill fails alone."""
+        try:
+            return await self.card_fill_service.ingest_fills([(entry.key, entry.fill) for entry in entries])
+        except Exception as e:
+            if len(entries) > 1:
+                self.app.logger.warning(f"Saving {len(entries)} queued fills failed, saving them one by one: {e!r}")
+                statuses: dict[str, Optional[FillBudgetStatus]] = {}
+                for entry in entries:
+                    statuses.update(await self._save([entry]))
+                return statuses
+            self.app.logger.exception(f"Could not save queued fill {entries[0].key}")
+            for entry in await self.app.redis_executor.run(self.app.fill_ingest_queue.fail, entries, repr(e)):
+                try:
+                    await self.bot.edit_message_text(
+                        chat_id=entry.chat_id, message_id=entry.message_id, text=format_fill_not_saved(entry.fill)
+                    )
+                except Exception:
+                    self.app.logger.exception(f"Could not report dead fill {entry.key}")
+            return {}
+
+
+def _delete_listed_fill_keyboard(fills: list[Fill]) -> Optional[InlineKeyboardMarkup]:
+    """One delete button per fill of a multi-fill summary."""
+    if not fills:
+        return None
+    inline_keyboard = []
+    for fill in fills:
+        text = f"{RED_CROSS} {fill.amount}"
+        if fill.description:
+            text += f" {fill.description[:24]}"
+        inline_keyboard.append(
+            [InlineKeyboardButton(text=text, callback_data=DeleteListedFillCallback(fill_id=fill.id).pack())]
+        )
+    return InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
+class MultiFillMessageHandler(BaseMessageHandler[MultiFillMessage]):
+    async def handle(self, message: MultiFillMessage) -> None:
+        fills = await self.card_fill_service.handle_new_fills(message.data)
         sent_message = await self.bot.send_message(
-            chat_id=message.original_message.chat.id, text=reply_text, reply_markup=keyboard
+            chat_id=message.original_message.chat.id,
+            text=format_fills_confirmed(fills),
+            reply_markup=_delete_listed_fill_keyboard(fills),
         )
-        self.cache_service.set_fill_for_message(sent_message, fill)
+        await self.cache_service.set_fills_for_message(sent_message, fills)
 
 
 class NetBalancesMessageHandler(BaseMessageHandler[NetBalancesMessage]):
     async def handle(self, message: NetBalancesMessage) -> None:
-        self.card_fill_service.net_balances(message.data)
+        await self.card_fill_service.net_balances(message.data)
         await self.bot.send_message(
             chat_id=message.original_message.chat.id,
             text="Текущие траты исключены из расчета баланса",
@@ -45,10 +187,16 @@ class NetBalancesMessageHandler(BaseMessageHandler[NetBalancesMessage]):
 
 
 class ShowCategoryCallbackHandler(BaseCallbackHandler, callback=Callback.SHOW_CATEGORY):
-    async def handle(self, callback: CallbackQuery, callback_data: Optional[Any] = None) -> None:
-        fill = self.cache_service.get_fill_for_message(callback.message)
-        categories = self.card_fill_service.list_categories()
+    # Keyboard built from the last category snapshot, rebuilt when the snapshot changes
+    _keyboard: ClassVar[Optional[tuple[CategorySnapshot, InlineKeyboardMarkup]]] = None
+
+    @classmethod
+    def _category_keyboard(cls, snapshot: CategorySnapshot) -> InlineKeyboardMarkup:
+        cached = cls._keyboard
+        if cached is not None and cached[0] is snapshot:
+            return cached[1]
 
+        categories = snapshot.categories
         keyboard_buttons = []
         buttons_per_row = 2
         for i in range(0, len(categories), buttons_per_row):
@@ -62,6 +210,13 @@ class ShowCategoryCallbackHandler(BaseCallbackHandler, callback=Callback.SHOW_CA
                 )
             keyboard_buttons.append(buttons_group)
         keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+        cls._keyboard = (snapshot, keyboard)
+        return keyboard
+
+    async def handle(self, callback: CallbackQuery, callback_data: Optional[Any] = None) -> None:
+        fill = await self.cache_service.get_fill_for_message(callback.message)
+        snapshot = await self.card_fill_service.get_category_snapshot()
+        keyboard = self._category_keyboard(snapshot)
 
         reply_text = (
             f"Принято {fill.amount} от @{fill.user.username}.\nВыберите категорию"
@@ -81,44 +236,49 @@ class ShowCategoryCallbackHandler(BaseCallbackHandler, callback=Callback.SHOW_CA
 class ChangeCategoryCallbackHandler(BaseCallbackHandler, callback=ChangeCategoryCallback):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
         assert isinstance(callback_data, ChangeCategoryCallback)
-        fill = self.cache_service.get_fill_for_message(callback.message)
-        fill = self.card_fill_service.change_category_for_fill(fill.id, callback_data.category_code)
-
-        budget = self.card_fill_service.get_budget_for_category(fill.category, fill.scope)
-        current_category_usage = (
-            self.card_fill_service.get_current_budget_usage_for_category(
-                fill.category, fill.scope
-            )
+        fill = await self.cache_service.get_fill_for_message(callback.message)
+        status = await self.card_fill_service.change_category_for_fill_with_budget_status(
+            fill.id, callback_data.category_code
         )
+        fill = status.fill
 
-        reply_text = format_fill_confirmed(fill, budget, current_category_usage)
-
-        change_category_button = InlineKeyboardButton(
-            text="Сменить категорию", callback_data=Callback.SHOW_CATEGORY.value
-        )
-        delete_fill_button = InlineKeyboardButton(
-            text="Удалить", callback_data=Callback.DELETE_FILL.value
-        )
-        inline_keyboard = [[change_category_button], [delete_fill_button]]
-
-        keyboard = InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
+        reply_text = format_fill_confirmed(fill, status.budget, status.usage)
 
         message = await self.bot.edit_message_text(
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id,
             text=reply_text,
-            reply_markup=keyboard,
+            reply_markup=_fill_keyboard(),
         )
-        self.cache_service.set_fill_for_message(message, fill)  # caching updated fill
+        await self.cache_service.set_fill_for_message(message, fill)  # caching updated fill
 
 
 class DeleteFillCallbackHandler(BaseCallbackHandler, callback=Callback.DELETE_FILL):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
-        fill = self.cache_service.get_fill_for_message(callback.message)
-        self.card_fill_service.delete_fill(fill)
+        fill = await self.cache_service.get_fill_for_message(callback.message)
+        await self.card_fill_service.delete_fill(fill)
         await self.bot.edit_message_text(
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id,
             text=f"Запись {fill.amount} ({fill.description}) удалена.",
             reply_markup=None,
         )
+
+
+class DeleteListedFillCallbackHandler(BaseCallbackHandler, callback=DeleteListedFillCallback):
+    async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
+        assert isinstance(callback_data, DeleteListedFillCallback)
+        fills = await self.cache_service.get_fills_for_message(callback.message) or []
+        # Only fills of this summary can be deleted from it, a repeated press finds nothing
+        fill = next((f for f in fills if f.id == callback_data.fill_id), None)
+        if fill is None:
+            return
+        await self.card_fill_service.delete_fill(fill)
+        remaining = [f for f in fills if f.id != fill.id]
+        message = await self.bot.edit_message_text(
+            chat_id=callback.message.chat.id,
+            message_id=callback.message.message_id,
+            text=format_fills_confirmed(remaining),
+            reply_markup=_delete_listed_fill_keyboard(remaining),
+        )
+        await self.cache_service.set_fills_for_message(message, remaining)
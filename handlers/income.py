@@ -9,7 +9,7 @@ from callbacks import Callback
 class IncomeMessageHandler(BaseMessageHandler[IncomeMessage]):
     async def handle(self, message: IncomeMessage) -> None:
         income = message.data
-        income = self.card_fill_service.handle_new_income(income)
+        income = await self.card_fill_service.handle_new_income(income)
         
         reply_text = format_income_confirmed(income)
 
@@ -25,13 +25,13 @@ class IncomeMessageHandler(BaseMessageHandler[IncomeMessage]):
             text=reply_text, 
             reply_markup=keyboard
         )
-        self.cache_service.set_income_for_message(sent_message, income)
+        await self.cache_service.set_income_for_message(sent_message, income)
 
 
 class DeleteIncomeCallbackHandler(BaseCallbackHandler, callback=Callback.DELETE_INCOME):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
-        income = self.cache_service.get_income_for_message(callback.message)
-        self.card_fill_service.delete_income(income)
+        income = await self.cache_service.get_income_for_message(callback.message)
+        await self.card_fill_service.delete_income(income)
         await self.bot.edit_message_text(
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id,
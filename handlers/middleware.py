@@ -0,0 +1,38 @@
+from typing import Any, Awaitable, Callable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from services.sql_stats import SqlStats
+
+
+class SqlStatsMiddleware(BaseMiddleware):
+    """Outer update middleware tracing the SQL each update runs, named after the event type until a handler is known."""
+
+    def __init__(self, sql_stats: SqlStats) -> None:
+        self.sql_stats = sql_stats
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        with self.sql_stats.track_update(event.update_id, event.event_type):
+            return await handler(event, data)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware naming the traced update after the class of the handler aiogram picked."""
+
+    def __init__(self, sql_stats: SqlStats) -> None:
+        self.sql_stats = sql_stats
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        owner = getattr(data["handler"].callback, "__self__", None)
+        if owner is not None:
+            self.sql_stats.name_handler(type(owner).__name__)
+        return await handler(event, data)
@@ -19,4 +19,4 @@ class MonthsMessageHandler(BaseMessageHandler[MonthMessage]):
             text=f'Выбраны месяцы: {", ".join(map(month_names.get, months))}. Какая информация интересует?',
             reply_markup=keyboard,
         )
-        self.cache_service.set_months_for_message(sent_message, months)
+        await self.cache_service.set_months_for_message(sent_message, months)
@@ -16,18 +16,19 @@ from formatters import (
     format_monthly_report_group,
     format_user_income,
 )
-from entities import User, FillScope
+from entities import User, FillScope, Month
+from services.report_cache import ReportSnapshot
 from settings import settings
 from callbacks import Callback
 
 
 class MyFillsCurrentYearCallbackHandler(BaseCallbackHandler, callback=Callback.MY_FILLS):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
-        months = self.cache_service.get_months_for_message(callback.message)
+        months = await self.cache_service.get_months_for_message(callback.message)
         year = datetime.now().year
         from_user = User.from_telegramapi(callback.from_user)
-        scope = self.card_fill_service.get_scope(callback.message.chat.id)
-        fills = self.card_fill_service.get_user_fills_in_months(from_user, months, year, scope)
+        scope = await self.card_fill_service.get_scope(callback.message.chat.id)
+        fills = await self.card_fill_service.get_user_fills_in_months(from_user, months, year, scope)
 
         message_text = format_user_fills(fills, from_user, months, year, scope)
         previous_year = InlineKeyboardButton(
@@ -46,11 +47,11 @@ class MyFillsCurrentYearCallbackHandler(BaseCallbackHandler, callback=Callback.M
 
 class MyFillsPreviousYearCallbackHandler(BaseCallbackHandler, callback=Callback.MY_FILLS_PREVIOUS_YEAR):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
-        months = self.cache_service.get_months_for_message(callback.message)
+        months = await self.cache_service.get_months_for_message(callback.message)
         previous_year = datetime.now().year - 1
         from_user = User.from_telegramapi(callback.from_user)
-        scope = self.card_fill_service.get_scope(callback.message.chat.id)
-        fills = self.card_fill_service.get_user_fills_in_months(
+        scope = await self.card_fill_service.get_scope(callback.message.chat.id)
+        fills = await self.card_fill_service.get_user_fills_in_months(
             from_user, months, previous_year, scope
         )
         message_text = format_user_fills(fills, from_user, months, previous_year, scope)
@@ -64,20 +65,20 @@ class MyFillsPreviousYearCallbackHandler(BaseCallbackHandler, callback=Callback.
 
 class PerMonthCurrentYearCallbackHandler(BaseCallbackHandler, callback=Callback.MONTHLY_REPORT):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
-        scope = self.card_fill_service.get_scope(callback.message.chat.id)
+        scope = await self.card_fill_service.get_scope(callback.message.chat.id)
         if scope.scope_id == settings.pay_silivri_scope_id:
             return await self._per_month_silivri(callback, scope)
         return await self._per_month_default(callback, scope)
 
     async def _per_month_silivri(self, callback: CallbackQuery, scope: FillScope) -> None:
-        months = self.cache_service.get_months_for_message(callback.message)
+        months = await self.cache_service.get_months_for_message(callback.message)
         year = datetime.now().year
-        data = self.card_fill_service.get_debt_monthly_report_by_user(months, year, scope)
+        data = await self.card_fill_service.get_debt_monthly_report_by_user(months, year, scope)
 
         message_text = format_monthly_report_group(data, year, scope)
         if len(months) == 1:
             month = months[0]
-            diagram = self.graph_service.create_by_user_diagram(
+            diagram = await self.graph_service.create_by_user_diagram(
                 data[month], name=f"{month_names[month]} {year}"
             )
             if diagram:
@@ -95,81 +96,89 @@ class PerMonthCurrentYearCallbackHandler(BaseCallbackHandler, callback=Callback.
                 )
 
     async def _per_month_default(self, callback: CallbackQuery, scope: FillScope) -> None:
-        months = self.cache_service.get_months_for_message(callback.message)
+        months = await self.cache_service.get_months_for_message(callback.message)
         year = datetime.now().year
-        data = self.card_fill_service.get_monthly_report(months, year, scope)
-        income_data = self.card_fill_service.get_income_monthly_report_by_user(months, year, scope)
+        snapshot = await _monthly_report_snapshot(self, months, year, scope)
 
-        message_text = format_monthly_report(data, year, scope, income_data)
         previous_year = InlineKeyboardButton(
             text="Предыдущий год", callback_data=Callback.MONTHLY_REPORT_PREVIOUS_YEAR.value
         )
         keyboard = InlineKeyboardMarkup(inline_keyboard=[[previous_year]])
 
-        if len(months) == 1:
-            month = months[0]
-            diagram = self.graph_service.create_by_category_diagram(
-                data[month].by_category, name=f"{month_names[month]} {year}"
+        if snapshot.diagram:
+            sent_message = await self.bot.send_photo(
+                callback.message.chat.id,
+                photo=BufferedInputFile(file=snapshot.diagram, filename=str(uuid4())),
+                caption=snapshot.text,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                reply_markup=keyboard,
             )
-            if diagram:
-                sent_message = await self.bot.send_photo(
-                    callback.message.chat.id,
-                    photo=BufferedInputFile(file=diagram, filename=str(uuid4())),
-                    caption=message_text,
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                    reply_markup=keyboard,
-                )
-                self.cache_service.set_months_for_message(sent_message, months)
-                return
-
-        sent_message = await self.bot.send_message(
-            chat_id=callback.message.chat.id,
-            text=message_text,
-            parse_mode=ParseMode.MARKDOWN_V2,
-            reply_markup=keyboard,
-        )
-        self.cache_service.set_months_for_message(sent_message, months)
+        else:
+            sent_message = await self.bot.send_message(
+                chat_id=callback.message.chat.id,
+                text=snapshot.text,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                reply_markup=keyboard,
+            )
+        await self.cache_service.set_months_for_message(sent_message, months)
 
 
 class PerMonthPreviousYearCallbackHandler(BaseCallbackHandler, callback=Callback.MONTHLY_REPORT_PREVIOUS_YEAR):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
-        months = self.cache_service.get_months_for_message(callback.message)
+        months = await self.cache_service.get_months_for_message(callback.message)
         previous_year = datetime.now().year - 1
-        scope = self.card_fill_service.get_scope(callback.message.chat.id)
-        data = self.card_fill_service.get_monthly_report(months, previous_year, scope)
-        income_data = self.card_fill_service.get_income_monthly_report_by_user(months, previous_year, scope)
-
-        message_text = format_monthly_report(data, previous_year, scope, income_data)
-        if len(months) == 1:
-            month = months[0]
-            diagram = self.graph_service.create_by_category_diagram(
-                data[month].by_category, name=f"{month_names[month]} {previous_year}"
+        scope = await self.card_fill_service.get_scope(callback.message.chat.id)
+        snapshot = await _monthly_report_snapshot(self, months, previous_year, scope)
+
+        if snapshot.diagram:
+            sent_message = await self.bot.send_photo(
+                callback.message.chat.id,
+                photo=BufferedInputFile(file=snapshot.diagram, filename=str(uuid4())),
+                caption=snapshot.text,
+                parse_mode=ParseMode.MARKDOWN_V2,
             )
-            if diagram:
-                sent_message = await self.bot.send_photo(
-                    callback.message.chat.id,
-                    photo=BufferedInputFile(file=diagram, filename=str(uuid4())),
-                    caption=message_text,
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                )
-                self.cache_service.set_months_for_message(sent_message, months)
-                return
-
-        sent_message = await self.bot.send_message(
-            chat_id=callback.message.chat.id,
-            text=message_text,
-            parse_mode=ParseMode.MARKDOWN_V2,
+        else:
+            sent_message = await self.bot.send_message(
+                chat_id=callback.message.chat.id,
+                text=snapshot.text,
+                parse_mode=ParseMode.MARKDOWN_V2,
+            )
+        await self.cache_service.set_months_for_message(sent_message, months)
+
+
+async def _monthly_report_snapshot(
+    handler: BaseCallbackHandler, months: list[Month], year: int, scope: FillScope
+) -> ReportSnapshot:
+    """Text and diagram of a monthly report, from the report cache when nothing changed since it was built."""
+    # Versions are read before the report is built, so a write landing meanwhile outdates it
+    key = await handler.report_cache.snapshot_key(scope, year, months)
+    if key is not None:
+        snapshot = await handler.report_cache.get(key)
+        if snapshot is not None:
+            return snapshot
+
+    data = await handler.card_fill_service.get_monthly_report(months, year, scope)
+    income_data = await handler.card_fill_service.get_income_monthly_report_by_user(months, year, scope)
+    message_text = format_monthly_report(data, year, scope, income_data)
+    diagram = None
+    if len(months) == 1:
+        month = months[0]
+        diagram = await handler.graph_service.create_by_category_diagram(
+            data[month].by_category, name=f"{month_names[month]} {year}"
         )
-        self.cache_service.set_months_for_message(sent_message, months)
+    snapshot = ReportSnapshot(text=message_text, diagram=diagram or None)
+    if key is not None:
+        await handler.report_cache.set(key, snapshot, year)
+    return snapshot
 
 
 class MyIncomeCurrentYearCallbackHandler(BaseCallbackHandler, callback=Callback.MY_INCOME):
     async def handle(self, callback: CallbackQuery, callback_data: Any | None = None) -> None:
-        months = self.cache_service.get_months_for_message(callback.message)
+        months = await self.cache_service.get_months_for_message(callback.message)
         year = datetime.now().year
         from_user = User.from_telegramapi(callback.from_user)
-        scope = self.card_fill_service.get_scope(callback.message.chat.id)
-        incomes = self.card_fill_service.get_user_income_in_months(from_user, months, year, scope)
+        scope = await self.card_fill_service.get_scope(callback.message.chat.id)
+        incomes = await self.card_fill_service.get_user_income_in_months(from_user, months, year, scope)
 
         message_text = format_user_income(incomes, from_user, months, year, scope)
         await self.bot.edit_message_text(
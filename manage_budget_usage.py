@@ -0,0 +1,21 @@
+import argparse
+import logging
+from services.cache_service import CacheService
+from services.card_fill_service import CardFillService
+from services.budget_usage_store import BudgetUsageStore
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the redis budget usage counters from card_fill_rollup")
+    parser.add_argument("--scope", type=int, action="append", dest="scope_ids", help="limit to scope id, repeatable")
+    parser.add_argument("--dotenv", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    card_fill_service = CardFillService(budget_usage=BudgetUsageStore(CacheService().rdb))
+    card_fill_service.reconcile_budget_usage(args.scope_ids)
+    print(f"Budget usage counters rebuilt for scopes {args.scope_ids or 'all'}")
+
+
+if __name__ == "__main__":
+    main()
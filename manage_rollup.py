@@ -0,0 +1,32 @@
+import argparse
+import logging
+from services.card_fill_service import CardFillService
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Verify or rebuild the card_fill_rollup table from card_fill")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--scope", type=int, action="append", dest="scope_ids", help="limit to scope id, repeatable")
+    parser.add_argument("--dotenv", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    card_fill_service = CardFillService()
+    if args.command == "verify":
+        drift = card_fill_service.verify_rollup(args.scope_ids)
+    else:
+        drift = card_fill_service.rebuild_rollup(args.scope_ids)
+
+    for d in drift:
+        print(
+            f"scope={d.scope_id} {d.year}-{d.month:02d} category={d.category_code} user={d.user_id} "
+            f"netted={d.is_netted}: expected {d.expected_amount:.2f}/{d.expected_count}, "
+            f"stored {d.actual_amount:.2f}/{d.actual_count}"
+        )
+    print(f"{len(drift)} drifted keys" + (" fixed" if args.command == "rebuild" else ""))
+    if args.command == "verify" and drift:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+-- Composite indexes for report queries filtering card_fill by scope and date range
+
+begin;
+create index idx_card_fill_scope_date on card_fill (fill_scope, fill_date);
+create index idx_card_fill_scope_user_date on card_fill (fill_scope, user_id, fill_date);
+commit;
@@ -0,0 +1,21 @@
+-- Monthly rollup of card_fill, maintained by the bot on every fill write.
+-- After applying, check it with: python3 manage_rollup.py verify
+
+create table card_fill_rollup (
+    fill_scope int not null,
+    year smallint not null,
+    month tinyint not null,
+    category_code varchar(255) not null,
+    user_id bigint not null,
+    is_netted boolean not null,
+    amount_sum double not null default 0,
+    fill_count int not null default 0,
+    primary key (fill_scope, year, month, category_code, user_id, is_netted)
+);
+
+begin;
+insert into card_fill_rollup (fill_scope, year, month, category_code, user_id, is_netted, amount_sum, fill_count)
+select fill_scope, year(fill_date), month(fill_date), category_code, user_id, coalesce(is_netted, false), sum(amount), count(*)
+from card_fill
+group by fill_scope, year(fill_date), month(fill_date), category_code, user_id, coalesce(is_netted, false);
+commit;
@@ -0,0 +1,7 @@
+-- Netting batch id and time, so a net_balances run can be audited and rolled back
+
+begin;
+alter table card_fill add column netting_batch_id varchar(36) default null;
+alter table card_fill add column netted_at datetime default null;
+create index idx_card_fill_netting_batch on card_fill (netting_batch_id);
+commit;
@@ -0,0 +1,13 @@
+-- Idempotency keys of fills persisted from the write-behind queue (FILL_WRITE_BEHIND).
+-- Rows are only needed while a queue entry can be redelivered; the fill ingest worker deletes
+-- the ones older than FILL_INGEST_KEY_TTL by created_at.
+
+begin;
+create table fill_ingest_key (
+    ingest_key varchar(64) not null primary key,
+    fill_id int not null,
+    created_at datetime not null
+);
+
+create index idx_fill_ingest_key_created_at on fill_ingest_key (created_at);
+commit;
@@ -0,0 +1,6 @@
+-- Index for the columnar report store (COLUMNAR_REPORTS), which reads the fills of a scope
+-- above the highest fill_id it has loaded on every report
+
+begin;
+create index idx_card_fill_scope_id on card_fill (fill_scope, fill_id);
+commit;
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Iterable, TypeVar
 import re
 from sqlalchemy import (
@@ -9,6 +10,7 @@ from sqlalchemy import (
     DateTime,
     Float,
     JSON,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
@@ -18,8 +20,22 @@ from entities import FillScope, Category, User, Fill, Budget, PurchaseListItem,
 Base = declarative_base()
 
 
+@lru_cache(maxsize=1024)
+def _split_aliases(aliases: str) -> tuple[str, ...]:
+    """StoredCategory.get_aliases as a tuple, split once per distinct aliases string."""
+    if aliases == "":
+        return ()
+    return tuple(aliases.split(","))
+
+
 class StoredCardFill(Base):
     __tablename__ = "card_fill"
+    __table_args__ = (
+        Index("idx_card_fill_scope_date", "fill_scope", "fill_date"),
+        Index("idx_card_fill_scope_user_date", "fill_scope", "user_id", "fill_date"),
+        Index("idx_card_fill_netting_batch", "netting_batch_id"),
+        Index("idx_card_fill_scope_id", "fill_scope", "fill_id"),
+    )
 
     fill_id = Column("fill_id", Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("telegram_user.user_id"))
@@ -32,6 +48,8 @@ class StoredCardFill(Base):
     fill_scope = Column(Integer, ForeignKey("fill_scope.scope_id"))
     scope = relationship("StoredFillScope", back_populates="card_fills", lazy="subquery")
     is_netted = Column("is_netted", Boolean, default=False)
+    netting_batch_id = Column("netting_batch_id", String(36), nullable=True)
+    netted_at = Column("netted_at", DateTime, nullable=True)
     currency = Column("currency", String)
 
     def to_entity_fill(self) -> Fill:
@@ -58,6 +76,40 @@ class StoredCardFill(Base):
         )
 
 
+class StoredCardFillRollup(Base):
+    """Per-month fill sums, maintained in the same transaction as every card_fill write."""
+
+    __tablename__ = "card_fill_rollup"
+
+    fill_scope = Column("fill_scope", Integer, primary_key=True)
+    year = Column("year", Integer, primary_key=True)
+    month = Column("month", Integer, primary_key=True)
+    category_code = Column("category_code", String, primary_key=True)
+    user_id = Column("user_id", Integer, primary_key=True)
+    is_netted = Column("is_netted", Boolean, primary_key=True)
+    amount_sum = Column("amount_sum", Float, nullable=False, default=0)
+    fill_count = Column("fill_count", Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return (
+            f"{super().__repr__()}: "
+            f'<"fill_scope": {self.fill_scope}, "year": {self.year}, "month": {self.month}, '
+            f'"category_code": {self.category_code}, "user_id": {self.user_id}, "is_netted": {self.is_netted}, '
+            f'"amount_sum": {self.amount_sum}, "fill_count": {self.fill_count}>'
+        )
+
+
+class StoredFillIngestKey(Base):
+    """Idempotency key of a queued fill, written in the same transaction as the fill itself."""
+
+    __tablename__ = "fill_ingest_key"
+    __table_args__ = (Index("idx_fill_ingest_key_created_at", "created_at"),)
+
+    ingest_key = Column("ingest_key", String(64), primary_key=True)
+    fill_id = Column("fill_id", Integer, nullable=False)
+    created_at = Column("created_at", DateTime, nullable=False)
+
+
 class StoredTelegramUser(Base):
     __tablename__ = "telegram_user"
 
@@ -71,7 +123,7 @@ class StoredTelegramUser(Base):
     incomes = relationship("StoredIncome")
 
     def to_entity_user(self) -> User:
-        return User(
+        return User.interned(
             id=self.user_id,
             is_bot=self.is_bot,
             first_name=self.first_name,
@@ -123,10 +175,10 @@ class StoredCategory(Base):
         )
 
     def to_entity_category(self) -> Category:
-        return Category(
+        return Category.interned(
             code=self.code,
             name=self.name,
-            aliases=tuple(self.get_aliases()),
+            aliases=_split_aliases(self.aliases),
             emoji_name=self.emoji_name,
         )
 
@@ -153,7 +205,7 @@ class StoredFillScope(Base):
         )
 
     def to_entity_fill_scope(self) -> FillScope:
-        return FillScope(
+        return FillScope.interned(
             scope_id=self.scope_id, scope_type=self.scope_type, chat_id=self.chat_id, report_scopes=self.report_scopes
         )
 
@@ -221,6 +273,11 @@ class StoredPurchaselistItem(Base):
 
 class StoredIncome(Base):
     __tablename__ = "income"
+    __table_args__ = (
+        Index("idx_income_user_date", "user_id", "income_date"),
+        Index("idx_income_scope_date", "fill_scope", "income_date"),
+        Index("idx_income_date", "income_date"),
+    )
 
     income_id = Column("income_id", Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("telegram_user.user_id"))
@@ -15,7 +15,7 @@ class BudgetMessageParser(MessageParser):
         self.card_fill_service = card_fill_service
 
     def parse(self, message: Message) -> Optional[BudgetMessage]:
-        if message.text.lower().startswith("/budget"):
+        if message.text and message.text.lower().startswith("/budget"):
             scope = self.card_fill_service.get_scope(message.chat.id)
             return BudgetMessage(message, data=scope)
         else:
@@ -1,21 +1,68 @@
+from datetime import date
 from typing import Optional
 from aiogram.types import Message
 from parsers import MessageParser, ParsedMessage
-from entities import ServiceCommandType
+from entities import ServiceCommandType, DumpOptions, DumpTable, ImportOptions
+
+
+DUMP_USAGE = "/dump [fills|income] [scope=<id>] [from=YYYY-MM-DD] [to=YYYY-MM-DD]"
+IMPORT_USAGE = "/import [mapping=<name>] [scope=<id>] as the caption of a CSV file"
 
 
 class ServiceCommandMessage(ParsedMessage):
-    def __init__(self, original_message: Message, data: ServiceCommandType) -> None:
+    def __init__(
+        self, original_message: Message, data: ServiceCommandType, arguments: tuple[str, ...] = ()
+    ) -> None:
         super().__init__(original_message, data)
+        self.arguments = arguments
 
 
 class ServiceCommandMessageParser(MessageParser):
     def parse(self, message: Message) -> Optional[ServiceCommandMessage]:
-        if (txt := message.text.lower()).startswith("/"):
+        # A command sent with a file, as /import is, comes in the caption
+        if (txt := message.text or message.caption or "").startswith("/"):
+            command, *arguments = txt.split()
             try:
-                command = ServiceCommandType(txt.split()[0][1:])
+                command = ServiceCommandType(command[1:].lower())
             except ValueError:
                 return None
-            return ServiceCommandMessage(message, data=command)
+            return ServiceCommandMessage(message, data=command, arguments=tuple(arguments))
         else:
             return None
+
+
+def parse_dump_options(arguments: tuple[str, ...]) -> DumpOptions:
+    """Parses /dump arguments, both tables are exported when none is named. `to` is inclusive."""
+    tables = []
+    options = {}
+    for argument in arguments:
+        key, sep, value = argument.lower().partition("=")
+        if not sep:
+            tables.append(DumpTable(key))
+        elif key == "scope":
+            options["scope_id"] = int(value)
+        elif key == "from":
+            options["date_from"] = date.fromisoformat(value)
+        elif key == "to":
+            options["date_to"] = date.fromisoformat(value)
+        else:
+            raise ValueError(f"Unknown dump option {key}")
+    return DumpOptions(tables=tuple(tables or DumpTable), **options)
+
+
+def parse_import_options(arguments: tuple[str, ...]) -> ImportOptions:
+    """Parses /import arguments, without a mapping the file must have the /dump fills layout.
+
+    Mapping names keep their case, they are the keys of IMPORT_MAPPINGS.
+    """
+    options = {}
+    for argument in arguments:
+        key, sep, value = argument.partition("=")
+        key = key.lower()
+        if key == "mapping" and sep:
+            options["mapping"] = value
+        elif key == "scope" and sep:
+            options["scope_id"] = int(value)
+        else:
+            raise ValueError(f"Unknown import option {argument}")
+    return ImportOptions(**options)
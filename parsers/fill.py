@@ -14,43 +14,76 @@ class FillMessage(ParsedMessage):
         super().__init__(original_message, data)
 
 
+class MultiFillMessage(ParsedMessage):
+    def __init__(self, original_message: Message, data: list[Fill]) -> None:
+        super().__init__(original_message, data)
+
+
 class FillMessageParser(MessageParser):
     def __init__(self, card_fill_service: CardFillService) -> None:
         self.card_fill_service = card_fill_service
 
-    def parse(self, message: Message) -> Optional[FillMessage]:
-        """Returns Fill on successful parse or None if no fill was found."""
-        message_text = message.text
+    @staticmethod
+    def _parse_amount(text: str) -> Optional[tuple[float, Optional[Currency], str]]:
+        """Amount, currency and description of a text with exactly one number, else None."""
         cnt = 0
-        for number_match in re.finditer(number_with_currency_regexp, message_text):
+        for number_match in re.finditer(number_with_currency_regexp, text):
             cnt += 1
             amount = number_match.group()
             currency = None
             if amount[-1] in ('r', 'R', 'e', 'E', 'р', 'Р', 'Е', 'е'):
                 amount, currency_alias = amount[:-1], amount[-1]
                 currency = Currency.get_by_alias(currency_alias.lower())
-            before_phrase = message_text[: number_match.start()].strip()
-            after_phrase = message_text[number_match.end() :].strip()
+            before_phrase = text[: number_match.start()].strip()
+            after_phrase = text[number_match.end() :].strip()
             if len(before_phrase) > 0 and len(after_phrase) > 0:
                 description = " ".join([before_phrase, after_phrase])
             else:
                 description = before_phrase + after_phrase
         if cnt == 1:
-            scope = self.card_fill_service.get_scope(message.chat.id)
-            fill = Fill(
-                id=None,
-                user=User.from_telegramapi(message.from_user),
-                fill_date=message.date,
-                amount=float(amount),
-                description=description,
-                category=None,
-                scope=scope,
-                currency=currency,
-            )
-            print(fill)
-            return FillMessage(original_message=message, data=fill)
+            return float(amount), currency, description
         return None
 
+    def parse(self, message: Message) -> Optional[FillMessage | MultiFillMessage]:
+        """Returns Fill on successful parse, a list of fills for a message with
+        one amount on every line, or None if no fill was found."""
+        message_text = message.text
+        # Commands such as "/dump scope=2" are left to their own parsers
+        if not message_text or message_text.startswith("/"):
+            return None
+        parsed = self._parse_amount(message_text)
+        if parsed is not None:
+            return FillMessage(original_message=message, data=self._fill(message, *parsed))
+
+        lines = [line for line in message_text.splitlines() if line.strip()]
+        if len(lines) < 2:
+            return None
+        parsed_lines = [self._parse_amount(line) for line in lines]
+        if any(parsed_line is None for parsed_line in parsed_lines):
+            return None
+        scope = self.card_fill_service.get_scope(message.chat.id)
+        fills = [self._fill(message, *parsed_line, scope=scope) for parsed_line in parsed_lines]
+        return MultiFillMessage(original_message=message, data=fills)
+
+    def _fill(
+        self,
+        message: Message,
+        amount: float,
+        currency: Optional[Currency],
+        description: str,
+        scope: Optional[FillScope] = None,
+    ) -> Fill:
+        return Fill(
+            id=None,
+            user=User.from_telegramapi(message.from_user),
+            fill_date=message.date,
+            amount=amount,
+            description=description,
+            category=None,
+            scope=scope or self.card_fill_service.get_scope(message.chat.id),
+            currency=currency,
+        )
+
 
 class NetBalancesMessage(ParsedMessage):
     def __init__(self, original_message: Message, data: FillScope) -> None:
@@ -62,7 +95,7 @@ class NetBalancesMessageParser(MessageParser):
         self.card_fill_service = card_fill_service
 
     def parse(self, message: Message) -> Optional[NetBalancesMessage]:
-        if message.text.lower().startswith("/net"):
+        if message.text and message.text.lower().startswith("/net"):
             scope = self.card_fill_service.get_scope(message.chat.id)
             return NetBalancesMessage(message, data=scope)
         else:
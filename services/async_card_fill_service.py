@@ -0,0 +1,292 @@
+import asyncio
+import logging
+from typing import Optional, Callable, TypeVar, Any
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncEngine
+from sqlalchemy.orm import Session
+from settings import settings
+from services.card_fill_service import CardFillService
+from services.reference_data_cache import CategorySnapshot
+from services.budget_usage_store import BudgetUsage
+from services.ttl_cache import CacheStats
+from services.db_pool import PoolStats, create_async_db_engine, get_pool_stats
+from services.replica_router import REPLICA_ERRORS
+from services.sql_stats import SqlStats
+from services.bounded_executor import BoundedExecutor, ExecutorOverloadedError
+from services.redis_calls import collect_redis_calls, run_redis_calls
+from entities import (
+    Month,
+    Fill,
+    Category,
+    User,
+    UserSumOverPeriod,
+    CategorySumOverPeriod,
+    SummaryOverPeriod,
+    FillScope,
+    Budget,
+    UserSumOverPeriodWithBalance,
+    Income,
+    RollupDrift,
+    NettingBatch,
+    FillBudgetStatus,
+)
+
+
+T = TypeVar("T")
+
+
+class AsyncCardFillService:
+    """Asyncio counterpart of CardFillService.
+
+    Query logic is shared with CardFillService: every call runs the sync
+    implementation inside AsyncSession.run_sync, so database round-trips are
+    awaited by the event loop instead of blocking it. run_sync still runs on
+    the event loop thread, so the redis writes the sync implementation makes
+    are collected and run on redis_executor once the session is closed.
+    """
+
+    def __init__(
+        self,
+        card_fill_service: Optional[CardFillService] = None,
+        db_engine: Optional[AsyncEngine] = None,
+        replica_db_engine: Optional[AsyncEngine] = None,
+        sql_stats: Optional[SqlStats] = None,
+        redis_executor: Optional[BoundedExecutor] = None,
+    ):
+        self.logger = logging.getLogger(__name__)
+        if db_engine is None:
+            db_engine = create_async_db_engine(settings.async_database_uri)
+            self.logger.info(
+                f"Initialized async db_engine for card fill service at {settings.async_database_uri}"
+            )
+        self._db_engine = db_engine
+        self._redis_executor = redis_executor
+        self._card_fill_service = card_fill_service or CardFillService(db_engine=db_engine.sync_engine)
+        self.AsyncDbSession = async_sessionmaker(bind=self._db_engine)
+        if replica_db_engine is None and settings.async_replica_database_uri is not None:
+            replica_db_engine = create_async_db_engine(settings.async_replica_database_uri)
+            self.logger.info(
+                f"Initialized async replica db_engine for reports at {settings.async_replica_database_uri}"
+            )
+        self._replica_db_engine = replica_db_engine
+        self.AsyncReplicaDbSession = (
+            async_sessionmaker(bind=replica_db_engine) if replica_db_engine is not None else None
+        )
+        if sql_stats is not None:
+            for engine in (db_engine, replica_db_engine):
+                if engine is not None:
+                    sql_stats.instrument(engine.sync_engine)
+
+    async def _run(self, method: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await self._run_in(self.AsyncDbSession, method, *args, **kwargs)
+
+    async def _run_read(self, method: Callable[..., T], *args: Any, scope: FillScope) -> T:
+        """_run on the replica when the router allows it for the scope, on the primary if that fails."""
+        if self.AsyncReplicaDbSession is None or not self._card_fill_service.routes_to_replica(scope):
+            return await self._run(method, *args, scope)
+        try:
+            return await self._run_in(self.AsyncReplicaDbSession, method, *args, scope)
+        except REPLICA_ERRORS as e:
+            self._card_fill_service.replica_router.mark_unavailable(e)
+            return await self._run(method, *args, scope)
+
+    async def _run_in(
+        self, sessionmaker: async_sessionmaker, method: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        redis_calls: list[Callable[[], Any]] = []
+        try:
+            with collect_redis_calls() as redis_calls:
+                async with sessionmaker() as async_db_session:
+                    return await async_db_session.run_sync(self._call_bound, method, *args, **kwargs)
+        finally:
+            await self._run_redis_calls(redis_calls)
+
+    async def _run_local(self, method: Callable[..., T], *args: Any) -> T:
+        """Runs a method that needs no session on the event loop, its redis writes on redis_executor."""
+        redis_calls: list[Callable[[], Any]] = []
+        try:
+            with collect_redis_calls() as redis_calls:
+                return method(*args)
+        finally:
+            await self._run_redis_calls(redis_calls)
+
+    async def _run_redis_calls(self, redis_calls: list[Callable[[], Any]]) -> None:
+        if not redis_calls:
+            return
+        if self._redis_executor is not None:
+            try:
+                await self._redis_executor.run(run_redis_calls, redis_calls)
+                return
+            except ExecutorOverloadedError:
+                # They record committed writes, dropping them would leave counters and versions behind
+                self.logger.warning(f"Redis executor is overloaded, running {len(redis_calls)} calls on a new thread")
+        await asyncio.to_thread(run_redis_calls, redis_calls)
+
+    def _call_bound(self, db_session: Session, method: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        with self._card_fill_service.bind_session(db_session):
+            return method(*args, **kwargs)
+
+    async def get_all_fills(self) -> list[Fill]:
+        return await self._run(self._card_fill_service.get_all_fills)
+
+    async def get_scope(self, chat_id: int) -> FillScope:
+        return await self._run(self._card_fill_service.get_scope, chat_id)
+
+    def invalidate_scope(self, chat_id: Optional[int] = None) -> None:
+        self._card_fill_service.invalidate_scope(chat_id)
+
+    def scope_cache_stats(self) -> CacheStats:
+        return self._card_fill_service.scope_cache_stats()
+
+    def user_cache_stats(self) -> CacheStats:
+        return self._card_fill_service.user_cache_stats()
+
+    def pool_stats(self) -> Optional[PoolStats]:
+        return get_pool_stats("async_db", self._db_engine)
+
+    def replica_pool_stats(self) -> Optional[PoolStats]:
+        if self._replica_db_engine is None:
+            return None
+        return get_pool_stats("async_replica_db", self._replica_db_engine)
+
+    async def handle_new_fill(self, fill: Fill) -> Fill:
+        return await self._run(self._card_fill_service.handle_new_fill, fill)
+
+    async def handle_new_fills(self, fills: list[Fill]) -> list[Fill]:
+        return await self._run(self._card_fill_service.handle_new_fills, fills)
+
+    async def ingest_fills(self, keyed_fills: list[tuple[str, Fill]]) -> dict[str, Optional[FillBudgetStatus]]:
+        fills = await self._run(self._card_fill_service.save_ingested_fills, keyed_fills)
+        stored = {key: fill for key, fill in fills.items() if fill is not None}
+        statuses = dict(zip(stored, await self._fill_budget_statuses(list(stored.values()))))
+        return {key: statuses.get(key) for key in fills}
+
+    async def purge_ingest_keys(self, older_than: timedelta) -> int:
+        return await self._run(self._card_fill_service.purge_ingest_keys, older_than)
+
+    async def get_fill_by_id(self, fill_id: int) -> Fill:
+        return await self._run(self._card_fill_service.get_fill_by_id, fill_id)
+
+    async def delete_fill(self, fill: Fill) -> None:
+        return await self._run(self._card_fill_service.delete_fill, fill)
+
+    async def change_date_for_fill(self, fill: Fill, dt: datetime) -> None:
+        return await self._run(self._card_fill_service.change_date_for_fill, fill, dt)
+
+    async def list_categories(self) -> list[Category]:
+        return await self._run(self._card_fill_service.list_categories)
+
+    async def get_category_snapshot(self) -> CategorySnapshot:
+        return await self._run(self._card_fill_service.get_category_snapshot)
+
+    async def invalidate_categories(self) -> None:
+        await self._run_local(self._card_fill_service.invalidate_categories)
+
+    async def invalidate_currency_rates(self) -> None:
+        await self._run_local(self._card_fill_service.invalidate_currency_rates)
+
+    async def invalidate_budgets(self, scope: FillScope) -> None:
+        await self._run_local(self._card_fill_service.invalidate_budgets, scope)
+
+    async def create_new_category(self, category: Category) -> Category:
+        return await self._run(self._card_fill_service.create_new_category, category)
+
+    async def change_category_for_fill(self, fill_id: int, target_category_code: str) -> Fill:
+        return await self._run(self._card_fill_service.change_category_for_fill, fill_id, target_category_code)
+
+    async def get_monthly_report_by_category(
+        self, months: list[Month], year: int, scope: FillScope
+    ) -> dict[Month, list[CategorySumOverPeriod]]:
+        return await self._run_read(self._card_fill_service.get_monthly_report_by_category, months, year, scope=scope)
+
+    async def get_monthly_report_by_user(
+        self, months: list[Month], year: int, scope: FillScope
+    ) -> dict[Month, list[UserSumOverPeriod]]:
+        return await self._run_read(self._card_fill_service.get_monthly_report_by_user, months, year, scope=scope)
+
+    async def get_debt_monthly_report_by_user(
+        self, months: list[Month], year: int, scope: FillScope
+    ) -> dict[Month, list[UserSumOverPeriodWithBalance]]:
+        return await self._run_read(self._card_fill_service.get_debt_monthly_report_by_user, months, year, scope=scope)
+
+    async def get_monthly_report(
+        self, months: list[Month], year: int, scope: FillScope
+    ) -> dict[Month, SummaryOverPeriod]:
+        return await self._run_read(self._card_fill_service.get_monthly_report, months, year, scope=scope)
+
+    async def get_user_fills_in_months(
+        self, user: User, months: list[Month], year: int, scope: FillScope
+    ) -> list[Fill]:
+        return await self._run_read(self._card_fill_service.get_user_fills_in_months, user, months, year, scope=scope)
+
+    async def get_budget_for_category(self, category: Category, scope: FillScope) -> Optional[Budget]:
+        return await self._run(self._card_fill_service.get_budget_for_category, category, scope)
+
+    async def list_budgets(self, scope: FillScope) -> list[Budget]:
+        return await self._run(self._card_fill_service.list_budgets, scope)
+
+    async def get_current_budget_usage_for_category(
+        self, category: Category, scope: FillScope
+    ) -> Optional[CategorySumOverPeriod]:
+        [counters] = await self._read_budget_usage([(category, scope)])
+        return await self._run(self._card_fill_service.category_usage, category, scope, counters)
+
+    async def handle_new_fill_with_budget_status(self, fill: Fill) -> FillBudgetStatus:
+        fill = await self._run(self._card_fill_service.handle_new_fill, fill)
+        [status] = await self._fill_budget_statuses([fill])
+        return status
+
+    async def change_category_for_fill_with_budget_status(
+        self, fill_id: int, target_category_code: str
+    ) -> FillBudgetStatus:
+        fill = await self._run(self._card_fill_service.change_category_for_fill, fill_id, target_category_code)
+        [status] = await self._fill_budget_statuses([fill])
+        return status
+
+    async def _fill_budget_statuses(self, fills: list[Fill]) -> list[FillBudgetStatus]:
+        counters = await self._read_budget_usage([(fill.category, fill.scope) for fill in fills])
+        return await self._run(self._card_fill_service.fill_budget_statuses, fills, counters)
+
+    async def _read_budget_usage(
+        self, targets: list[tuple[Category, FillScope]]
+    ) -> list[BudgetUsage]:
+        """read_budget_usage on redis_executor, or no counters when it is overloaded, then the rollup is read."""
+        if self._redis_executor is None:
+            return await asyncio.to_thread(self._card_fill_service.read_budget_usage, targets)
+        try:
+            return await self._redis_executor.run(self._card_fill_service.read_budget_usage, targets)
+        except ExecutorOverloadedError:
+            return [None] * len(targets)
+
+    async def net_balances(self, scope: FillScope, record_batch: bool = True) -> NettingBatch:
+        return await self._run(self._card_fill_service.net_balances, scope, record_batch)
+
+    async def rollback_netting(self, batch_id: str) -> int:
+        return await self._run(self._card_fill_service.rollback_netting, batch_id)
+
+    async def handle_new_income(self, income: Income) -> Income:
+        return await self._run(self._card_fill_service.handle_new_income, income)
+
+    async def delete_income(self, income: Income) -> None:
+        return await self._run(self._card_fill_service.delete_income, income)
+
+    async def get_user_income_in_months(
+        self, user: User, months: list[Month], year: int, scope: FillScope
+    ) -> list[Income]:
+        return await self._run_read(self._card_fill_service.get_user_income_in_months, user, months, year, scope=scope)
+
+    async def get_income_monthly_report_by_user(
+        self, months: list[Month], year: int, scope: FillScope
+    ) -> dict[Month, list[UserSumOverPeriod]]:
+        return await self._run_read(
+            self._card_fill_service.get_income_monthly_report_by_user, months, year, scope=scope
+        )
+
+    async def verify_rollup(self, scope_ids: Optional[list[int]] = None) -> list[RollupDrift]:
+        return await self._run(self._card_fill_service.verify_rollup, scope_ids)
+
+    async def rebuild_rollup(self, scope_ids: Optional[list[int]] = None) -> list[RollupDrift]:
+        return await self._run(self._card_fill_service.rebuild_rollup, scope_ids)
+
+    async def reconcile_budget_usage(self, scope_ids: Optional[list[int]] = None) -> None:
+        return await self._run(self._card_fill_service.reconcile_budget_usage, scope_ids)
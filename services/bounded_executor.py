@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from typing import Any, Callable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class ExecutorOverloadedError(Exception):
+    """Raised when a call is rejected because the executor queue is full."""
+
+
+@dataclass(frozen=True)
+class ExecutorStats:
+    name: str
+    max_workers: int
+    max_queue: int
+    active: int
+    queued: int
+    rejected: int
+    completed: int
+
+
+class BoundedExecutor:
+    """Thread pool with a bounded queue for running blocking calls from coroutines.
+
+    At most max_workers calls run at once and at most max_queue more wait for a
+    worker; anything beyond that is rejected with ExecutorOverloadedError
+    instead of piling up behind slow work.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-executor")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._rejected = 0
+        self._completed = 0
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        with self._lock:
+            if self._active + self._queued >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                stats = self._stats_locked()
+                self.logger.warning(f"Executor {self.name} rejected {fn}: {stats}")
+                raise ExecutorOverloadedError(f"Executor {self.name} is overloaded")
+            self._queued += 1
+
+        call = functools.partial(fn, *args, **kwargs)
+        ctx = contextvars.copy_context()
+        future = self._executor.submit(ctx.run, self._call, call)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _call(self, call: Callable[[], T]) -> T:
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            return call()
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    def _on_done(self, future: Future) -> None:
+        if future.cancelled():  # cancelled while waiting, _call never ran
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self) -> ExecutorStats:
+        with self._lock:
+            return self._stats_locked()
+
+    def _stats_locked(self) -> ExecutorStats:
+        return ExecutorStats(
+            name=self.name,
+            max_workers=self.max_workers,
+            max_queue=self.max_queue,
+            active=self._active,
+            queued=self._queued,
+            rejected=self._rejected,
+            completed=self._completed,
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class OffloadedService:
+    """Proxy that turns every method of a blocking service into a coroutine run on an executor."""
+
+    def __init__(self, service: Any, executor: BoundedExecutor) -> None:
+        self._service = service
+        self._executor = executor
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._service, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def offloaded(*args: Any, **kwargs: Any) -> Any:
+            return await self._executor.run(attr, *args, **kwargs)
+
+        return offloaded
@@ -0,0 +1,171 @@
+import logging
+from dataclasses import dataclass
+from typing import Iterable, Mapping, Union
+import redis
+from entities import Month, Quarter
+
+
+# Set on a hash by rebuild; a hash without it only holds increments made since it expired or was lost
+_BUILT_FIELD = "built"
+
+
+@dataclass(frozen=True)
+class UsageMiss:
+    """get_usage of counters that are not built, with the write generation of each (scope_id, year) hash.
+
+    The generations are read before the rows a rebuild is made of, so
+    rebuild_missing can tell that an increment landed after the rows were read.
+    """
+
+    generations: Mapping[tuple[int, int], int]
+
+
+# Counters as read by get_usage: month, quarter and year usage, a miss, or None when redis could not be read
+BudgetUsage = Union[tuple[float, float, float], UsageMiss, None]
+
+
+class BudgetUsageStore:
+    """Per-scope spending counters in redis, so a budget check does not touch the database.
+
+    Every (scope, year) is one hash with a field per category and month, quarter
+    and year. Writers add amounts with HINCRBYFLOAT after their transaction
+    commits. Counters are trusted only after a rebuild has filled the hash from
+    the database; until then get_usage returns a UsageMiss and callers fall
+    back to a query, whose rows rebuild_missing turns into the hash. Every
+    write to a hash also bumps its generation counter, a key of its own that
+    survives the hash being dropped. rebuild is also the reconciliation job for
+    counters that drifted when a redis write failed.
+    """
+
+    def __init__(self, rdb: redis.Redis) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.rdb = rdb
+
+    def add(self, amounts: Iterable[tuple[int, int, int, str, float]]) -> None:
+        """Adds (scope_id, year, month, category_code, amount) to the month, quarter and year counters."""
+        amounts = [a for a in amounts if a[4] != 0]
+        if not amounts:
+            return
+        try:
+            pipe = self.rdb.pipeline(transaction=True)
+            for scope_id, year, month, category_code, amount in amounts:
+                key = self._key(scope_id, year)
+                for field in self._fields(category_code, Month(month)):
+                    pipe.hincrbyfloat(key, field, amount)
+            for scope_id, year in {(scope_id, year) for scope_id, year, _, _, _ in amounts}:
+                pipe.incr(self._generation_key(scope_id, year))
+            pipe.execute()
+        except redis.RedisError:
+            self.logger.exception("Could not update budget usage counters, dropping them until the next rebuild")
+            self.invalidate({(scope_id, year) for scope_id, year, _, _, _ in amounts})
+
+    def get_usage(
+        self, scope_ids: list[int], year: int, month: Month, category_code: str
+    ) -> BudgetUsage:
+        """Month, quarter and year usage summed over scope_ids, a UsageMiss when a counter is not built yet."""
+        fields = [_BUILT_FIELD, *self._fields(category_code, month)]
+        try:
+            pipe = self.rdb.pipeline(transaction=False)
+            for scope_id in scope_ids:
+                pipe.hmget(self._key(scope_id, year), fields)
+                pipe.get(self._generation_key(scope_id, year))
+            replies = pipe.execute()
+        except redis.RedisError:
+            self.logger.exception("Could not read budget usage counters")
+            return None
+
+        usage = [0.0, 0.0, 0.0]
+        generations = {}
+        built_all = True
+        for scope_id, (built, *amounts), generation in zip(scope_ids, replies[::2], replies[1::2]):
+            generations[(scope_id, year)] = int(generation or 0)
+            built_all = built_all and built is not None
+            for i, amount in enumerate(amounts):
+                usage[i] += float(amount or 0)
+        if not built_all:
+            return UsageMiss(generations)
+        return usage[0], usage[1], usage[2]
+
+    def rebuild(self, scope_years: Iterable[tuple[int, int]], rows: Iterable[tuple[int, int, int, str, float]]) -> None:
+        """Replaces the hashes of scope_years with (scope_id, year, month, category_code, amount) rows.
+
+        Increments that land between reading rows from the database and this call
+        are lost, so run it when few fills are coming in.
+        """
+        hashes = self._hashes(scope_years, rows)
+        pipe = self.rdb.pipeline(transaction=True)
+        for (scope_id, year), counters in hashes.items():
+            key = self._key(scope_id, year)
+            pipe.delete(key)
+            pipe.hset(key, mapping={_BUILT_FIELD: 1, **counters})
+        pipe.execute()
+        self.logger.info(f"Rebuilt budget usage counters for {len(hashes)} scope years")
+
+    def rebuild_missing(self, miss: UsageMiss, rows: Iterable[tuple[int, int, int, str, float]]) -> None:
+        """rebuild for the hashes get_usage missed that are still not built, from rows read after the miss.
+
+        Built hashes are left alone, and so are hashes whose generation moved
+        since get_usage: an increment landed after the rows may have been read,
+        and the rows could be missing it. When a writer touches one of the
+        hashes between this check and the rebuild, nothing is written. Either
+        way the next miss tries again.
+        """
+        hashes = {
+            scope_year: counters
+            for scope_year, counters in self._hashes(miss.generations, rows).items()
+            if scope_year in miss.generations
+        }
+        keys = {self._key(*scope_year): scope_year for scope_year in hashes}
+        with self.rdb.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(*keys, *(self._generation_key(*scope_year) for scope_year in hashes))
+                missing = [
+                    key
+                    for key, scope_year in keys.items()
+                    if not pipe.hexists(key, _BUILT_FIELD)
+                    and int(pipe.get(self._generation_key(*scope_year)) or 0) == miss.generations[scope_year]
+                ]
+                if not missing:
+                    return
+                pipe.multi()
+                for key in missing:
+                    pipe.delete(key)
+                    pipe.hset(key, mapping={_BUILT_FIELD: 1, **hashes[keys[key]]})
+                pipe.execute()
+            except redis.WatchError:
+                self.logger.info("Budget usage counters changed during their rebuild, leaving it to the next miss")
+                return
+        self.logger.info(f"Rebuilt budget usage counters for {len(missing)} scope years after a miss")
+
+    def invalidate(self, scope_years: Iterable[tuple[int, int]]) -> None:
+        try:
+            pipe = self.rdb.pipeline(transaction=True)
+            for scope_id, year in scope_years:
+                pipe.delete(self._key(scope_id, year))
+                pipe.incr(self._generation_key(scope_id, year))
+            pipe.execute()
+        except redis.RedisError:
+            self.logger.exception("Could not drop budget usage counters")
+
+    def _hashes(
+        self, scope_years: Iterable[tuple[int, int]], rows: Iterable[tuple[int, int, int, str, float]]
+    ) -> dict[tuple[int, int], dict[str, float]]:
+        hashes: dict[tuple[int, int], dict[str, float]] = {scope_year: {} for scope_year in scope_years}
+        for scope_id, year, month, category_code, amount in rows:
+            counters = hashes.setdefault((scope_id, year), {})
+            for field in self._fields(category_code, Month(month)):
+                counters[field] = counters.get(field, 0) + amount
+        return hashes
+
+    @staticmethod
+    def _key(scope_id: int, year: int) -> str:
+        return f"budget_usage_{scope_id}_{year}"
+
+    @staticmethod
+    def _generation_key(scope_id: int, year: int) -> str:
+        return f"budget_usage_generation_{scope_id}_{year}"
+
+    @staticmethod
+    def _fields(category_code: str, month: Month) -> tuple[str, str, str]:
+        quarter = Quarter.from_month(month)
+        return f"{category_code}_m{month.value}", f"{category_code}_q{quarter.value}", f"{category_code}_y"
@@ -55,6 +55,22 @@ class CacheService:
             return None
         return FillSchema().loads(fill_json)
 
+    def set_fills_for_message(self, message: Message, fills: list[Fill]) -> None:
+        fills_json = FillSchema(many=True).dumps(fills)
+        self.rdb.set(f"{message.chat.id}_{message.message_id}_fills", fills_json)
+        self.logger.debug(
+            f"Save to cache fills {[fill.id for fill in fills]} for chat {message.chat.id}, message {message.message_id}"
+        )
+
+    def get_fills_for_message(self, message: Message) -> Optional[list[Fill]]:
+        fills_json = self.rdb.get(f"{message.chat.id}_{message.message_id}_fills")
+        self.logger.debug(
+            f"Get from cache fills {fills_json} for chat {message.chat.id}, message {message.message_id}"
+        )
+        if not fills_json:
+            return None
+        return FillSchema(many=True).loads(fills_json)
+
     def set_months_for_message(self, message: Message, months: list[Month]) -> None:
         month_numbers = [str(month.value) for month in months]
         self.rdb.set(
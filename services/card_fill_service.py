@@ -1,12 +1,56 @@
 from collections import defaultdict
+import functools
+import inspect
+import itertools
 import logging
+import uuid
+import numpy as np
 from contextlib import contextmanager
-from typing import Optional
-from datetime import datetime
-from sqlalchemy import create_engine, extract
-from sqlalchemy.orm import scoped_session, sessionmaker, Session
+from contextvars import ContextVar
+from dataclasses import replace
+from types import MappingProxyType
+from typing import Optional, Iterator, Iterable, Callable, TypeVar
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import extract, func, and_, or_, ColumnElement, Select, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import (
+    scoped_session,
+    sessionmaker,
+    Session,
+    InstrumentedAttribute,
+    joinedload,
+    selectinload,
+    lazyload,
+)
 from settings import settings
-from model import StoredCardFill, StoredCategory, StoredTelegramUser, StoredFillScope, StoredBudget, StoredCurrencyRate, StoredIncome
+from model import (
+    StoredCardFill,
+    StoredCardFillRollup,
+    StoredFillIngestKey,
+    StoredCategory,
+    StoredTelegramUser,
+    StoredFillScope,
+    StoredBudget,
+    StoredCurrencyRate,
+    StoredIncome,
+)
+from services.upsert import upsert
+from services.category_classifier import CategoryClassifier
+from services.reference_data_cache import (
+    ReferenceDataCache,
+    CategorySnapshot,
+    BudgetSnapshot,
+    CurrencyRateSnapshot,
+)
+from services.fill_import import DUMP_FILL_COLUMNS, IMPORT_REPORT_SAMPLE
+from services.budget_usage_store import BudgetUsage, BudgetUsageStore, UsageMiss
+from services.redis_calls import call_redis
+from services.columnar_report import ColumnarFillStore, FillColumns, MonthMatrix
+from services.report_cache import ReportCache
+from services.sql_stats import SqlStats
+from services.ttl_cache import TTLCache, CacheStats
+from services.db_pool import PoolStats, create_db_engine, get_pool_stats
+from services.replica_router import REPLICA_ERRORS, ReplicaRouter
 from entities import (
     Month,
     Fill,
@@ -20,31 +64,222 @@ from entities import (
     UserSumOverPeriodWithBalance,
     Quarter,
     Income,
+    RollupDrift,
+    NettingBatch,
+    FillBudgetStatus,
+    ImportedFill,
+    ImportReport,
+)
+
+
+_bound_db_session: ContextVar[Optional[Session]] = ContextVar("bound_db_session", default=None)
+
+F = TypeVar("F", bound=Callable)
+
+
+def _replica_read(method: F) -> F:
+    """Runs a read-only method with a `scope` argument on the replica when the router allows it.
+
+    A failed replica read is repeated on the primary. Inside a bound session the
+    method runs as is, so nested reports share the session chosen by the outer one.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self: "CardFillService", *args, **kwargs):
+        if self.ReplicaDbSession is None or _bound_db_session.get() is not None:
+            return method(self, *args, **kwargs)
+        scope: FillScope = signature.bind(self, *args, **kwargs).arguments["scope"]
+        if self.routes_to_replica(scope):
+            try:
+                with self.replica_db_session() as db_session, self.bind_session(db_session):
+                    return method(self, *args, **kwargs)
+            except REPLICA_ERRORS as e:
+                self.replica_router.mark_unavailable(e)
+        with self.db_session() as db_session, self.bind_session(db_session):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+# Loader options per use case, so that to_entity_fill and to_entity_income never lazy-load.
+# A single row joins everything. Lists join the user and fetch the few distinct categories
+# and scopes with one selectin query each instead of re-running the base query as the
+# subquery loaders on the model do. Writes only need columns and load no relationships.
+_FILL_ROW_OPTIONS = (
+    joinedload(StoredCardFill.user),
+    joinedload(StoredCardFill.category),
+    joinedload(StoredCardFill.scope),
+)
+_FILL_LIST_OPTIONS = (
+    joinedload(StoredCardFill.user),
+    selectinload(StoredCardFill.category),
+    selectinload(StoredCardFill.scope),
 )
+_FILL_WRITE_OPTIONS = (lazyload(StoredCardFill.category), lazyload(StoredCardFill.scope))
+_INCOME_LIST_OPTIONS = (joinedload(StoredIncome.user), selectinload(StoredIncome.scope))
+_INCOME_WRITE_OPTIONS = (lazyload(StoredIncome.scope),)
 
 
 class CardFillService:
-    def __init__(self):
+    def __init__(
+        self,
+        db_engine: Optional[Engine] = None,
+        reference_data: Optional[ReferenceDataCache] = None,
+        budget_usage: Optional[BudgetUsageStore] = None,
+        replica_db_engine: Optional[Engine] = None,
+        fill_columns: Optional[ColumnarFillStore] = None,
+        report_cache: Optional[ReportCache] = None,
+        sql_stats: Optional[SqlStats] = None,
+    ):
         self.logger = logging.getLogger(__name__)
-        self._db_engine = create_engine(settings.database_uri, pool_recycle=3600)
-        self.logger.info(
-            f"Initialized db_engine for card fill service at {settings.database_uri}"
-        )
+        if db_engine is None:
+            db_engine = create_db_engine(settings.database_uri)
+            self.logger.info(
+                f"Initialized db_engine for card fill service at {settings.database_uri}"
+            )
+        self._db_engine = db_engine
         self.DbSession = scoped_session(sessionmaker(bind=self._db_engine))
+        if replica_db_engine is None and settings.replica_database_uri is not None:
+            replica_db_engine = create_db_engine(settings.replica_database_uri)
+            self.logger.info(f"Initialized replica db_engine for reports at {settings.replica_database_uri}")
+        self._replica_db_engine = replica_db_engine
+        self.ReplicaDbSession = (
+            scoped_session(sessionmaker(bind=replica_db_engine)) if replica_db_engine is not None else None
+        )
+        if sql_stats is not None:
+            for engine in (db_engine, replica_db_engine):
+                if engine is not None:
+                    sql_stats.instrument(engine)
+        self.replica_router = ReplicaRouter(
+            read_after_write_window=settings.replica_read_after_write_window,
+            retry_interval=settings.replica_retry_interval,
+            maxsize=settings.scope_cache_size,
+        )
+        if reference_data is None:
+            reference_data = ReferenceDataCache(ttl=settings.reference_data_ttl)
+        self._reference_data = reference_data
+        self._budget_usage = budget_usage
+        if fill_columns is None and settings.columnar_reports:
+            fill_columns = ColumnarFillStore(
+                reference_data, maxsize=settings.columnar_scope_cache_size, ttl=settings.columnar_scope_ttl
+            )
+        self._fill_columns = fill_columns
+        self._report_cache = report_cache
+        self._scope_cache: TTLCache[int, FillScope] = TTLCache(
+            maxsize=settings.scope_cache_size, ttl=settings.scope_cache_ttl
+        )
+        # Users as last written to telegram_user, so unchanged users are not written again
+        self._user_cache: TTLCache[int, User] = TTLCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+
+    @contextmanager
+    def bind_session(self, db_session: Session) -> Iterator[Session]:
+        """Makes every service call inside the block use db_session instead of a scoped one."""
+        token = _bound_db_session.set(db_session)
+        try:
+            yield db_session
+        finally:
+            _bound_db_session.reset(token)
 
     @contextmanager
     def db_session(self) -> Session:
+        bound_session = _bound_db_session.get()
+        if bound_session is not None:
+            yield bound_session
+            return
         db_session = self.DbSession()
         try:
             yield db_session
         finally:
             self.DbSession.remove()
 
+    @contextmanager
+    def replica_db_session(self) -> Session:
+        db_session = self.ReplicaDbSession()
+        try:
+            yield db_session
+        finally:
+            self.ReplicaDbSession.remove()
+
     def get_all_fills(self) -> list[Fill]:
         with self.db_session() as db_session:
-            return [f.to_entity_fill() for f in db_session.query(StoredCardFill).all()]
+            return [f.to_entity_fill() for f in db_session.query(StoredCardFill).options(*_FILL_LIST_OPTIONS)]
+
+    FILL_EXPORT_COLUMNS = DUMP_FILL_COLUMNS
+    INCOME_EXPORT_COLUMNS = (
+        "income_id", "scope_id", "user_id", "income_date", "amount", "description",
+        "currency", "original_amount", "original_currency",
+    )
+
+    def iter_fill_export_rows(
+        self, scope_id: Optional[int] = None, date_from: Optional[date] = None, date_to: Optional[date] = None
+    ) -> Iterator[tuple]:
+        """Streams card_fill rows in FILL_EXPORT_COLUMNS order without building ORM objects."""
+        stmt = (
+            select(
+                StoredCardFill.fill_id,
+                StoredCardFill.fill_scope,
+                StoredCardFill.user_id,
+                StoredCardFill.fill_date,
+                StoredCardFill.amount,
+                StoredCardFill.category_code,
+                StoredCardFill.description,
+                StoredCardFill.is_netted,
+            )
+            .where(*self._export_filters(StoredCardFill.fill_scope, StoredCardFill.fill_date, scope_id, date_from, date_to))
+            .order_by(StoredCardFill.fill_id)
+        )
+        yield from self._stream(stmt)
+
+    def iter_income_export_rows(
+        self, scope_id: Optional[int] = None, date_from: Optional[date] = None, date_to: Optional[date] = None
+    ) -> Iterator[tuple]:
+        """Streams income rows in INCOME_EXPORT_COLUMNS order without building ORM objects."""
+        stmt = (
+            select(
+                StoredIncome.income_id,
+                StoredIncome.fill_scope,
+                StoredIncome.user_id,
+                StoredIncome.income_date,
+                StoredIncome.amount,
+                StoredIncome.description,
+                StoredIncome.currency,
+                StoredIncome.original_amount,
+                StoredIncome.original_currency,
+            )
+            .where(*self._export_filters(StoredIncome.fill_scope, StoredIncome.income_date, scope_id, date_from, date_to))
+            .order_by(StoredIncome.income_id)
+        )
+        yield from self._stream(stmt)
+
+    def _stream(self, stmt: Select) -> Iterator[tuple]:
+        # yield_per makes the driver use a server-side cursor and fetch export_batch_size rows at a time
+        with self.db_session() as db_session:
+            result = db_session.execute(stmt.execution_options(yield_per=settings.export_batch_size))
+            for partition in result.partitions():
+                yield from partition
+
+    @staticmethod
+    def _export_filters(
+        scope_column: InstrumentedAttribute,
+        date_column: InstrumentedAttribute,
+        scope_id: Optional[int],
+        date_from: Optional[date],
+        date_to: Optional[date],
+    ) -> list[ColumnElement[bool]]:
+        filters = []
+        if scope_id is not None:
+            filters.append(scope_column == scope_id)
+        if date_from is not None:
+            filters.append(date_column >= datetime.combine(date_from, time.min))
+        if date_to is not None:
+            filters.append(date_column < datetime.combine(date_to + timedelta(days=1), time.min))
+        return filters
 
     def get_scope(self, chat_id: int) -> FillScope:
+        cached_scope = self._scope_cache.get(chat_id)
+        if cached_scope is not None:
+            return cached_scope
         with self.db_session() as db_session:
             scope: StoredFillScope = (
                 db_session.query(StoredFillScope)
@@ -52,37 +287,42 @@ class CardFillService:
                 .one_or_none()
             )
             self.logger.info(f"For chat {chat_id} identified scope {scope}")
-            return scope.to_entity_fill_scope()
+            fill_scope = scope.to_entity_fill_scope()
+            self._scope_cache.set(chat_id, fill_scope)
+            return fill_scope
+
+    def invalidate_scope(self, chat_id: Optional[int] = None) -> None:
+        """Drops the cached scope of a chat, or of every chat, after fill_scope rows change."""
+        self._scope_cache.invalidate(chat_id)
+
+    def scope_cache_stats(self) -> CacheStats:
+        return self._scope_cache.stats()
+
+    def pool_stats(self) -> Optional[PoolStats]:
+        return get_pool_stats("db", self._db_engine)
+
+    def replica_pool_stats(self) -> Optional[PoolStats]:
+        if self._replica_db_engine is None:
+            return None
+        return get_pool_stats("replica_db", self._replica_db_engine)
+
+    def routes_to_replica(self, scope: FillScope) -> bool:
+        """Whether a report of the scope may read from the replica, counted in the router stats."""
+        return self.replica_router.use_replica(self._get_scope_id_filter(scope))
 
     def handle_new_fill(self, fill: Fill) -> Fill:
         with self.db_session() as db_session:
-            user = db_session.query(StoredTelegramUser).get(fill.user.id)
-            if not user:
-                new_user = StoredTelegramUser(
-                    user_id=fill.user.id,
-                    is_bot=fill.user.is_bot,
-                    first_name=fill.user.first_name,
-                    last_name=fill.user.last_name,
-                    username=fill.user.username,
-                    language_code=fill.user.language_code,
-                )
-                db_session.add(new_user)
-                user = new_user
-                self.logger.info(f"Create new user {user}")
+            upserted_users = self._upsert_users(db_session, [fill.user])
 
-            category = StoredCategory.by_desc(
-                description=fill.description,
-                categories=db_session.query(StoredCategory).all(),
-                default=db_session.query(StoredCategory).get("OTHER"),
-            )
-            fill.category = category.to_entity_category()
+            category = self._get_category_snapshot(db_session).classifier.classify(fill.description)
+            fill.category = category
 
             if fill.currency:
-                currency = db_session.query(StoredCurrencyRate).get(fill.currency.value)
-                fill.amount = fill.amount * currency.rate
+                rate = self._get_currency_rate_snapshot(db_session).rates[fill.currency.value]
+                fill.amount = fill.amount * rate
 
             card_fill = StoredCardFill(
-                user_id=user.user_id,
+                user_id=fill.user.id,
                 fill_date=fill.fill_date,
                 amount=fill.amount,
                 description=fill.description,
@@ -92,33 +332,392 @@ class CardFillService:
             )
 
             db_session.add(card_fill)
-            db_session.commit()
+            deltas = [(self._rollup_key_of(card_fill), fill.amount, 1)]
+            self._add_to_rollup(db_session, deltas)
+            db_session.flush()
+            # Read the id before commit expires card_fill, which would reload it with its relationships
             fill.id = card_fill.fill_id
+            db_session.commit()
+            self._remember_users(upserted_users)
+            self._add_to_budget_usage(deltas)
+            self._reports_changed({(key[0], key[1]) for key, _, _ in deltas})
+            self._fills_added([fill])
+            self.replica_router.record_write(fill.scope.scope_id)
             self.logger.info(f"Save fill {fill}")
             return fill
 
+    def handle_new_fills(self, fills: list[Fill], ingest_keys: Optional[list[str]] = None) -> list[Fill]:
+        """Saves fills of one message with a single multi-row INSERT in one transaction.
+
+        Categories and currency conversion are resolved from one snapshot for the
+        whole batch, and the returned fills carry their new ids in input order.
+        ingest_keys, one per fill, are stored in the same transaction for ingest_fills.
+        """
+        if not fills:
+            return []
+        with self.db_session() as db_session:
+            upserted_users = self._upsert_users(db_session, [fill.user for fill in fills])
+            classifier = self._get_category_snapshot(db_session).classifier
+            rates = self._get_currency_rate_snapshot(db_session).rates if any(f.currency for f in fills) else None
+            for fill in fills:
+                fill.category = classifier.classify(fill.description)
+                if fill.currency:
+                    fill.amount = fill.amount * rates[fill.currency.value]
+
+            card_fill = StoredCardFill.__table__
+            # A core INSERT, so rows with and without a currency are not split into separate statements.
+            # Ids of one multi-row INSERT increase in VALUES order, so sorting them restores the input
+            # order without sort_by_parameter_order, which SQLite can only do one row at a time.
+            fill_ids = db_session.scalars(
+                insert(card_fill).returning(card_fill.c.fill_id),
+                [
+                    dict(
+                        user_id=fill.user.id,
+                        fill_date=fill.fill_date,
+                        amount=fill.amount,
+                        description=fill.description,
+                        category_code=fill.category.code,
+                        fill_scope=fill.scope.scope_id,
+                        currency=fill.currency.value if fill.currency else None,
+                        is_netted=False,
+                    )
+                    for fill in fills
+                ],
+            ).all()
+            for fill, fill_id in zip(fills, sorted(fill_ids)):
+                fill.id = fill_id
+            if ingest_keys is not None:
+                created_at = datetime.now()
+                db_session.execute(
+                    insert(StoredFillIngestKey.__table__),
+                    [
+                        dict(ingest_key=key, fill_id=fill.id, created_at=created_at)
+                        for key, fill in zip(ingest_keys, fills)
+                    ],
+                )
+            deltas = [
+                (
+                    self._rollup_key(
+                        fill.scope.scope_id, fill.fill_date.year, fill.fill_date.month,
+                        fill.category.code, fill.user.id, False,
+                    ),
+                    fill.amount,
+                    1,
+                )
+                for fill in fills
+            ]
+            self._add_to_rollup(db_session, deltas)
+            db_session.commit()
+            self._remember_users(upserted_users)
+            self._add_to_budget_usage(deltas)
+            self._reports_changed({(key[0], key[1]) for key, _, _ in deltas})
+            self._fills_added(fills)
+            self.replica_router.record_write(*{fill.scope.scope_id for fill in fills})
+            self.logger.info(f"Save {len(fills)} fills {[fill.id for fill in fills]}")
+            return fills
+
+    def ingest_fills(self, keyed_fills: list[tuple[str, Fill]]) -> dict[str, Optional[FillBudgetStatus]]:
+        """save_ingested_fills followed by the budget status of every fill, by key."""
+        fills = self.save_ingested_fills(keyed_fills)
+        stored = {key: fill for key, fill in fills.items() if fill is not None}
+        counters = self.read_budget_usage([(fill.category, fill.scope) for fill in stored.values()])
+        statuses = dict(zip(stored, self.fill_budget_statuses(list(stored.values()), counters)))
+        return {key: statuses.get(key) for key in fills}
+
+    def save_ingested_fills(self, keyed_fills: list[tuple[str, Fill]]) -> dict[str, Optional[Fill]]:
+        """Saves fills from the write-behind queue once per key and returns them by key.
+
+        A key saved before, by a batch whose queue entries were redelivered, gets the
+        fill stored for it then, or None when that fill was deleted since.
+        """
+        with self.db_session() as db_session, self.bind_session(db_session):
+            stored_ids = dict(
+                db_session.execute(
+                    select(StoredFillIngestKey.ingest_key, StoredFillIngestKey.fill_id).where(
+                        StoredFillIngestKey.ingest_key.in_([key for key, _ in keyed_fills])
+                    )
+                ).all()
+            )
+            new_fills: dict[str, Fill] = {}
+            for key, fill in keyed_fills:
+                if key not in stored_ids:
+                    new_fills.setdefault(key, fill)
+            fills: dict[str, Optional[Fill]] = dict(
+                zip(new_fills, self.handle_new_fills(list(new_fills.values()), list(new_fills)))
+            )
+            if stored_ids:
+                stored_fills = db_session.scalars(
+                    select(StoredCardFill)
+                    .options(*_FILL_ROW_OPTIONS)
+                    .where(StoredCardFill.fill_id.in_(stored_ids.values()))
+                ).all()
+                fills_by_id = {stored.fill_id: stored.to_entity_fill() for stored in stored_fills}
+                fills.update((key, fills_by_id.get(fill_id)) for key, fill_id in stored_ids.items())
+            return fills
+
+    def purge_ingest_keys(self, older_than: timedelta) -> int:
+        """Deletes idempotency keys of queued fills saved more than older_than ago, returns how many.
+
+        A key is only needed while its queue entry can still be redelivered, so
+        older_than must exceed how long an entry may stay pending.
+        """
+        with self.db_session() as db_session:
+            table = StoredFillIngestKey.__table__
+            result = db_session.execute(table.delete().where(table.c.created_at < datetime.now() - older_than))
+            db_session.commit()
+            if result.rowcount:
+                self.logger.info(f"Purged {result.rowcount} fill ingest keys older than {older_than}")
+            return result.rowcount
+
+    def _upsert_users(self, db_session: Session, users: Iterable[User]) -> list[User]:
+        """Inserts or refreshes the users that are not in the known-user cache as they are now.
+
+        One INSERT ... ON DUPLICATE KEY UPDATE covers new users and changed names, and
+        known unchanged users cost no statement. The returned users go to
+        _remember_users once the transaction is committed.
+        """
+        changed = {user.id: user for user in users if self._user_cache.get(user.id) != user}
+        if changed:
+            upsert(
+                db_session,
+                StoredTelegramUser.__table__,
+                [
+                    dict(
+                        user_id=user.id,
+                        is_bot=user.is_bot,
+                        first_name=user.first_name,
+                        last_name=user.last_name,
+                        username=user.username,
+                        language_code=user.language_code,
+                    )
+                    for user in changed.values()
+                ],
+                lambda proposed: dict(
+                    is_bot=proposed.is_bot,
+                    first_name=proposed.first_name,
+                    last_name=proposed.last_name,
+                    username=proposed.username,
+                    language_code=proposed.language_code,
+                ),
+            )
+            self.logger.info(f"Upsert users {list(changed)}")
+        return list(changed.values())
+
+    def _remember_users(self, users: list[User]) -> None:
+        for user in users:
+            self._user_cache.set(user.id, user)
+
+    def user_cache_stats(self) -> CacheStats:
+        return self._user_cache.stats()
+
+    def import_fills(
+        self,
+        rows: Iterable[ImportedFill],
+        users: Iterable[User] = (),
+        batch_size: Optional[int] = None,
+        on_progress: Optional[Callable[[ImportReport], None]] = None,
+    ) -> ImportReport:
+        """Saves imported rows in batches, each one transaction with an executemany INSERT.
+
+        Rows are classified, unless they carry a known category code, and converted
+        against one snapshot for the whole import. A row is a duplicate when a fill
+        with the same scope, user, date, amount in base currency and description is
+        stored already or came earlier in the file. Duplicates and rows with an
+        unknown scope, user or currency are left out and counted in the report,
+        which on_progress gets after every batch. users are registered first.
+        """
+        batch_size = batch_size or settings.import_batch_size
+        report = ImportReport()
+        seen: set[tuple] = set()
+        rows = iter(rows)
+        with self.db_session() as db_session:
+            upserted_users = self._upsert_users(db_session, users)
+            db_session.commit()
+            self._remember_users(upserted_users)
+            category_snapshot = self._get_category_snapshot(db_session)
+            category_codes = {category.code for category in category_snapshot.categories}
+            rates = self._get_currency_rate_snapshot(db_session).rates
+            scope_ids = set(db_session.scalars(select(StoredFillScope.scope_id)))
+            while batch := list(itertools.islice(rows, batch_size)):
+                known_user_ids = set(
+                    db_session.scalars(
+                        select(StoredTelegramUser.user_id)
+                        .where(StoredTelegramUser.user_id.in_({row.user_id for row in batch}))
+                    )
+                )
+                stored = self._stored_fill_keys(db_session, batch)
+                values, deltas, duplicate_lines, errors = [], [], [], []
+                for row in batch:
+                    if row.scope_id not in scope_ids:
+                        errors.append((row.line, f"unknown scope {row.scope_id}"))
+                        continue
+                    if row.user_id not in known_user_ids:
+                        errors.append((row.line, f"unknown user {row.user_id}"))
+                        continue
+                    if row.currency is not None and row.currency not in rates:
+                        errors.append((row.line, f"unknown currency {row.currency}"))
+                        continue
+                    amount = row.amount * rates[row.currency] if row.currency else row.amount
+                    key = self._fill_key(row.scope_id, row.user_id, row.fill_date, amount, row.description)
+                    if key in stored or key in seen:
+                        duplicate_lines.append(row.line)
+                        continue
+                    seen.add(key)
+                    if row.category_code in category_codes:
+                        category_code = row.category_code
+                    else:
+                        category_code = category_snapshot.classifier.classify(row.description).code
+                    values.append(
+                        dict(
+                            user_id=row.user_id,
+                            fill_date=row.fill_date,
+                            amount=amount,
+                            description=row.description,
+                            category_code=category_code,
+                            fill_scope=row.scope_id,
+                            currency=row.currency,
+                            is_netted=row.is_netted,
+                        )
+                    )
+                    deltas.append(
+                        (
+                            self._rollup_key(
+                                row.scope_id, row.fill_date.year, row.fill_date.month,
+                                category_code, row.user_id, row.is_netted,
+                            ),
+                            amount,
+                            1,
+                        )
+                    )
+                if values:
+                    db_session.execute(insert(StoredCardFill.__table__), values)
+                    self._add_to_rollup(db_session, deltas)
+                    db_session.commit()
+                    self._add_to_budget_usage(deltas)
+                    self._reports_changed({(key[0], key[1]) for key, _, _ in deltas})
+                    self.replica_router.record_write(*{v["fill_scope"] for v in values})
+                report = replace(
+                    report,
+                    processed=report.processed + len(batch),
+                    imported=report.imported + len(values),
+                    duplicates=report.duplicates + len(duplicate_lines),
+                    invalid=report.invalid + len(errors),
+                    duplicate_lines=(report.duplicate_lines + tuple(duplicate_lines))[:IMPORT_REPORT_SAMPLE],
+                    errors=(report.errors + tuple(errors))[:IMPORT_REPORT_SAMPLE],
+                )
+                if on_progress is not None:
+                    on_progress(report)
+        self.logger.info(f"Imported fills: {report}")
+        return report
+
+    @staticmethod
+    def _fill_key(scope_id: int, user_id: int, fill_date: datetime, amount: float, description: Optional[str]) -> tuple:
+        return scope_id, user_id, fill_date, round(amount, 2), description or ""
+
+    def _stored_fill_keys(self, db_session: Session, batch: list[ImportedFill]) -> set[tuple]:
+        """Duplicate keys of stored fills in the scopes and date range of the batch."""
+        rows = db_session.execute(
+            select(
+                StoredCardFill.fill_scope,
+                StoredCardFill.user_id,
+                StoredCardFill.fill_date,
+                StoredCardFill.amount,
+                StoredCardFill.description,
+            )
+            .where(StoredCardFill.fill_scope.in_({row.scope_id for row in batch}))
+            .where(
+                StoredCardFill.fill_date.between(min(row.fill_date for row in batch), max(row.fill_date for row in batch))
+            )
+        )
+        return {self._fill_key(*row) for row in rows}
+
+    def _get_category_snapshot(self, db_session: Session) -> CategorySnapshot:
+        def load(version: int) -> CategorySnapshot:
+            categories = tuple(cat.to_entity_category() for cat in db_session.query(StoredCategory).all())
+            default = next(cat for cat in categories if cat.code == "OTHER")
+            return CategorySnapshot(
+                version=version,
+                categories=categories,
+                classifier=CategoryClassifier(categories, default),
+            )
+
+        return self._reference_data.get("categories", load)
+
+    def _get_currency_rate_snapshot(self, db_session: Session) -> CurrencyRateSnapshot:
+        def load(version: int) -> CurrencyRateSnapshot:
+            rates = {rate.currency: rate.rate for rate in db_session.query(StoredCurrencyRate).all()}
+            return CurrencyRateSnapshot(version=version, rates=MappingProxyType(rates))
+
+        return self._reference_data.get("currency_rates", load)
+
+    def _get_budget_snapshot(self, db_session: Session, scope_id: int) -> BudgetSnapshot:
+        def load(version: int) -> BudgetSnapshot:
+            budgets = tuple(
+                sb.to_entity_budget()
+                for sb in db_session.query(StoredBudget).filter(StoredBudget.fill_scope == scope_id).all()
+            )
+            return BudgetSnapshot(
+                version=version,
+                budgets=budgets,
+                by_category_code=MappingProxyType({budget.category.code: budget for budget in budgets}),
+            )
+
+        return self._reference_data.get(f"budgets_{scope_id}", load)
+
+    def get_category_snapshot(self) -> CategorySnapshot:
+        with self.db_session() as db_session:
+            return self._get_category_snapshot(db_session)
+
+    def invalidate_categories(self) -> None:
+        """Drops cached categories on every replica and the cached reports that name them."""
+        self._reference_data.bump("categories")
+        if self._report_cache is not None:
+            call_redis(self._report_cache.bump_all)
+
+    def invalidate_currency_rates(self) -> None:
+        """Drops cached currency rates on every replica after currency_rate rows change."""
+        self._reference_data.bump("currency_rates")
+
+    def invalidate_budgets(self, scope: FillScope) -> None:
+        """Drops cached budgets of a scope on every replica after budget rows change."""
+        self._reference_data.bump(f"budgets_{scope.scope_id}")
+        if self._report_cache is not None:
+            call_redis(self._report_cache.bump_scope, scope.scope_id)
+
     def get_fill_by_id(self, fill_id: int) -> Fill:
         with self.db_session() as db_session:
-            return db_session.query(StoredCardFill).get(fill_id).to_entity_fill()
+            return db_session.get(StoredCardFill, fill_id, options=_FILL_ROW_OPTIONS).to_entity_fill()
 
     def delete_fill(self, fill: Fill) -> None:
         with self.db_session() as db_session:
-            fill_obj = db_session.query(StoredCardFill).get(fill.id)
+            fill_obj = db_session.get(StoredCardFill, fill.id, options=_FILL_WRITE_OPTIONS)
+            deltas = [(self._rollup_key_of(fill_obj), -fill_obj.amount, -1)]
+            self._add_to_rollup(db_session, deltas)
             db_session.delete(fill_obj)
             db_session.commit()
+            self._add_to_budget_usage(deltas)
+            self._reports_changed({(key[0], key[1]) for key, _, _ in deltas})
+            self._fills_changed(fill.scope.scope_id)
+            self.replica_router.record_write(fill.scope.scope_id)
             self.logger.info(f"Delete fill {fill}")
 
     def change_date_for_fill(self, fill: Fill, dt: datetime) -> None:
         with self.db_session() as db_session:
-            fill_obj = db_session.query(StoredCardFill).get(fill.id)
+            fill_obj = db_session.get(StoredCardFill, fill.id, options=_FILL_WRITE_OPTIONS)
+            old_key = self._rollup_key_of(fill_obj)
             fill_obj.fill_date = dt
             db_session.add(fill_obj)
+            deltas = [(old_key, -fill_obj.amount, -1), (self._rollup_key_of(fill_obj), fill_obj.amount, 1)]
+            self._add_to_rollup(db_session, deltas)
             db_session.commit()
-            self.logger.info(f"Changed date for fill {fill_obj}")
+            self._add_to_budget_usage(deltas)
+            self._reports_changed({(key[0], key[1]) for key, _, _ in deltas})
+            self._fills_changed(fill.scope.scope_id)
+            self.replica_router.record_write(fill.scope.scope_id)
+            self.logger.info(f"Changed date for fill {fill.id} to {dt}")
 
     def list_categories(self) -> list[Category]:
-        with self.db_session() as db_session:
-            return [cat.to_entity_category() for cat in db_session.query(StoredCategory).all()]
+        return list(self.get_category_snapshot().categories)
 
     def create_new_category(self, category: Category) -> Category:
         with self.db_session() as db_session:
@@ -130,6 +729,7 @@ class CardFillService:
             )
             db_session.add(stored_category)
             db_session.commit()
+            self.invalidate_categories()
             self.logger.info(f"Create category {stored_category}")
             return stored_category.to_entity_category()
 
@@ -137,10 +737,15 @@ class CardFillService:
         self, fill_id: int, target_category_code: str
     ) -> Fill:
         with self.db_session() as db_session:
-            fill: StoredCardFill = db_session.query(StoredCardFill).get(fill_id)
-            category: StoredCategory = db_session.query(StoredCategory).get(target_category_code)
+            fill: StoredCardFill = db_session.get(StoredCardFill, fill_id, options=_FILL_ROW_OPTIONS)
+            category: StoredCategory = db_session.get(StoredCategory, target_category_code)
             old_category = fill.category
+            old_aliases = category.aliases
+            old_key = self._rollup_key_of(fill)
+            fill.category = category
             fill.category_code = category.code
+            deltas = [(old_key, -fill.amount, -1), (self._rollup_key_of(fill), fill.amount, 1)]
+            self._add_to_rollup(db_session, deltas)
             if (
                 old_category.code == "OTHER"
                 and category.code != "OTHER"
@@ -148,85 +753,162 @@ class CardFillService:
             ):
                 category.add_alias(fill.description.lower())
                 self.logger.info(f"Add alias {fill.description} to category {category}")
+            # Built before commit, which would expire the row and reload it with its relationships
+            changed_fill = fill.to_entity_fill()
+            aliases_changed = category.aliases != old_aliases
             db_session.commit()
-            self.logger.info(f"Change category for fill {fill} to {category}")
-            return fill.to_entity_fill()
+            self._add_to_budget_usage(deltas)
+            self._reports_changed({(key[0], key[1]) for key, _, _ in deltas})
+            self._fills_changed(changed_fill.scope.scope_id)
+            self.replica_router.record_write(changed_fill.scope.scope_id)
+            if aliases_changed:
+                self.invalidate_categories()
+            self.logger.info(f"Change category for fill {fill_id} to {target_category_code}")
+            return changed_fill
 
+    @_replica_read
     def get_monthly_report_by_category(
         self, months: list[Month], year: int, scope: FillScope
     ) -> dict[Month, list[CategorySumOverPeriod]]:
         with self.db_session() as db_session:
-            fills: list[StoredCardFill] = (
-                db_session.query(StoredCardFill)
-                .filter(StoredCardFill.fill_scope.in_(self._get_scope_id_filter(scope)))
-                .filter(extract("year", StoredCardFill.fill_date) == year)
-                .all()
-            )
-
-            monthly_data: dict[Month, dict[Category, float]] = defaultdict(
-                lambda: defaultdict(float)
+            if self._fill_columns is not None:
+                category_codes, matrix = self._category_matrix_from_columns(db_session, year, scope)
+            else:
+                category_codes, matrix = self._category_matrix_from_rollup(db_session, year, scope)
+            present = matrix.present()
+            present_codes = [category_codes[group] for group in present]
+            stored_categories = (
+                db_session.query(StoredCategory).filter(StoredCategory.code.in_(present_codes)).all()
+                if present_codes else []
             )
-            quarter_data: dict[Quarter, dict[Category, float]] = defaultdict(lambda: defaultdict(float))
-            year_data: dict[Category, float] = defaultdict(float)
-            for fill in fills:
-                fill_month = Month(fill.fill_date.month)
-                fill_quarter = Quarter.from_month(fill_month)
-                fill_category = fill.category.to_entity_category()
-                monthly_data[fill_month][fill_category] += fill.amount
-                quarter_data[fill_quarter][fill_category] += fill.amount
-                year_data[fill_category] += fill.amount
+            categories_by_code = {cat.code: cat.to_entity_category() for cat in stored_categories}
 
             ret: dict[Month, list[CategorySumOverPeriod]] = defaultdict(list)
             budgets = {budget.category.code: budget for budget in self.list_budgets(scope)}
-            categories = year_data.keys()
+            year_sums = matrix.year()
             for month in months:
                 quarter = Quarter.from_month(month)
-                mdata = monthly_data[month]
-                qdata = quarter_data[quarter]
-                for category in categories:
-                    budget = budgets.get(category.code)
+                month_sums = matrix.month(month)
+                quarter_sums = matrix.quarter(quarter)
+                for group, category_code in zip(present, present_codes):
+                    category = categories_by_code[category_code]
+                    budget = budgets.get(category_code)
                     ret[month].append(
                         CategorySumOverPeriod(
                             category=category,
                             month=month,
                             quarter=quarter,
                             year=year,
-                            amount=mdata.get(category, 0),
+                            amount=float(month_sums[group]),
                             monthly_limit=budget.monthly_limit if budget else None,
-                            quarter_amount=qdata.get(category, 0),
+                            quarter_amount=float(quarter_sums[group]),
                             quarter_limit=budget.quarter_limit if budget else None,
-                            year_amount=year_data.get(category, 0),
+                            year_amount=float(year_sums[group]),
                             year_limit=budget.year_limit if budget else None,
                         )
                     )
             return ret
 
+    def _category_matrix_from_rollup(
+        self, db_session: Session, year: int, scope: FillScope
+    ) -> tuple[list[str], MonthMatrix]:
+        rows = (
+            db_session.query(
+                StoredCardFillRollup.month,
+                StoredCardFillRollup.category_code,
+                func.sum(StoredCardFillRollup.amount_sum),
+            )
+            .filter(StoredCardFillRollup.fill_scope.in_(self._get_scope_id_filter(scope)))
+            .filter(StoredCardFillRollup.year == year)
+            .group_by(StoredCardFillRollup.month, StoredCardFillRollup.category_code)
+            .all()
+        )
+        category_codes, code_index = np.unique(
+            np.array([category_code for _, category_code, _ in rows], dtype=object), return_inverse=True
+        )
+        matrix = MonthMatrix(
+            np.array([month - 1 for month, _, _ in rows], dtype=np.intp),
+            code_index,
+            np.array([amount for _, _, amount in rows], dtype=np.float64),
+            len(category_codes),
+        )
+        return category_codes.tolist(), matrix
+
+    def _category_matrix_from_columns(
+        self, db_session: Session, year: int, scope: FillScope
+    ) -> tuple[list[str], MonthMatrix]:
+        columns = FillColumns.concat(
+            [self._fill_columns.columns(db_session, scope_id) for scope_id in self._get_scope_id_filter(scope)]
+        )
+        category_codes = self._fill_columns.category_codes
+        return category_codes, columns.year_matrix(year, columns.category_id, len(category_codes))
+
+    def _reports_changed(self, scope_years: set[tuple[int, int]]) -> None:
+        """Outdates cached report snapshots of the (scope_id, year) pairs a commit wrote to."""
+        if self._report_cache is not None:
+            call_redis(self._report_cache.bump_years, scope_years)
+
+    def _fills_changed(self, *scope_ids: int) -> None:
+        """Drops columnar fills of scopes after fills were edited or deleted; new fills are picked up by fill_id."""
+        if self._fill_columns is not None:
+            self._fill_columns.invalidate(*scope_ids)
+
+    def _fills_added(self, fills: list[Fill]) -> None:
+        """Lets the columnar store drop scopes that loaded fills above the ids just committed."""
+        if self._fill_columns is not None:
+            fill_ids = defaultdict(list)
+            for fill in fills:
+                fill_ids[fill.scope.scope_id].append(fill.id)
+            for scope_id, ids in fill_ids.items():
+                self._fill_columns.added(scope_id, ids)
+
     def _get_scope_id_filter(self, scope: FillScope) -> list[int]:
         if scope.report_scopes:
             return scope.report_scopes
         return [scope.scope_id]
 
+    def _period_filter(
+        self, column: InstrumentedAttribute, year: int, months: Optional[list[Month]] = None
+    ) -> ColumnElement[bool]:
+        """Half-open datetime ranges covering the months of the year, so the date index can be used."""
+        if months is None:
+            return and_(column >= datetime(year, 1, 1), column < datetime(year + 1, 1, 1))
+        ranges: list[list[int]] = []
+        for month_number in sorted({m.value for m in months}):
+            if ranges and ranges[-1][1] == month_number:
+                ranges[-1][1] = month_number + 1
+            else:
+                ranges.append([month_number, month_number + 1])
+        month_ranges = [
+            and_(column >= self._month_start(year, start), column < self._month_start(year, end))
+            for start, end in ranges
+        ]
+        if len(month_ranges) == 1:
+            return month_ranges[0]
+        # The enclosing range keeps the index usable for planners that do not split ORs into ranges
+        return and_(
+            column >= self._month_start(year, ranges[0][0]),
+            column < self._month_start(year, ranges[-1][1]),
+            or_(*month_ranges),
+        )
+
+    @staticmethod
+    def _month_start(year: int, month_number: int) -> datetime:
+        if month_number > 12:
+            return datetime(year + 1, month_number - 12, 1)
+        return datetime(year, month_number, 1)
+
+    @_replica_read
     def get_monthly_report_by_user(
         self, months: list[Month], year: int, scope: FillScope
     ) -> dict[Month, list[UserSumOverPeriod]]:
         with self.db_session() as db_session:
-            fills: list[StoredCardFill] = (
-                db_session.query(StoredCardFill)
-                .filter(StoredCardFill.fill_scope.in_(self._get_scope_id_filter(scope)))
-                .filter(extract("year", StoredCardFill.fill_date) == year)
-                .filter(
-                    extract("month", StoredCardFill.fill_date).in_([m.value for m in months])
-                )
-                .all()
-            )
-
-            data: dict[Month, dict[User, float]] = defaultdict(
-                lambda: defaultdict(float)
+            data = self._sum_by_month_and_user(
+                db_session,
+                StoredCardFillRollup.fill_scope.in_(self._get_scope_id_filter(scope)),
+                StoredCardFillRollup.year == year,
+                StoredCardFillRollup.month.in_([m.value for m in months]),
             )
-            for fill in fills:
-                fill_month = Month(fill.fill_date.month)
-                fill_user = fill.user.to_entity_user()
-                data[fill_month][fill_user] += fill.amount
 
             ret: dict[Month, list[UserSumOverPeriod]] = defaultdict(list)
             for month, mdata in data.items():
@@ -234,29 +916,19 @@ class CardFillService:
                     ret[month].append(UserSumOverPeriod(user=user, amount=amount))
             return ret
 
+    @_replica_read
     def get_debt_monthly_report_by_user(
         self, months: list[Month], year: int, scope: FillScope
     ) -> dict[Month, list[UserSumOverPeriodWithBalance]]:
         with self.db_session() as db_session:
-            fills: list[StoredCardFill] = (
-                db_session.query(StoredCardFill)
-                .filter(StoredCardFill.fill_scope == scope.scope_id)
-                .filter(extract("year", StoredCardFill.fill_date) == year)
-                .filter(
-                    extract("month", StoredCardFill.fill_date).in_([m.value for m in months])
-                )
-                .filter(StoredCardFill.is_netted.is_(False))
-                .all()
+            data = self._sum_by_month_and_user(
+                db_session,
+                StoredCardFillRollup.fill_scope == scope.scope_id,
+                StoredCardFillRollup.year == year,
+                StoredCardFillRollup.month.in_([m.value for m in months]),
+                StoredCardFillRollup.is_netted.is_(False),
             )
 
-            data: dict[Month, dict[User, float]] = defaultdict(
-                lambda: defaultdict(float)
-            )
-            for fill in fills:
-                fill_month = Month(fill.fill_date.month)
-                fill_user = fill.user.to_entity_user()
-                data[fill_month][fill_user] += fill.amount
-
             ret: dict[Month, list[UserSumOverPeriodWithBalance]] = defaultdict(list)
             for month, mdata in data.items():
                 month_total = sum(mdata.values())
@@ -271,6 +943,35 @@ class CardFillService:
                     )
             return ret
 
+    def _sum_by_month_and_user(
+        self, db_session: Session, *rollup_filters: ColumnElement[bool]
+    ) -> dict[Month, dict[User, float]]:
+        """Rollup sums per (month, user) joined to telegram_user in one statement."""
+        sums = (
+            select(
+                StoredCardFillRollup.month,
+                StoredCardFillRollup.user_id,
+                func.sum(StoredCardFillRollup.amount_sum).label("amount"),
+            )
+            .where(*rollup_filters)
+            .group_by(StoredCardFillRollup.month, StoredCardFillRollup.user_id)
+            .subquery()
+        )
+        rows = (
+            db_session.query(sums.c.month, StoredTelegramUser, sums.c.amount)
+            .join(StoredTelegramUser, StoredTelegramUser.user_id == sums.c.user_id)
+            .order_by(sums.c.month, sums.c.user_id)
+            .all()
+        )
+
+        data: dict[Month, dict[User, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        for month_number, stored_user, amount in rows:
+            data[Month(month_number)][stored_user.to_entity_user()] += amount
+        return data
+
+    @_replica_read
     def get_monthly_report(
         self, months: list[Month], year: int, scope: FillScope
     ) -> dict[Month, SummaryOverPeriod]:
@@ -286,6 +987,7 @@ class CardFillService:
             )
         return res
 
+    @_replica_read
     def get_user_fills_in_months(
         self, user: User, months: list[Month], year: int, scope: FillScope
     ) -> list[Fill]:
@@ -294,78 +996,413 @@ class CardFillService:
                 db_session.query(StoredCardFill)
                 .filter(StoredCardFill.fill_scope == scope.scope_id)
                 .filter(StoredCardFill.user_id == user.id)
-                .filter(extract("year", StoredCardFill.fill_date) == year)
-                .filter(
-                    extract("month", StoredCardFill.fill_date).in_([m.value for m in months])
-                )
+                .filter(self._period_filter(StoredCardFill.fill_date, year, months))
+                .options(*_FILL_LIST_OPTIONS)
             )
             return [f.to_entity_fill() for f in fills]
 
     def get_budget_for_category(self, category: Category, scope: FillScope) -> Optional[Budget]:
         with self.db_session() as db_session:
-            budget = (
-                db_session.query(StoredBudget)
-                .filter(StoredBudget.category_code == category.code)
-                .filter(StoredBudget.fill_scope == scope.scope_id)
-                .one_or_none()
-            )
-            if budget:
-                return budget.to_entity_budget()
-            return None
+            return self._get_budget_snapshot(db_session, scope.scope_id).by_category_code.get(category.code)
 
     def list_budgets(self, scope: FillScope) -> list[Budget]:
         with self.db_session() as db_session:
-            budgets: list[StoredBudget] = (
-                db_session.query(StoredBudget)
-                .filter(StoredBudget.fill_scope == scope.scope_id)
-                .all()
-            )
-            return [sb.to_entity_budget() for sb in budgets]
+            return list(self._get_budget_snapshot(db_session, scope.scope_id).budgets)
 
     def get_current_budget_usage_for_category(
         self, category: Category, scope: FillScope
     ) -> Optional[CategorySumOverPeriod]:
+        [counters] = self.read_budget_usage([(category, scope)])
+        return self.category_usage(category, scope, counters)
+
+    def handle_new_fill_with_budget_status(self, fill: Fill) -> FillBudgetStatus:
+        """handle_new_fill followed by the budget and current usage of the fill category."""
+        fill = self.handle_new_fill(fill)
+        [status] = self.fill_budget_statuses([fill], self.read_budget_usage([(fill.category, fill.scope)]))
+        return status
+
+    def change_category_for_fill_with_budget_status(
+        self, fill_id: int, target_category_code: str
+    ) -> FillBudgetStatus:
+        fill = self.change_category_for_fill(fill_id, target_category_code)
+        [status] = self.fill_budget_statuses([fill], self.read_budget_usage([(fill.category, fill.scope)]))
+        return status
+
+    def read_budget_usage(
+        self, targets: list[tuple[Category, FillScope]]
+    ) -> list[BudgetUsage]:
+        """Current month, quarter and year usage of each (category, scope) from the redis counters.
+
+        Only redis is read, a UsageMiss stands for counters that are not built and
+        None for counters that could not be read. The async service runs it on the
+        redis executor and hands the result to category_usage or
+        fill_budget_statuses, which only use the database and rebuild the
+        counters after a miss.
+        """
+        if self._budget_usage is None:
+            return [None] * len(targets)
         current_month, current_year = Month(datetime.now().month), datetime.now().year
-        current_month_usage_by_category = self.get_monthly_report_by_category(
-            months=[current_month], year=current_year, scope=scope
-        )[current_month]
-        return next(
-            filter(
-                lambda cat_data: cat_data.category.code == category.code,
-                current_month_usage_by_category,
-            ),
-            None,
+        return [
+            self._budget_usage.get_usage(self._get_scope_id_filter(scope), current_year, current_month, category.code)
+            for category, scope in targets
+        ]
+
+    def category_usage(
+        self, category: Category, scope: FillScope, counters: BudgetUsage
+    ) -> CategorySumOverPeriod:
+        """Current usage of the category with its budget, counters as returned by read_budget_usage."""
+        with self.db_session() as db_session:
+            return self._current_category_usage(db_session, category, scope, counters)
+
+    def fill_budget_statuses(
+        self, fills: list[Fill], counters: list[BudgetUsage]
+    ) -> list[FillBudgetStatus]:
+        """Budget and current usage of each fill category, counters as returned by read_budget_usage."""
+        with self.db_session() as db_session:
+            return [
+                FillBudgetStatus(
+                    fill=fill,
+                    budget=self._get_budget_snapshot(db_session, fill.scope.scope_id).by_category_code.get(
+                        fill.category.code
+                    ),
+                    usage=self._current_category_usage(db_session, fill.category, fill.scope, fill_counters),
+                )
+                for fill, fill_counters in zip(fills, counters)
+            ]
+
+    def _current_category_usage(
+        self,
+        db_session: Session,
+        category: Category,
+        scope: FillScope,
+        counters: BudgetUsage,
+    ) -> CategorySumOverPeriod:
+        """Month, quarter and year usage of one category, from redis counters when they are built."""
+        current_month, current_year = Month(datetime.now().month), datetime.now().year
+        current_quarter = Quarter.from_month(current_month)
+        budget = self._get_budget_snapshot(db_session, scope.scope_id).by_category_code.get(category.code)
+        if isinstance(counters, tuple):
+            amount, quarter_amount, year_amount = counters
+        elif isinstance(counters, UsageMiss) and self._budget_usage is not None:
+            amount, quarter_amount, year_amount = self._category_usage_rebuilding_counters(
+                db_session, category, scope, current_year, current_month, counters
+            )
+        else:
+            amount, quarter_amount, year_amount = self._category_usage_from_rollup(
+                db_session, category, scope, current_year, current_month
+            )
+        return CategorySumOverPeriod(
+            category=category,
+            month=current_month,
+            quarter=current_quarter,
+            year=current_year,
+            amount=amount,
+            monthly_limit=budget.monthly_limit if budget else None,
+            quarter_amount=quarter_amount,
+            quarter_limit=budget.quarter_limit if budget else None,
+            year_amount=year_amount,
+            year_limit=budget.year_limit if budget else None,
+        )
+
+    def _category_usage_rebuilding_counters(
+        self, db_session: Session, category: Category, scope: FillScope, year: int, month: Month, miss: UsageMiss
+    ) -> tuple[float, float, float]:
+        """Usage of one category from the rollup after a counter miss, rebuilding the missing counters from it.
+
+        Every category of the scopes and year is read, the same rows fill the
+        counters, so the next budget check of any category is served by redis.
+        """
+        scope_ids = self._get_scope_id_filter(scope)
+        rows = self._budget_usage_rows(db_session, scope_ids, year)
+        call_redis(self._budget_usage.rebuild_missing, miss, rows)
+        quarter = Quarter.from_month(month)
+        monthly_amounts: dict[int, float] = defaultdict(float)
+        for _, _, row_month, category_code, amount in rows:
+            if category_code == category.code:
+                monthly_amounts[row_month] += amount
+        return (
+            monthly_amounts.get(month.value, 0),
+            sum(amount for m, amount in monthly_amounts.items() if Quarter.from_month(Month(m)) == quarter),
+            sum(monthly_amounts.values()),
+        )
+
+    def _category_usage_from_rollup(
+        self, db_session: Session, category: Category, scope: FillScope, year: int, month: Month
+    ) -> tuple[float, float, float]:
+        """Month, quarter and year usage of one category from its at most twelve monthly rollup sums."""
+        quarter = Quarter.from_month(month)
+        monthly_amounts: dict[int, float] = dict(
+            db_session.query(StoredCardFillRollup.month, func.sum(StoredCardFillRollup.amount_sum))
+            .filter(StoredCardFillRollup.fill_scope.in_(self._get_scope_id_filter(scope)))
+            .filter(StoredCardFillRollup.year == year)
+            .filter(StoredCardFillRollup.category_code == category.code)
+            .group_by(StoredCardFillRollup.month)
+            .all()
+        )
+        return (
+            monthly_amounts.get(month.value, 0),
+            sum(amount for m, amount in monthly_amounts.items() if Quarter.from_month(Month(m)) == quarter),
+            sum(monthly_amounts.values()),
         )
 
-    def net_balances(self, scope: FillScope) -> None:
+    def net_balances(self, scope: FillScope, record_batch: bool = True) -> NettingBatch:
+        """Marks every un-netted fill of the scope as netted with one UPDATE.
+
+        With record_batch the fills are stamped with a new batch id and the netting
+        time, so the batch can be audited and undone with rollback_netting.
+        """
+        batch = NettingBatch(
+            batch_id=str(uuid.uuid4()) if record_batch else None,
+            scope_id=scope.scope_id,
+            netted_at=datetime.now(),
+            fill_count=0,
+        )
+        scope_ids = self._get_scope_id_filter(scope)
         with self.db_session() as db_session:
-            fills = (
+            # Locking the un-netted rollup rows first makes concurrent fills wait for the netting
+            unnetted_rollup_query = (
+                db_session.query(StoredCardFillRollup)
+                .filter(StoredCardFillRollup.fill_scope.in_(scope_ids))
+                .filter(StoredCardFillRollup.is_netted.is_(False))
+            )
+            moved_to_netted = [
+                (self._rollup_key(r.fill_scope, r.year, r.month, r.category_code, r.user_id, True), r.amount_sum, r.fill_count)
+                for r in unnetted_rollup_query.with_for_update().all()
+            ]
+            values = {StoredCardFill.is_netted: True}
+            if record_batch:
+                values[StoredCardFill.netting_batch_id] = batch.batch_id
+                values[StoredCardFill.netted_at] = batch.netted_at
+            fill_count = (
                 db_session.query(StoredCardFill)
-                .filter(StoredCardFill.fill_scope.in_(self._get_scope_id_filter(scope)))
+                .filter(StoredCardFill.fill_scope.in_(scope_ids))
                 .filter(StoredCardFill.is_netted == False)
-                .all()
+                .update(values, synchronize_session=False)
             )
-            for fill in fills:
-                fill.is_netted = True
-                db_session.add(fill)
+            unnetted_rollup_query.delete(synchronize_session=False)
+            self._add_to_rollup(db_session, moved_to_netted)
             db_session.commit()
-            self.logger.info(f"Net {len(fills)} balances for scope {scope.scope_id}")
+            self.replica_router.record_write(*scope_ids)
+            batch = replace(batch, fill_count=fill_count)
+            self.logger.info(f"Net {fill_count} balances for scope {scope.scope_id} in batch {batch.batch_id}")
+            return batch
 
-    def handle_new_income(self, income: Income) -> Income:
+    def rollback_netting(self, batch_id: str) -> int:
+        """Returns the fills of a netting batch to the balance, returns their count."""
+        with self.db_session() as db_session:
+            batch_filter = StoredCardFill.netting_batch_id == batch_id
+            rollup_deltas = []
+            for scope_id, year, month, category_code, user_id, amount, count in (
+                db_session.query(
+                    StoredCardFill.fill_scope,
+                    extract("year", StoredCardFill.fill_date),
+                    extract("month", StoredCardFill.fill_date),
+                    StoredCardFill.category_code,
+                    StoredCardFill.user_id,
+                    func.sum(StoredCardFill.amount),
+                    func.count(),
+                )
+                .filter(batch_filter)
+                .group_by(
+                    StoredCardFill.fill_scope,
+                    extract("year", StoredCardFill.fill_date),
+                    extract("month", StoredCardFill.fill_date),
+                    StoredCardFill.category_code,
+                    StoredCardFill.user_id,
+                )
+            ):
+                rollup_deltas.append((self._rollup_key(scope_id, year, month, category_code, user_id, True), -amount, -count))
+                rollup_deltas.append((self._rollup_key(scope_id, year, month, category_code, user_id, False), amount, count))
+            fill_count = (
+                db_session.query(StoredCardFill)
+                .filter(batch_filter)
+                .update(
+                    {
+                        StoredCardFill.is_netted: False,
+                        StoredCardFill.netting_batch_id: None,
+                        StoredCardFill.netted_at: None,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            self._add_to_rollup(db_session, rollup_deltas)
+            db_session.commit()
+            self.replica_router.record_write(*{key[0] for key, _, _ in rollup_deltas})
+            self.logger.info(f"Rolled back netting batch {batch_id} of {fill_count} fills")
+            return fill_count
+
+    @staticmethod
+    def _rollup_key(
+        scope_id: int, year: int, month: int, category_code: str, user_id: int, is_netted: bool
+    ) -> tuple[int, int, int, str, int, bool]:
+        return scope_id, year, month, category_code, user_id, bool(is_netted)
+
+    def _rollup_key_of(self, fill: StoredCardFill) -> tuple[int, int, int, str, int, bool]:
+        return self._rollup_key(
+            fill.fill_scope, fill.fill_date.year, fill.fill_date.month, fill.category_code, fill.user_id, fill.is_netted
+        )
+
+    def _add_to_rollup(
+        self, db_session: Session, deltas: list[tuple[tuple[int, int, int, str, int, bool], float, int]]
+    ) -> None:
+        """Applies (rollup key, amount, count) deltas in the current transaction."""
+        merged: dict[tuple, list[float]] = defaultdict(lambda: [0.0, 0])
+        for key, amount, count in deltas:
+            merged[key][0] += amount
+            merged[key][1] += count
+        changes = {key: delta for key, delta in merged.items() if delta[1] != 0 or delta[0] != 0}
+        if not changes:
+            return
+
+        rollup = StoredCardFillRollup.__table__
+        key_columns = ("fill_scope", "year", "month", "category_code", "user_id", "is_netted")
+        upsert(
+            db_session,
+            rollup,
+            [dict(zip(key_columns, key), amount_sum=amount, fill_count=count) for key, (amount, count) in changes.items()],
+            lambda proposed: dict(
+                amount_sum=rollup.c.amount_sum + proposed.amount_sum,
+                fill_count=rollup.c.fill_count + proposed.fill_count,
+            ),
+        )
+        for key, (_, count) in changes.items():
+            if count < 0:
+                db_session.execute(
+                    rollup.delete()
+                    .where(*(rollup.c[column] == value for column, value in zip(key_columns, key)))
+                    .where(rollup.c.fill_count <= 0)
+                )
+
+    def _add_to_budget_usage(self, deltas: list[tuple[tuple[int, int, int, str, int, bool], float, int]]) -> None:
+        """Mirrors committed rollup deltas into the redis budget usage counters."""
+        if self._budget_usage is None:
+            return
+        call_redis(
+            self._budget_usage.add,
+            [
+                (scope_id, year, month, category_code, amount)
+                for (scope_id, year, month, category_code, _, _), amount, _ in deltas
+            ],
+        )
+
+    def reconcile_budget_usage(self, scope_ids: Optional[list[int]] = None) -> None:
+        """Rebuilds the redis budget usage counters of every year in the rollup and of the current year."""
+        if self._budget_usage is None:
+            raise ValueError("Budget usage store is not configured")
+        with self.db_session() as db_session:
+            scope_query = db_session.query(StoredFillScope.scope_id)
+            if scope_ids is not None:
+                scope_query = scope_query.filter(StoredFillScope.scope_id.in_(scope_ids))
+            rows = self._budget_usage_rows(db_session, scope_ids)
+            current_year = datetime.now().year
+            scope_years = {(scope_id, current_year) for scope_id, in scope_query}
+            scope_years.update((scope_id, year) for scope_id, year, _, _, _ in rows)
+            call_redis(self._budget_usage.rebuild, scope_years, rows)
+            self.logger.info(f"Reconciled budget usage counters for scopes {scope_ids or 'all'}")
+
+    def _budget_usage_rows(
+        self, db_session: Session, scope_ids: Optional[list[int]], year: Optional[int] = None
+    ) -> list[tuple[int, int, int, str, float]]:
+        """(scope_id, year, month, category_code, amount) rollup sums, the rows BudgetUsageStore builds from."""
+        query = db_session.query(
+            StoredCardFillRollup.fill_scope,
+            StoredCardFillRollup.year,
+            StoredCardFillRollup.month,
+            StoredCardFillRollup.category_code,
+            func.sum(StoredCardFillRollup.amount_sum),
+        )
+        if scope_ids is not None:
+            query = query.filter(StoredCardFillRollup.fill_scope.in_(scope_ids))
+        if year is not None:
+            query = query.filter(StoredCardFillRollup.year == year)
+        rows = query.group_by(
+            StoredCardFillRollup.fill_scope,
+            StoredCardFillRollup.year,
+            StoredCardFillRollup.month,
+            StoredCardFillRollup.category_code,
+        ).all()
+        return [tuple(row) for row in rows]
+
+    def _expected_rollup_query(self, db_session: Session, scope_ids: Optional[list[int]]):
+        fill_year = extract("year", StoredCardFill.fill_date)
+        fill_month = extract("month", StoredCardFill.fill_date)
+        is_netted = func.coalesce(StoredCardFill.is_netted, False)
+        query = db_session.query(
+            StoredCardFill.fill_scope,
+            fill_year,
+            fill_month,
+            StoredCardFill.category_code,
+            StoredCardFill.user_id,
+            is_netted,
+            func.sum(StoredCardFill.amount),
+            func.count(StoredCardFill.fill_id),
+        )
+        if scope_ids is not None:
+            query = query.filter(StoredCardFill.fill_scope.in_(scope_ids))
+        return query.group_by(
+            StoredCardFill.fill_scope,
+            fill_year,
+            fill_month,
+            StoredCardFill.category_code,
+            StoredCardFill.user_id,
+            is_netted,
+        )
+
+    def verify_rollup(self, scope_ids: Optional[list[int]] = None) -> list[RollupDrift]:
+        """Recomputes the rollup from card_fill and returns every key where the stored rollup differs."""
+        with self.db_session() as db_session:
+            expected = {
+                self._rollup_key(*row[:6]): (row[6], row[7])
+                for row in self._expected_rollup_query(db_session, scope_ids).all()
+            }
+            actual_query = db_session.query(StoredCardFillRollup)
+            if scope_ids is not None:
+                actual_query = actual_query.filter(StoredCardFillRollup.fill_scope.in_(scope_ids))
+            actual = {
+                self._rollup_key(r.fill_scope, r.year, r.month, r.category_code, r.user_id, r.is_netted): (
+                    r.amount_sum, r.fill_count
+                )
+                for r in actual_query.all()
+            }
+
+            drift: list[RollupDrift] = []
+            for key in sorted(expected.keys() | actual.keys(), key=str):
+                expected_amount, expected_count = expected.get(key, (0.0, 0))
+                actual_amount, actual_count = actual.get(key, (0.0, 0))
+                if expected_count != actual_count or abs(expected_amount - actual_amount) > 0.005:
+                    drift.append(
+                        RollupDrift(
+                            *key,
+                            expected_amount=expected_amount,
+                            actual_amount=actual_amount,
+                            expected_count=expected_count,
+                            actual_count=actual_count,
+                        )
+                    )
+            return drift
+
+    def rebuild_rollup(self, scope_ids: Optional[list[int]] = None) -> list[RollupDrift]:
+        """Replaces the rollup with sums recomputed from card_fill and returns the drift it fixed."""
         with self.db_session() as db_session:
-            user = db_session.query(StoredTelegramUser).get(income.user.id)
-            if not user:
-                new_user = StoredTelegramUser(
-                    user_id=income.user.id,
-                    is_bot=income.user.is_bot,
-                    first_name=income.user.first_name,
-                    last_name=income.user.last_name,
-                    username=income.user.username,
-                    language_code=income.user.language_code,
+            drift = self.verify_rollup(scope_ids)
+            rollup = StoredCardFillRollup.__table__
+            delete_stmt = rollup.delete()
+            if scope_ids is not None:
+                delete_stmt = delete_stmt.where(rollup.c.fill_scope.in_(scope_ids))
+            db_session.execute(delete_stmt)
+            db_session.execute(
+                insert(rollup).from_select(
+                    ["fill_scope", "year", "month", "category_code", "user_id", "is_netted", "amount_sum", "fill_count"],
+                    self._expected_rollup_query(db_session, scope_ids).statement,
                 )
-                db_session.add(new_user)
-                user = new_user
-                self.logger.info(f"Create new user {user}")
+            )
+            db_session.commit()
+            self.logger.info(f"Rebuilt card fill rollup for scopes {scope_ids or 'all'}, fixed {len(drift)} drifted keys")
+            return drift
+
+    def handle_new_income(self, income: Income) -> Income:
+        with self.db_session() as db_session:
+            upserted_users = self._upsert_users(db_session, [income.user])
 
             # Store original amount and currency for reference
             original_amount = income.amount
@@ -373,12 +1410,12 @@ class CardFillService:
 
             # Convert to base currency if needed
             if income.currency:
-                currency_rate = db_session.query(StoredCurrencyRate).get(income.currency.value)
-                if currency_rate:
-                    income.amount = income.amount * currency_rate.rate
+                rate = self._get_currency_rate_snapshot(db_session).rates.get(income.currency.value)
+                if rate:
+                    income.amount = income.amount * rate
 
             stored_income = StoredIncome(
-                user_id=user.user_id,
+                user_id=income.user.id,
                 income_date=income.income_date,
                 amount=income.amount,
                 description=income.description,
@@ -390,6 +1427,9 @@ class CardFillService:
 
             db_session.add(stored_income)
             db_session.commit()
+            self._remember_users(upserted_users)
+            self._reports_changed({(income.scope.scope_id, income.income_date.year)})
+            self.replica_router.record_write(income.scope.scope_id)
             income.id = stored_income.income_id
             income.original_amount = original_amount
             income.original_currency = original_currency
@@ -398,11 +1438,15 @@ class CardFillService:
 
     def delete_income(self, income: Income) -> None:
         with self.db_session() as db_session:
-            income_obj = db_session.query(StoredIncome).get(income.id)
+            income_obj = db_session.get(StoredIncome, income.id, options=_INCOME_WRITE_OPTIONS)
+            scope_year = (income_obj.fill_scope, income_obj.income_date.year)
             db_session.delete(income_obj)
             db_session.commit()
+            self._reports_changed({scope_year})
+            self.replica_router.record_write(income.scope.scope_id)
             self.logger.info(f"Delete income {income}")
 
+    @_replica_read
     def get_user_income_in_months(
         self, user: User, months: list[Month], year: int, scope: FillScope
     ) -> list[Income]:
@@ -411,35 +1455,46 @@ class CardFillService:
                 db_session.query(StoredIncome)
                 .filter(StoredIncome.user_id == user.id)
                 .filter(StoredIncome.fill_scope.in_(self._get_scope_id_filter(scope)))
-                .filter(extract("year", StoredIncome.income_date) == year)
-                .filter(extract("month", StoredIncome.income_date).in_([m.value for m in months]))
+                .filter(self._period_filter(StoredIncome.income_date, year, months))
+                .options(*_INCOME_LIST_OPTIONS)
                 .all()
             )
             return [income.to_entity_income() for income in incomes]
 
+    @_replica_read
     def get_income_monthly_report_by_user(
         self, months: list[Month], year: int, scope: FillScope
     ) -> dict[Month, list[UserSumOverPeriod]]:
         with self.db_session() as db_session:
-            incomes: list[StoredIncome] = (
-                db_session.query(StoredIncome)
-                .filter(StoredIncome.fill_scope.in_(self._get_scope_id_filter(scope)))
-                .filter(extract("year", StoredIncome.income_date) == year)
+            rows = db_session.execute(
+                select(StoredIncome.income_date, StoredIncome.user_id, StoredIncome.amount)
+                .where(StoredIncome.fill_scope.in_(self._get_scope_id_filter(scope)))
+                .where(self._period_filter(StoredIncome.income_date, year))
+            ).all()
+            user_ids, user_index = np.unique(
+                np.array([user_id for _, user_id, _ in rows], dtype=np.int64), return_inverse=True
+            )
+            matrix = MonthMatrix(
+                np.array([income_date.month - 1 for income_date, _, _ in rows], dtype=np.intp),
+                user_index,
+                np.array([amount for _, _, amount in rows], dtype=np.float64),
+                len(user_ids),
+            )
+            present = matrix.present()
+            stored_users = (
+                db_session.query(StoredTelegramUser)
+                .filter(StoredTelegramUser.user_id.in_(user_ids.tolist()))
                 .all()
+                if present else []
             )
-
-            monthly_data: dict[Month, dict[User, float]] = defaultdict(lambda: defaultdict(float))
-            all_users = set()
-            for income in incomes:
-                income_month = Month(income.income_date.month)
-                user = income.user.to_entity_user()
-                monthly_data[income_month][user] += income.amount
-                all_users.add(user)
+            users = {stored_user.user_id: stored_user.to_entity_user() for stored_user in stored_users}
 
             ret: dict[Month, list[UserSumOverPeriod]] = defaultdict(list)
             for month in months:
-                for user in all_users:
-                    amount = monthly_data[month].get(user, 0)
-                    if amount > 0:  # Only include users with income in this month
-                        ret[month].append(UserSumOverPeriod(user=user, amount=amount))
+                month_sums = matrix.month(month)
+                for group in present:
+                    if month_sums[group] > 0:  # Only include users with income in this month
+                        ret[month].append(
+                            UserSumOverPeriod(user=users[int(user_ids[group])], amount=float(month_sums[group]))
+                        )
             return ret
@@ -0,0 +1,70 @@
+import logging
+import re
+from typing import Optional, Sequence
+from entities import Category
+
+
+_REGEX_SPECIAL_CHARS = frozenset(r".^$*+?{}[]\|()")
+
+
+class CategoryClassifier:
+    """Picks the category of a fill description from category aliases.
+
+    Aliases are regular expressions matched case-insensitively at the start of
+    the description, and the first category with a matching alias wins, as in
+    StoredCategory.by_desc. All aliases are compiled once into a single
+    alternation ordered by category; descriptions equal to a plain-text alias
+    are answered from a dict without running the regex.
+    """
+
+    def __init__(self, categories: Sequence[Category], default: Category) -> None:
+        self.logger = logging.getLogger(__name__)
+        self._categories = tuple(categories)
+        self._default = default
+        self._pattern: Optional[re.Pattern] = None
+        self._alias_patterns: list[tuple[re.Pattern, Category]] = []
+
+        alternatives = [
+            f"(?P<c{i}>{'|'.join(f'(?:{alias})' for alias in category.aliases)})"
+            for i, category in enumerate(self._categories)
+            if category.aliases
+        ]
+        try:
+            self._pattern = re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+        except re.error:
+            # Aliases with their own group names or numbered backreferences cannot share one pattern
+            self.logger.warning("Category aliases do not compile into one pattern, matching them one by one")
+            self._alias_patterns = [
+                (re.compile(alias, re.IGNORECASE), category)
+                for category in self._categories
+                for alias in category.aliases
+            ]
+
+        self._exact: dict[str, Category] = {}
+        for category in self._categories:
+            for alias in category.aliases:
+                if not _REGEX_SPECIAL_CHARS.intersection(alias):
+                    self._exact.setdefault(alias.lower(), self._match(alias))
+
+    @property
+    def categories(self) -> tuple[Category, ...]:
+        return self._categories
+
+    def classify(self, description: Optional[str]) -> Category:
+        if description is None:
+            return self._default
+        exact = self._exact.get(description.lower())
+        if exact is not None:
+            return exact
+        return self._match(description)
+
+    def _match(self, description: str) -> Category:
+        if self._pattern is not None:
+            match = self._pattern.match(description)
+            if match is None:
+                return self._default
+            return self._categories[int(match.lastgroup[1:])]
+        for pattern, category in self._alias_patterns:
+            if pattern.match(description):
+                return category
+        return self._default
@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from entities import Month, Quarter
+from model import StoredCardFill
+from services.reference_data_cache import ReferenceDataCache
+
+
+# Month indexes count months from January 1970, as numpy datetime64[M] does
+_EPOCH_YEAR = 1970
+
+
+def month_index(year: int, month: int) -> int:
+    return (year - _EPOCH_YEAR) * 12 + month - 1
+
+
+class MonthMatrix:
+    """Sums of one year per month and group, from parallel arrays in one bincount.
+
+    Cumulative sums over the months make quarter, year-to-date and year totals
+    a difference of two rows instead of another pass over the data.
+    """
+
+    def __init__(self, months: np.ndarray, groups: np.ndarray, amounts: np.ndarray, group_count: int) -> None:
+        """months are 0 for January to 11 for December, groups are 0 to group_count - 1."""
+        flat = months.astype(np.intp) * group_count + groups.astype(np.intp)
+        size = 12 * group_count
+        self.sums = np.bincount(flat, weights=amounts, minlength=size).reshape(12, group_count)
+        self.counts = np.bincount(flat, minlength=size).reshape(12, group_count)
+        self.cumulative = np.vstack([np.zeros((1, group_count)), np.cumsum(self.sums, axis=0)])
+
+    def month(self, month: Month) -> np.ndarray:
+        return self.sums[month.value - 1]
+
+    def quarter(self, quarter: Quarter) -> np.ndarray:
+        return self.cumulative[3 * quarter.value] - self.cumulative[3 * (quarter.value - 1)]
+
+    def year_to_date(self, month: Month) -> np.ndarray:
+        return self.cumulative[month.value]
+
+    def year(self) -> np.ndarray:
+        return self.cumulative[12]
+
+    def present(self) -> list[int]:
+        """Groups with rows in the year, ordered by the first month they appear in."""
+        has_rows = self.counts > 0
+        first_month = np.argmax(has_rows, axis=0)
+        present = np.flatnonzero(has_rows.any(axis=0))
+        return sorted(present.tolist(), key=lambda group: (first_month[group], group))
+
+
+@dataclass(frozen=True)
+class FillColumns:
+    """Fills of a scope as parallel arrays, ordered by fill_id."""
+
+    fill_id: np.ndarray
+    amount: np.ndarray
+    epoch_day: np.ndarray
+    month_index: np.ndarray
+    category_id: np.ndarray
+    user_id: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.fill_id)
+
+    @classmethod
+    def empty(cls) -> "FillColumns":
+        return cls.concat([])
+
+    @classmethod
+    def concat(cls, parts: Sequence["FillColumns"]) -> "FillColumns":
+        if len(parts) == 1:
+            return parts[0]
+        return cls(
+            fill_id=np.concatenate([p.fill_id for p in parts] or [np.empty(0, np.int64)]),
+            amount=np.concatenate([p.amount for p in parts] or [np.empty(0, np.float64)]),
+            epoch_day=np.concatenate([p.epoch_day for p in parts] or [np.empty(0, np.int32)]),
+            month_index=np.concatenate([p.month_index for p in parts] or [np.empty(0, np.int32)]),
+            category_id=np.concatenate([p.category_id for p in parts] or [np.empty(0, np.int32)]),
+            user_id=np.concatenate([p.user_id for p in parts] or [np.empty(0, np.int64)]),
+        )
+
+    def year_matrix(self, year: int, groups: np.ndarray, group_count: int) -> MonthMatrix:
+        """MonthMatrix of the fills in year, grouped by groups, an array parallel to the columns."""
+        first = month_index(year, 1)
+        in_year = (self.month_index >= first) & (self.month_index < first + 12)
+        return MonthMatrix(self.month_index[in_year] - first, groups[in_year], self.amount[in_year], group_count)
+
+
+@dataclass(frozen=True)
+class _ScopeEntry:
+    version: int
+    columns: FillColumns
+    loaded_at: float
+
+    @property
+    def high_water(self) -> int:
+        return int(self.columns.fill_id[-1]) if len(self.columns) else 0
+
+
+class ColumnarFillStore:
+    """Fills of each scope as NumPy columns in process memory, for report aggregation.
+
+    A read appends the fills above the highest fill_id already loaded, with one
+    query on the primary key. Edits and deletes cannot be seen that way, so
+    writers call invalidate, which bumps the scope version through the
+    ReferenceDataCache counters on every replica, and the next read loads the
+    scope again. A fill saved by this process below the loaded fill_ids, when
+    concurrent transactions commit out of id order, invalidates the scope too
+    (see added). Rows missed otherwise, committed out of order on another
+    replica or changed directly in the database, are picked up when the scope
+    is loaded again after ttl seconds. At most maxsize scopes are kept, the
+    least recently read are dropped first.
+    """
+
+    def __init__(
+        self,
+        reference_data: ReferenceDataCache,
+        maxsize: int = 256,
+        ttl: float = 600,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self._reference_data = reference_data
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._scopes: OrderedDict[int, _ScopeEntry] = OrderedDict()
+        self._category_ids: dict[str, int] = {}
+        self._category_codes: list[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def category_codes(self) -> list[str]:
+        """Category codes by category_id; ids are only ever added."""
+        with self._lock:
+            return list(self._category_codes)
+
+    def columns(self, db_session: Session, scope_id: int) -> FillColumns:
+        now = self._clock()
+        # Read before loading, so a write landing during the load makes the next read reload
+        version = self._reference_data.version(self._key(scope_id))
+        with self._lock:
+            entry = self._scopes.get(scope_id)
+        if entry is not None and entry.version == version and now - entry.loaded_at < self.ttl:
+            new_columns = self._load(db_session, scope_id, entry.high_water)
+            if len(new_columns):
+                entry = _ScopeEntry(version, FillColumns.concat([entry.columns, new_columns]), entry.loaded_at)
+        else:
+            entry = _ScopeEntry(version, self._load(db_session, scope_id), now)
+        with self._lock:
+            self._scopes[scope_id] = entry
+            self._scopes.move_to_end(scope_id)
+            while len(self._scopes) > self.maxsize:
+                self._scopes.popitem(last=False)
+        return entry.columns
+
+    def added(self, scope_id: int, fill_ids: Sequence[int]) -> None:
+        """Invalidates the scope when a fill saved to it is below the fill_ids loaded already."""
+        with self._lock:
+            entry = self._scopes.get(scope_id)
+        if entry is not None and fill_ids and min(fill_ids) <= entry.high_water:
+            self.logger.info(f"Fill {min(fill_ids)} of scope {scope_id} was committed after later fills")
+            self.invalidate(scope_id)
+
+    def invalidate(self, *scope_ids: int) -> None:
+        for scope_id in scope_ids:
+            self._reference_data.bump(self._key(scope_id))
+
+    def _load(self, db_session: Session, scope_id: int, after_fill_id: Optional[int] = None) -> FillColumns:
+        stmt = (
+            select(
+                StoredCardFill.fill_id,
+                StoredCardFill.amount,
+                StoredCardFill.fill_date,
+                StoredCardFill.category_code,
+                StoredCardFill.user_id,
+            )
+            .where(StoredCardFill.fill_scope == scope_id)
+            .order_by(StoredCardFill.fill_id)
+        )
+        if after_fill_id is not None:
+            stmt = stmt.where(StoredCardFill.fill_id > after_fill_id)
+        rows = db_session.execute(stmt).all()
+        if not rows:
+            return FillColumns.empty()
+
+        fill_ids, amounts, fill_dates, category_codes, user_ids = zip(*rows)
+        dates = np.array(fill_dates, dtype="datetime64[D]")
+        codes, code_index = np.unique(np.array(category_codes, dtype=object), return_inverse=True)
+        with self._lock:
+            for code in codes:
+                if code not in self._category_ids:
+                    self._category_ids[code] = len(self._category_codes)
+                    self._category_codes.append(code)
+            code_ids = np.array([self._category_ids[code] for code in codes], dtype=np.int32)
+        return FillColumns(
+            fill_id=np.array(fill_ids, dtype=np.int64),
+            amount=np.array(amounts, dtype=np.float64),
+            epoch_day=dates.astype(np.int32),
+            month_index=dates.astype("datetime64[M]").astype(np.int32),
+            category_id=code_ids[code_index],
+            user_id=np.array(user_ids, dtype=np.int64),
+        )
+
+    @staticmethod
+    def _key(scope_id: int) -> str:
+        return f"fill_columns_{scope_id}"
@@ -0,0 +1,44 @@
+import csv
+import gzip
+import io
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import IO, Any, AsyncGenerator, Iterable, Sequence
+from aiogram import Bot
+from aiogram.types.input_file import InputFile, DEFAULT_CHUNK_SIZE
+
+
+def write_csv_gz(columns: Sequence[str], rows: Iterable[Sequence[Any]], spool_max_size: int) -> IO[bytes]:
+    """Writes rows as gzip-compressed CSV into a temp file that moves to disk past spool_max_size bytes.
+
+    Rows are consumed one at a time, so memory use does not depend on their number.
+    The returned file is positioned at its start and must be closed by the caller.
+    """
+    spool = SpooledTemporaryFile(max_size=spool_max_size)
+    try:
+        with gzip.GzipFile(fileobj=spool, mode="wb") as gz:
+            text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+            # Closing the wrapper would close gz too early, detach flushes it and leaves gz to the with block
+            text.detach()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+class SpooledInputFile(InputFile):
+    """Uploads an open binary file chunk by chunk instead of reading it into memory first."""
+
+    def __init__(self, file: IO[bytes], filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
@@ -0,0 +1,104 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from settings import settings
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    name: str
+    size: int
+    max_overflow: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    timeouts: int
+    checkout_avg_ms: float
+    checkout_max_ms: float
+
+
+class _CheckoutTimingMixin:
+    """Counts checkouts and measures how long each one waited for a connection.
+
+    The wait covers queueing for a free connection and opening a new one;
+    the pre-ping, when enabled, runs after it on the returned connection.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._timing_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._checkout_total = 0.0
+        self._checkout_max = 0.0
+
+    def _do_get(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._timing_lock:
+                self._timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._timing_lock:
+                self._checkouts += 1
+                self._checkout_total += elapsed
+                self._checkout_max = max(self._checkout_max, elapsed)
+
+    def stats(self, name: str) -> PoolStats:
+        with self._timing_lock:
+            checkouts, timeouts = self._checkouts, self._timeouts
+            total, longest = self._checkout_total, self._checkout_max
+        return PoolStats(
+            name=name,
+            size=self.size(),
+            max_overflow=self._max_overflow,
+            checked_out=self.checkedout(),
+            overflow=max(self.overflow(), 0),
+            checkouts=checkouts,
+            timeouts=timeouts,
+            checkout_avg_ms=total / checkouts * 1000 if checkouts else 0.0,
+            checkout_max_ms=longest * 1000,
+        )
+
+
+class InstrumentedQueuePool(_CheckoutTimingMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options() -> dict[str, Any]:
+    return dict(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+
+
+def create_db_engine(uri: str, **kwargs: Any) -> Engine:
+    return create_engine(uri, poolclass=InstrumentedQueuePool, **{**pool_options(), **kwargs})
+
+
+def create_async_db_engine(uri: str, **kwargs: Any) -> AsyncEngine:
+    return create_async_engine(uri, poolclass=InstrumentedAsyncAdaptedQueuePool, **{**pool_options(), **kwargs})
+
+
+def get_pool_stats(name: str, engine: Engine | AsyncEngine) -> Optional[PoolStats]:
+    """Stats of the engine pool, None for engines created without an instrumented pool."""
+    pool = engine.pool
+    if isinstance(pool, _CheckoutTimingMixin):
+        return pool.stats(name)
+    return None
@@ -0,0 +1,164 @@
+import csv
+import gzip
+import io
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import IO, Any, Callable, Iterator, Optional
+from entities import ImportedFill
+
+
+# Layout of the fills table written by /dump
+DUMP_FILL_COLUMNS = (
+    "fill_id", "scope_id", "user_id", "fill_date", "amount", "category_code", "description", "is_netted",
+)
+# At most this many duplicate lines and errors are listed in an import report
+IMPORT_REPORT_SAMPLE = 20
+
+
+@dataclass(frozen=True)
+class ImportMapping:
+    """Column layout of a bank statement CSV.
+
+    Rows whose amount does not have expense_sign, such as incoming transfers and
+    refunds, are skipped. Amounts in currency_column other than base_currency are
+    converted with the stored currency rates.
+    """
+
+    date_column: str
+    amount_column: str
+    description_column: str
+    date_format: str = "%Y-%m-%d"
+    currency_column: Optional[str] = None
+    base_currency: Optional[str] = None
+    delimiter: str = ","
+    encoding: str = "utf-8"
+    decimal_comma: bool = False
+    expense_sign: int = -1
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "ImportMapping":
+        known = {field.name for field in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown import mapping fields {sorted(unknown)}")
+        return cls(**data)
+
+
+class FillImportReader:
+    """Streams ImportedFill rows out of an uploaded CSV, plain or gzip-compressed.
+
+    Without a mapping the file must have the /dump fills layout and rows keep their
+    scope and user unless scope_id is given. With a mapping every row belongs to
+    scope_id and user_id. Rows that cannot be parsed are counted in errors and
+    skipped rows in skipped; iteration goes on past both.
+    """
+
+    def __init__(
+        self,
+        file: IO[bytes],
+        mapping: Optional[ImportMapping] = None,
+        scope_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+    ) -> None:
+        if mapping is not None and (scope_id is None or user_id is None):
+            raise ValueError("Statement import needs a scope and a user")
+        self.file = file
+        self.mapping = mapping
+        self.scope_id = scope_id
+        self.user_id = user_id
+        self.errors: list[tuple[int, str]] = []
+        self.invalid = 0
+        self.skipped = 0
+        self._positions: dict[str, int] = {}
+
+    def _open_text(self) -> io.TextIOWrapper:
+        self.file.seek(0)
+        if self.file.read(2) == b"\x1f\x8b":
+            self.file.seek(0)
+            binary = gzip.GzipFile(fileobj=self.file, mode="rb")
+        else:
+            self.file.seek(0)
+            binary = self.file
+        encoding = self.mapping.encoding if self.mapping else "utf-8"
+        return io.TextIOWrapper(binary, encoding=encoding, newline="")
+
+    def __iter__(self) -> Iterator[ImportedFill]:
+        text = self._open_text()
+        try:
+            reader = csv.reader(text, delimiter=self.mapping.delimiter if self.mapping else ",")
+            header = next(reader, None)
+            if header is None:
+                return
+            header = [column.strip().lstrip("\ufeff") for column in header]
+            parse_row = self._row_parser(header)
+            for row in reader:
+                if not any(value.strip() for value in row):
+                    continue
+                try:
+                    fill = parse_row(reader.line_num, row)
+                except (ValueError, IndexError) as e:
+                    self.add_error(reader.line_num, str(e))
+                    continue
+                if fill is None:
+                    self.skipped += 1
+                else:
+                    yield fill
+        finally:
+            # The wrapper must not close the uploaded file, which the caller owns
+            text.detach()
+
+    def add_error(self, line: int, error: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < IMPORT_REPORT_SAMPLE:
+            self.errors.append((line, error))
+
+    def _row_parser(self, header: list[str]) -> Callable[[int, list[str]], Optional[ImportedFill]]:
+        if self.mapping is None:
+            if tuple(header) != DUMP_FILL_COLUMNS:
+                raise ValueError(f"Expected columns {', '.join(DUMP_FILL_COLUMNS)}")
+            return self._parse_dump_row
+
+        mapping = self.mapping
+        columns = [mapping.date_column, mapping.amount_column, mapping.description_column]
+        if mapping.currency_column:
+            columns.append(mapping.currency_column)
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError(f"Missing columns {', '.join(missing)}")
+        self._positions = {column: header.index(column) for column in columns}
+        return self._parse_statement_row
+
+    def _parse_dump_row(self, line: int, row: list[str]) -> ImportedFill:
+        values = dict(zip(DUMP_FILL_COLUMNS, row))
+        return ImportedFill(
+            line=line,
+            scope_id=self.scope_id if self.scope_id is not None else int(values["scope_id"]),
+            user_id=int(values["user_id"]),
+            fill_date=datetime.fromisoformat(values["fill_date"]),
+            amount=float(values["amount"]),
+            description=values["description"],
+            category_code=values["category_code"] or None,
+            is_netted=values["is_netted"] == "True",
+        )
+
+    def _parse_statement_row(self, line: int, row: list[str]) -> Optional[ImportedFill]:
+        mapping = self.mapping
+        values = {column: row[position].strip() for column, position in self._positions.items()}
+        amount_text = values[mapping.amount_column].replace(" ", "").replace("\xa0", "")
+        if mapping.decimal_comma:
+            amount_text = amount_text.replace(".", "").replace(",", ".")
+        amount = float(amount_text) * mapping.expense_sign
+        if amount <= 0:
+            return None
+        currency = values[mapping.currency_column].upper() if mapping.currency_column else None
+        if currency == mapping.base_currency:
+            currency = None
+        return ImportedFill(
+            line=line,
+            scope_id=self.scope_id,
+            user_id=self.user_id,
+            fill_date=datetime.strptime(values[mapping.date_column], mapping.date_format),
+            amount=amount,
+            description=values[mapping.description_column],
+            currency=currency or None,
+        )
@@ -0,0 +1,158 @@
+import logging
+import os
+import socket
+from dataclasses import dataclass
+from typing import Optional
+import redis
+from entities import Fill
+from schemas import FillSchema
+
+
+@dataclass(frozen=True)
+class QueuedFill:
+    entry_id: str
+    key: str
+    fill: Fill
+    chat_id: int
+    message_id: int
+
+
+@dataclass(frozen=True)
+class FillIngestStats:
+    backlog: int
+    pending: int
+    dead: int
+
+
+class FillIngestQueue:
+    """Parsed fills waiting in a redis stream to be saved by a consumer group.
+
+    The message handler claims an idempotency key per telegram message, so a
+    redelivered update is not queued twice, and adds the fill together with the
+    confirmation message to edit once it is saved. Consumers read batches with
+    XREADGROUP and ack an entry, which also deletes it, after its fill is
+    committed. Entries a consumer failed on or left behind when it died stay
+    pending and are claimed again after retry_after seconds; after max_attempts
+    failures they move to the dead-letter stream.
+    """
+
+    def __init__(
+        self,
+        rdb: redis.Redis,
+        stream: str = "fill_ingest",
+        group: str = "fill_writers",
+        consumer: Optional[str] = None,
+        max_attempts: int = 5,
+        retry_after: float = 30,
+        key_ttl: int = 24 * 60 * 60,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.rdb = rdb
+        self.stream = stream
+        self.dead_stream = f"{stream}_dead"
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.max_attempts = max_attempts
+        self.retry_after = retry_after
+        self.key_ttl = key_ttl
+        self._attempts_key = f"{stream}_attempts"
+        # XAUTOCLAIM cursor, so pending entries that are not due yet do not hide the ones behind them
+        self._claim_cursor = "0-0"
+
+    def ensure_group(self) -> None:
+        try:
+            self.rdb.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def claim_key(self, key: str) -> bool:
+        """False when key was claimed within key_ttl, that is the fill is queued already."""
+        return bool(self.rdb.set(f"{self.stream}_key_{key}", 1, nx=True, ex=self.key_ttl))
+
+    def release_key(self, key: str) -> None:
+        """Undoes claim_key for a fill that did not make it into the stream, so a redelivery queues it."""
+        self.rdb.delete(f"{self.stream}_key_{key}")
+
+    def enqueue(self, key: str, fill: Fill, chat_id: int, message_id: int) -> str:
+        entry_id = self.rdb.xadd(self.stream, self._fields(key, fill, chat_id, message_id))
+        self.logger.debug(f"Queued fill {key} as {entry_id}")
+        return entry_id
+
+    def read(self, count: int) -> list[QueuedFill]:
+        """Up to count entries, those due for a retry first, then new ones."""
+        self._claim_cursor, claimed, *_ = self.rdb.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=int(self.retry_after * 1000),
+            start_id=self._claim_cursor,
+            count=count,
+        )
+        entries = [(entry_id, fields) for entry_id, fields in claimed if fields]
+        if len(entries) < count:
+            for _, new_entries in self.rdb.xreadgroup(
+                self.group, self.consumer, {self.stream: ">"}, count=count - len(entries)
+            ):
+                entries.extend(new_entries)
+
+        queued = []
+        for entry_id, fields in entries:
+            try:
+                queued.append(
+                    QueuedFill(
+                        entry_id=entry_id,
+                        key=fields["key"],
+                        fill=FillSchema().loads(fields["fill"]),
+                        chat_id=int(fields["chat_id"]),
+                        message_id=int(fields["message_id"]),
+                    )
+                )
+            except Exception as e:
+                self.logger.exception(f"Could not decode queued fill {entry_id}")
+                self._bury(entry_id, fields, repr(e))
+        return queued
+
+    def ack(self, entries: list[QueuedFill]) -> None:
+        if not entries:
+            return
+        entry_ids = [entry.entry_id for entry in entries]
+        pipe = self.rdb.pipeline(transaction=True)
+        pipe.xack(self.stream, self.group, *entry_ids)
+        pipe.xdel(self.stream, *entry_ids)
+        pipe.hdel(self._attempts_key, *entry_ids)
+        pipe.execute()
+
+    def fail(self, entries: list[QueuedFill], error: str) -> list[QueuedFill]:
+        """Counts a failed attempt for entries and returns those moved to the dead-letter stream."""
+        pipe = self.rdb.pipeline(transaction=False)
+        for entry in entries:
+            pipe.hincrby(self._attempts_key, entry.entry_id, 1)
+        attempts = pipe.execute()
+
+        dead = [entry for entry, attempt in zip(entries, attempts) if attempt >= self.max_attempts]
+        for entry in dead:
+            self._bury(entry.entry_id, self._fields(entry.key, entry.fill, entry.chat_id, entry.message_id), error)
+        if dead:
+            self.logger.error(f"Moved {len(dead)} fills to {self.dead_stream} after {self.max_attempts} attempts: {error}")
+        return dead
+
+    def stats(self) -> FillIngestStats:
+        pipe = self.rdb.pipeline(transaction=False)
+        pipe.xlen(self.stream)
+        pipe.xpending(self.stream, self.group)
+        pipe.xlen(self.dead_stream)
+        backlog, pending, dead = pipe.execute()
+        return FillIngestStats(backlog=backlog, pending=pending["pending"], dead=dead)
+
+    def _bury(self, entry_id: str, fields: dict[str, str], error: str) -> None:
+        pipe = self.rdb.pipeline(transaction=True)
+        pipe.xadd(self.dead_stream, {**fields, "entry_id": entry_id, "error": error})
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        pipe.hdel(self._attempts_key, entry_id)
+        pipe.execute()
+
+    @staticmethod
+    def _fields(key: str, fill: Fill, chat_id: int, message_id: int) -> dict[str, str]:
+        return dict(key=key, fill=FillSchema().dumps(fill), chat_id=str(chat_id), message_id=str(message_id))
@@ -1,7 +1,7 @@
 from typing import Optional
 from io import BytesIO
 import matplotlib
-from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 from entities import CategorySumOverPeriod, UserSumOverPeriodWithBalance
 
 matplotlib.use("Agg")
@@ -31,7 +31,9 @@ class GraphService:
         return self._draw_figure(data, labels, name)
 
     def _draw_figure(self, data: list[float], labels: list[str], name: str) -> bytes:
-        fig = plt.figure()
+        # Figure is used instead of pyplot: it keeps no global state, so diagrams
+        # can be drawn from executor threads and are freed after rendering.
+        fig = Figure()
         ax = fig.add_axes([0, 0, 1, 1])
         ax.axis("equal")
         ax.pie(data, labels=labels, autopct="%1.1f%%")
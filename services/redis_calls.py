@@ -0,0 +1,45 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Iterator, Optional
+import redis
+
+
+logger = logging.getLogger(__name__)
+
+_pending: ContextVar[Optional[list[Callable[[], Any]]]] = ContextVar("pending_redis_calls", default=None)
+
+
+def call_redis(fn: Callable[..., Any], *args: Any) -> None:
+    """Runs a redis write now, or queues it when the caller is inside collect_redis_calls.
+
+    CardFillService runs on executor threads, where blocking on redis is fine,
+    and inside AsyncSession.run_sync, which is the event loop thread; there the
+    calls are collected and run on the redis executor once the session is done.
+    """
+    pending = _pending.get()
+    if pending is None:
+        run_redis_calls([partial(fn, *args)])
+    else:
+        pending.append(partial(fn, *args))
+
+
+@contextmanager
+def collect_redis_calls() -> Iterator[list[Callable[[], Any]]]:
+    """Queues every call_redis made inside the block, in the current context and its greenlets."""
+    pending: list[Callable[[], Any]] = []
+    token = _pending.set(pending)
+    try:
+        yield pending
+    finally:
+        _pending.reset(token)
+
+
+def run_redis_calls(calls: list[Callable[[], Any]]) -> None:
+    """Runs queued calls in order; a redis error is logged and does not stop the calls after it."""
+    for call in calls:
+        try:
+            call()
+        except redis.RedisError:
+            logger.exception(f"Redis call {getattr(call, 'func', call).__qualname__} failed")
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Mapping, Optional, TypeVar
+import redis
+from entities import Budget, Category
+from services.category_classifier import CategoryClassifier
+from services.redis_calls import call_redis
+
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class CategorySnapshot:
+    version: int
+    categories: tuple[Category, ...]
+    classifier: CategoryClassifier
+
+
+@dataclass(frozen=True)
+class BudgetSnapshot:
+    version: int
+    budgets: tuple[Budget, ...]
+    by_category_code: Mapping[str, Budget]
+
+
+@dataclass(frozen=True)
+class CurrencyRateSnapshot:
+    version: int
+    rates: Mapping[str, float]
+
+
+@dataclass
+class _Entry:
+    version: int
+    value: object
+    loaded_at: float
+
+
+class ReferenceDataCache:
+    """Keeps immutable snapshots of rarely changing tables in process memory.
+
+    Every key has a version counter. Writers bump it after committing, and a
+    cached snapshot is served until its version no longer matches the current
+    one. With a redis client the counters are shared through redis, so a write
+    on one replica invalidates snapshots on all of them: refresh_versions reads
+    them in one MGET and is run by a background task, get and version only look
+    at process memory. Snapshots are also reloaded after ttl seconds to pick up
+    rows changed directly in the database.
+    """
+
+    def __init__(
+        self,
+        rdb: Optional[redis.Redis] = None,
+        ttl: float = 600,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.rdb = rdb
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: dict[str, _Entry] = {}
+        self._local_versions: dict[str, int] = {}
+        # Redis counters as last read by refresh_versions
+        self._remote_versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, load: Callable[[int], T]) -> T:
+        """Returns the snapshot of key, calling load(version) when there is no current one."""
+        now = self._clock()
+        version = self.version(key)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry.version == version and now - entry.loaded_at < self.ttl:
+            return entry.value
+
+        # The version is read before loading, so a write that lands during the load
+        # leaves the snapshot behind the counter and it is reloaded on the next get.
+        value = load(version)
+        with self._lock:
+            self._entries[key] = _Entry(version=version, value=value, loaded_at=now)
+        self.logger.info(f"Loaded reference data {key} version {version}")
+        return value
+
+    def version(self, key: str) -> int:
+        with self._lock:
+            return self._local_versions.get(key, 0)
+
+    def bump(self, key: str) -> None:
+        """Marks every snapshot of key as stale, on all replicas sharing the redis."""
+        with self._lock:
+            self._local_versions[key] = self._local_versions.get(key, 0) + 1
+            self._entries.pop(key, None)
+        if self.rdb is not None:
+            call_redis(self._bump_remote, key)
+        self.logger.info(f"Bumped reference data version of {key}")
+
+    def refresh_versions(self) -> None:
+        """Bumps the local version of every known key whose redis counter moved since the last refresh.
+
+        Blocks on redis, so it runs on the redis executor. A replica's own bumps
+        come back as a change once, which costs one extra reload, and so does
+        the first refresh of a key that already has a snapshot.
+        """
+        if self.rdb is None:
+            return
+        with self._lock:
+            keys = sorted(self._local_versions.keys() | self._entries.keys())
+        if not keys:
+            return
+        try:
+            remote = self.rdb.mget([self._version_key(key) for key in keys])
+        except redis.RedisError:
+            self.logger.warning("Could not read reference data versions from redis, keeping the local ones")
+            return
+        with self._lock:
+            for key, value in zip(keys, remote):
+                value = int(value or 0)
+                last_seen = self._remote_versions.get(key)
+                self._remote_versions[key] = value
+                # A snapshot loaded before the first refresh of its key may already be behind
+                if value != last_seen and (last_seen is not None or key in self._entries):
+                    self._local_versions[key] = self._local_versions.get(key, 0) + 1
+                    self._entries.pop(key, None)
+                    self.logger.info(f"Reference data {key} changed in redis, version {value}")
+
+    def _bump_remote(self, key: str) -> None:
+        try:
+            self.rdb.incr(self._version_key(key))
+        except redis.RedisError:
+            self.logger.warning(f"Could not bump version of {key} in redis, other replicas keep it until ttl")
+
+    @staticmethod
+    def _version_key(key: str) -> str:
+        return f"reference_data_version_{key}"
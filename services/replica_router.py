@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable
+from sqlalchemy.exc import InterfaceError, OperationalError
+from services.ttl_cache import TTLCache
+
+
+# Errors after which a replica read is retried on the primary
+REPLICA_ERRORS = (OperationalError, InterfaceError)
+
+
+@dataclass(frozen=True)
+class ReplicaStats:
+    replica_reads: int
+    primary_reads: int
+    fallbacks: int
+    available: bool
+
+
+class ReplicaRouter:
+    """Decides whether a read-only report can be served by the replica.
+
+    Replication lag would hide a fill from the report asked for right after it was
+    saved, so reads of a scope stay on the primary for read_after_write_window
+    seconds after its last write. After a failed replica read every read goes to
+    the primary for retry_interval seconds before the replica is tried again.
+    """
+
+    def __init__(
+        self,
+        read_after_write_window: float,
+        retry_interval: float,
+        maxsize: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.retry_interval = retry_interval
+        self._clock = clock
+        self._recent_writes: TTLCache[int, bool] = TTLCache(maxsize=maxsize, ttl=read_after_write_window, clock=clock)
+        self._lock = threading.Lock()
+        self._unavailable_until = 0.0
+        self._replica_reads = 0
+        self._primary_reads = 0
+        self._fallbacks = 0
+
+    def record_write(self, *scope_ids: int) -> None:
+        for scope_id in scope_ids:
+            self._recent_writes.set(scope_id, True)
+
+    def use_replica(self, scope_ids: Iterable[int]) -> bool:
+        use_replica = self._available() and not any(self._recent_writes.get(scope_id) for scope_id in scope_ids)
+        with self._lock:
+            if use_replica:
+                self._replica_reads += 1
+            else:
+                self._primary_reads += 1
+        return use_replica
+
+    def mark_unavailable(self, error: Exception) -> None:
+        self.logger.warning(f"Replica read failed, using primary for {self.retry_interval}s: {error}")
+        with self._lock:
+            self._fallbacks += 1
+            self._unavailable_until = self._clock() + self.retry_interval
+
+    def _available(self) -> bool:
+        with self._lock:
+            return self._clock() >= self._unavailable_until
+
+    def stats(self) -> ReplicaStats:
+        available = self._available()
+        with self._lock:
+            return ReplicaStats(
+                replica_reads=self._replica_reads,
+                primary_reads=self._primary_reads,
+                fallbacks=self._fallbacks,
+                available=available,
+            )
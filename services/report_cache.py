@@ -0,0 +1,109 @@
+import base64
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+import redis
+from entities import FillScope, Month
+
+
+# Version shared by the snapshots of every scope, bumped when the categories they name change
+_GLOBAL_VERSION_KEY = "report_version"
+
+
+@dataclass(frozen=True)
+class ReportSnapshot:
+    text: str
+    diagram: Optional[bytes] = None
+
+
+class ReportCache:
+    """Finished monthly reports in redis: the message text and the diagram.
+
+    A snapshot key carries the data version of every (scope, year) the report
+    sums, a version of the scope itself for its budgets and a version shared by
+    all reports for the categories they name. Writers bump them
+    after committing, so a snapshot is never served once its data changed and
+    the stale keys simply expire. Past years change rarely, their snapshots are
+    kept for past_year_ttl instead of ttl.
+    """
+
+    def __init__(self, rdb: redis.Redis, ttl: int = 60 * 60, past_year_ttl: int = 30 * 24 * 60 * 60) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.rdb = rdb
+        self.ttl = ttl
+        self.past_year_ttl = past_year_ttl
+
+    def snapshot_key(self, scope: FillScope, year: int, months: list[Month]) -> Optional[str]:
+        """Key of the report as of the current versions, None when they cannot be read."""
+        scope_ids = scope.report_scopes or [scope.scope_id]
+        version_keys = [_GLOBAL_VERSION_KEY, self._scope_version_key(scope.scope_id)]
+        version_keys.extend(self._year_version_key(scope_id, year) for scope_id in scope_ids)
+        try:
+            versions = self.rdb.mget(version_keys)
+        except redis.RedisError:
+            self.logger.exception("Could not read report versions")
+            return None
+        month_numbers = "-".join(str(month.value) for month in months)
+        version = "-".join(str(v or 0) for v in versions)
+        return f"report_{scope.scope_id}_{year}_{month_numbers}_{version}"
+
+    def get(self, key: str) -> Optional[ReportSnapshot]:
+        try:
+            record = self.rdb.get(key)
+        except redis.RedisError:
+            self.logger.exception(f"Could not read report snapshot {key}")
+            return None
+        if record is None:
+            return None
+        data = json.loads(record)
+        diagram = base64.b64decode(data["diagram"]) if data["diagram"] is not None else None
+        self.logger.debug(f"Got report snapshot {key}")
+        return ReportSnapshot(text=data["text"], diagram=diagram)
+
+    def set(self, key: str, snapshot: ReportSnapshot, year: int) -> None:
+        # The client decodes replies as text, so the PNG is stored base64-encoded
+        record = json.dumps(
+            dict(
+                text=snapshot.text,
+                diagram=base64.b64encode(snapshot.diagram).decode() if snapshot.diagram is not None else None,
+            )
+        )
+        ttl = self.past_year_ttl if year < datetime.now().year else self.ttl
+        try:
+            self.rdb.set(key, record, ex=ttl)
+        except redis.RedisError:
+            self.logger.exception(f"Could not save report snapshot {key}")
+
+    def bump_years(self, scope_years: Iterable[tuple[int, int]]) -> None:
+        """Outdates the snapshots of every (scope_id, year) whose fills or incomes changed."""
+        self._bump({self._year_version_key(scope_id, year) for scope_id, year in scope_years})
+
+    def bump_scope(self, scope_id: int) -> None:
+        """Outdates every snapshot of a scope, such as after its budgets changed."""
+        self._bump({self._scope_version_key(scope_id)})
+
+    def bump_all(self) -> None:
+        """Outdates the snapshots of every scope, such as after a category was added or renamed."""
+        self._bump({_GLOBAL_VERSION_KEY})
+
+    def _bump(self, version_keys: Iterable[str]) -> None:
+        version_keys = sorted(version_keys)
+        if not version_keys:
+            return
+        try:
+            pipe = self.rdb.pipeline(transaction=False)
+            for version_key in version_keys:
+                pipe.incr(version_key)
+            pipe.execute()
+        except redis.RedisError:
+            self.logger.exception(f"Could not bump report versions {version_keys}")
+
+    @staticmethod
+    def _scope_version_key(scope_id: int) -> str:
+        return f"report_version_{scope_id}"
+
+    @staticmethod
+    def _year_version_key(scope_id: int, year: int) -> str:
+        return f"report_version_{scope_id}_{year}"
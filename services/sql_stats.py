@@ -0,0 +1,227 @@
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Statements beyond this many distinct fingerprints are counted together under OTHER_STATEMENTS
+MAX_FINGERPRINTS = 500
+OTHER_STATEMENTS = "<other statements>"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|(?<![:\w]):\w+|\?")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_ROW_LIST = re.compile(r"(\(\?(?:\.\.\.)?\))(?:\s*,\s*\(\?(?:\.\.\.)?\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Statement text with literals and placeholders replaced, so differently bound runs compare equal.
+
+    Expanded IN lists and multi-row VALUES collapse to one item, their length
+    depends on the data rather than on the code that ran them.
+    """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _PLACEHOLDER_LIST.sub("?...", statement)
+    statement = _ROW_LIST.sub(r"\1, ...", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+@dataclass(frozen=True)
+class StatementStats:
+    fingerprint: str
+    count: int
+    total_ms: float
+    max_ms: float
+    rows: int
+
+
+@dataclass(frozen=True)
+class HandlerStats:
+    handler: str
+    updates: int
+    statements: int
+    max_statements: int
+    sql_ms: float
+    rows: int
+    update_avg_ms: float
+    update_max_ms: float
+
+
+@dataclass
+class _Totals:
+    count: int = 0
+    total: float = 0.0
+    longest: float = 0.0
+    rows: int = 0
+
+    def add(self, elapsed: float, rows: int) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.longest = max(self.longest, elapsed)
+        self.rows += rows
+
+
+@dataclass
+class UpdateTrace:
+    """Statements run on behalf of one telegram update, from any executor thread."""
+
+    update_id: int
+    handler: str
+    started: float = field(default_factory=time.perf_counter)
+    statements: dict[str, _Totals] = field(default_factory=dict)
+
+    @property
+    def statement_count(self) -> int:
+        return sum(totals.count for totals in self.statements.values())
+
+
+@dataclass
+class _HandlerTotals:
+    updates: int = 0
+    statements: int = 0
+    max_statements: int = 0
+    sql_total: float = 0.0
+    rows: int = 0
+    update_total: float = 0.0
+    update_longest: float = 0.0
+
+
+_current_update: ContextVar[Optional[UpdateTrace]] = ContextVar("current_update", default=None)
+
+
+class SqlStats:
+    """Statement counts, latency and row counts of instrumented engines, per fingerprint and per handler.
+
+    track_update puts a trace in a context variable; BoundedExecutor and the
+    async engine carry it over to the threads and greenlets that run the
+    statements, so each one is attributed to the update that caused it.
+    Statements outside any update, such as the fill ingest worker, only count
+    towards the fingerprint totals. Rows are the cursor rowcount, which covers
+    selected rows only where the driver reports them, as the MariaDB one does.
+    """
+
+    def __init__(self, slow_update_ms: Optional[float] = None) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.slow_update_ms = slow_update_ms
+        self._lock = threading.Lock()
+        self._statements: dict[str, _Totals] = {}
+        self._handlers: dict[str, _HandlerTotals] = {}
+
+    def instrument(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    @contextmanager
+    def track_update(self, update_id: int, handler: str) -> Iterator[UpdateTrace]:
+        """Attributes statements run inside the block to the update, handler may be renamed by name_handler."""
+        trace = UpdateTrace(update_id=update_id, handler=handler)
+        token = _current_update.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_update.reset(token)
+            self._finish(trace)
+
+    def name_handler(self, handler: str) -> None:
+        """Names the handler of the update being tracked, once the bot knows which one runs it."""
+        trace = _current_update.get()
+        if trace is not None:
+            trace.handler = handler
+
+    def handler_stats(self) -> list[HandlerStats]:
+        """Per handler totals, the handlers running the most statements first."""
+        with self._lock:
+            stats = [
+                HandlerStats(
+                    handler=handler,
+                    updates=totals.updates,
+                    statements=totals.statements,
+                    max_statements=totals.max_statements,
+                    sql_ms=totals.sql_total * 1000,
+                    rows=totals.rows,
+                    update_avg_ms=totals.update_total / totals.updates * 1000,
+                    update_max_ms=totals.update_longest * 1000,
+                )
+                for handler, totals in self._handlers.items()
+            ]
+        return sorted(stats, key=lambda s: s.statements, reverse=True)
+
+    def statement_stats(self, limit: Optional[int] = None) -> list[StatementStats]:
+        """Per fingerprint totals, the most time spent first."""
+        with self._lock:
+            stats = [_statement_stats(fp, totals) for fp, totals in self._statements.items()]
+        stats.sort(key=lambda s: s.total_ms, reverse=True)
+        return stats[:limit] if limit is not None else stats
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statements.clear()
+            self._handlers.clear()
+
+    @staticmethod
+    def _before_cursor_execute(
+        conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+    ) -> None:
+        # On the execution context rather than the connection, so a statement that raises leaves nothing behind
+        if context is not None:
+            context._sql_stats_started = time.perf_counter()
+
+    def _after_cursor_execute(
+        self, conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+    ) -> None:
+        started = getattr(context, "_sql_stats_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        rows = max(cursor.rowcount, 0)
+        statement_fingerprint = fingerprint(statement)
+        trace = _current_update.get()
+        with self._lock:
+            if statement_fingerprint not in self._statements and len(self._statements) >= MAX_FINGERPRINTS:
+                statement_fingerprint = OTHER_STATEMENTS
+            self._statements.setdefault(statement_fingerprint, _Totals()).add(elapsed, rows)
+            if trace is not None:
+                trace.statements.setdefault(statement_fingerprint, _Totals()).add(elapsed, rows)
+
+    def _finish(self, trace: UpdateTrace) -> None:
+        elapsed = time.perf_counter() - trace.started
+        with self._lock:
+            statements = list(trace.statements.items())
+            totals = self._handlers.setdefault(trace.handler, _HandlerTotals())
+            count = trace.statement_count
+            sql_total = sum(t.total for _, t in statements)
+            totals.updates += 1
+            totals.statements += count
+            totals.max_statements = max(totals.max_statements, count)
+            totals.sql_total += sql_total
+            totals.rows += sum(t.rows for _, t in statements)
+            totals.update_total += elapsed
+            totals.update_longest = max(totals.update_longest, elapsed)
+
+        if self.slow_update_ms is not None and elapsed * 1000 >= self.slow_update_ms:
+            slowest = sorted(statements, key=lambda item: item[1].total, reverse=True)[:3]
+            self.logger.warning(
+                f"Slow update {trace.update_id} in {trace.handler}: {elapsed * 1000:.0f} ms, "
+                f"{count} statements, {sql_total * 1000:.0f} ms in sql; slowest "
+                + "; ".join(f"{t.count}x {t.total * 1000:.1f} ms {fp[:120]}" for fp, t in slowest)
+            )
+
+
+def _statement_stats(statement_fingerprint: str, totals: _Totals) -> StatementStats:
+    return StatementStats(
+        fingerprint=statement_fingerprint,
+        count=totals.count,
+        total_ms=totals.total * 1000,
+        max_ms=totals.longest * 1000,
+        rows=totals.rows,
+    )
@@ -0,0 +1,33 @@
+from typing import Any, Callable
+from sqlalchemy import Table
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+
+def upsert(
+    db_session: Session,
+    table: Table,
+    rows: list[dict[str, Any]],
+    update: Callable[[Any], dict[str, Any]],
+) -> None:
+    """Inserts rows, updating the existing ones on primary key conflict.
+
+    update receives the namespace of the proposed row (VALUES() on MariaDB,
+    excluded on SQLite) and returns the column assignments for the conflict case.
+    """
+    if not rows:
+        return
+    dialect = db_session.get_bind().dialect.name
+    if dialect in ("mysql", "mariadb"):
+        stmt = mysql_insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(**update(stmt.inserted))
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_=update(stmt.excluded),
+        )
+    else:
+        raise NotImplementedError(f"Upsert is not supported for {dialect}")
+    db_session.execute(stmt)
@@ -1,12 +1,13 @@
 from typing import Optional, Any
+import json
 import os
 from entities import AppMode
 import argparse
 
 
-parser = argparse.ArgumentParser()
+parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument('--dotenv', action='store_true')
-args = parser.parse_args()
+args, _ = parser.parse_known_args()
 
 if args.dotenv:
     from dotenv import load_dotenv
@@ -22,6 +23,9 @@ class _Settings:
         self.mysql_password = os.getenv("MYSQL_PASSWORD")
         self.mysql_host = os.getenv("MYSQL_HOST")
         self.mysql_database = os.getenv("MYSQL_DATABASE")
+        self.replica_mysql_host = os.getenv("REPLICA_MYSQL_HOST")
+        self.replica_read_after_write_window = float(os.getenv("REPLICA_READ_AFTER_WRITE_WINDOW", "10"))
+        self.replica_retry_interval = float(os.getenv("REPLICA_RETRY_INTERVAL", "30"))
 
         self.redis_host = os.getenv("REDIS_HOST")
         self.redis_port = 6379
@@ -37,7 +41,56 @@ class _Settings:
         self.webapp_host = os.getenv("WEBAPP_HOST", "0.0.0.0")
         self.webapp_port = int(os.getenv("WEBAPP_PORT", "8000"))
 
+        self.scope_cache_size = int(os.getenv("SCOPE_CACHE_SIZE", "1024"))
+        self.scope_cache_ttl = float(os.getenv("SCOPE_CACHE_TTL", "300"))
+        self.user_cache_size = int(os.getenv("USER_CACHE_SIZE", "1024"))
+        self.user_cache_ttl = float(os.getenv("USER_CACHE_TTL", "3600"))
+        self.export_batch_size = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+        self.export_spool_max_size = int(os.getenv("EXPORT_SPOOL_MAX_SIZE", str(8 * 1024 * 1024)))
+        self.import_batch_size = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+        # Bank statement layouts for /import, {"<name>": {ImportMapping fields}}
+        self.import_mappings = json.loads(os.getenv("IMPORT_MAPPINGS", "{}"))
+        # Category reports summed from per-scope fill columns in memory instead of the rollup table
+        self.columnar_reports = os.getenv("COLUMNAR_REPORTS", "false").lower() in ("1", "true", "yes")
+        # Scopes kept in memory and seconds before a scope is loaded again to pick up rows changed in the database
+        self.columnar_scope_cache_size = int(os.getenv("COLUMNAR_SCOPE_CACHE_SIZE", "256"))
+        self.columnar_scope_ttl = float(os.getenv("COLUMNAR_SCOPE_TTL", "600"))
+        # Finished monthly report snapshots in redis, previous years kept longer
+        self.report_cache_ttl = int(os.getenv("REPORT_CACHE_TTL", "3600"))
+        self.report_cache_past_year_ttl = int(os.getenv("REPORT_CACHE_PAST_YEAR_TTL", str(30 * 24 * 60 * 60)))
+        self.reference_data_ttl = float(os.getenv("REFERENCE_DATA_TTL", "600"))
+        # How often a background task reads the reference data versions bumped by other replicas
+        self.reference_data_version_check_interval = float(
+            os.getenv("REFERENCE_DATA_VERSION_CHECK_INTERVAL", "5")
+        )
+
+        self.db_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+        self.db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+        self.db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+        self.db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+        self.db_pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+        # Write-behind mode: fills are confirmed once queued in redis and saved in batches by a consumer group
+        self.fill_write_behind = os.getenv("FILL_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+        self.fill_queue_batch_size = int(os.getenv("FILL_QUEUE_BATCH_SIZE", "50"))
+        self.fill_queue_max_attempts = int(os.getenv("FILL_QUEUE_MAX_ATTEMPTS", "5"))
+        self.fill_queue_retry_after = float(os.getenv("FILL_QUEUE_RETRY_AFTER", "30"))
+        self.fill_queue_poll_interval = float(os.getenv("FILL_QUEUE_POLL_INTERVAL", "0.5"))
+        # Seconds a telegram message is recognised as queued or saved already: the redis claim expires
+        # after this long and the idempotency keys of saved fills are purged, every purge interval
+        self.fill_ingest_key_ttl = int(os.getenv("FILL_INGEST_KEY_TTL", str(7 * 24 * 60 * 60)))
+        self.fill_ingest_key_purge_interval = float(os.getenv("FILL_INGEST_KEY_PURGE_INTERVAL", "3600"))
+
+        self.db_executor_workers = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+        self.db_executor_max_queue = int(os.getenv("DB_EXECUTOR_MAX_QUEUE", "32"))
+        self.redis_executor_workers = int(os.getenv("REDIS_EXECUTOR_WORKERS", "4"))
+        self.redis_executor_max_queue = int(os.getenv("REDIS_EXECUTOR_MAX_QUEUE", "64"))
+        self.cpu_executor_workers = int(os.getenv("CPU_EXECUTOR_WORKERS", "2"))
+        self.cpu_executor_max_queue = int(os.getenv("CPU_EXECUTOR_MAX_QUEUE", "8"))
+
         self.log_level = os.getenv("LOG_LEVEL", "INFO")
+        # Updates taking longer are logged with their slowest statements
+        self.slow_update_ms = float(os.getenv("SLOW_UPDATE_MS", "1000"))
 
         self.tz = os.getenv("TZ", "Europe/Moscow")
 
@@ -56,11 +109,31 @@ class _Settings:
     def _any_none(cls, *vals: Any) -> bool:
         return any(map(lambda v: v is None, vals))
 
+    def _mysql_uri(self, driver: str, host: Optional[str] = None) -> str:
+        host = host or self.mysql_host
+        if self._any_none(host, self.mysql_database, self.mysql_user, self.mysql_password):
+            raise ValueError('Database settings not defined')
+        return f"mysql+{driver}://{self.mysql_user}:{self.mysql_password}" f"@{host}/{self.mysql_database}"
+
     @property
     def database_uri(self) -> str:
-        if self._any_none(self.mysql_host, self.mysql_database, self.mysql_user, self.mysql_password):
-            raise ValueError('Database settings not defined')
-        return f"mysql+pymysql://{self.mysql_user}:{self.mysql_password}" f"@{self.mysql_host}/{self.mysql_database}"
+        return self._mysql_uri("pymysql")
+
+    @property
+    def async_database_uri(self) -> str:
+        return self._mysql_uri("aiomysql")
+
+    @property
+    def replica_database_uri(self) -> Optional[str]:
+        if self.replica_mysql_host is None:
+            return None
+        return self._mysql_uri("pymysql", self.replica_mysql_host)
+
+    @property
+    def async_replica_database_uri(self) -> Optional[str]:
+        if self.replica_mysql_host is None:
+            return None
+        return self._mysql_uri("aiomysql", self.replica_mysql_host)
 
     @property
     def webhook_url(self) -> str:
@@ -6,7 +6,7 @@ import pytest
 # Add the parent directory to the Python path so we can import modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from entities import User, FillScope, Currency, Income
+from entities import User, Fill, FillScope, Currency, Income
 from parsers.income import IncomeMessageParser
 
 
@@ -119,4 +119,98 @@ def mock_message():
 @pytest.fixture
 def income_parser():
     """Create an income parser with mock service"""
-    return IncomeMessageParser(MockCardFillService()) 
\ No newline at end of file
+    return IncomeMessageParser(MockCardFillService())
+
+
+@pytest.fixture
+def fill_parser():
+    """Create a fill parser with mock service"""
+    from parsers.fill import FillMessageParser
+
+    return FillMessageParser(MockCardFillService())
+
+
+@pytest.fixture
+def db_engine():
+    """In-memory SQLite database with the bot schema and reference data"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+    from model import Base
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    seed_reference_data(engine)
+    yield engine
+    engine.dispose()
+
+
+def seed_reference_data(engine):
+    from sqlalchemy.orm import Session
+    from model import StoredCategory, StoredFillScope, StoredCurrencyRate, StoredBudget
+
+    with Session(engine) as session:
+        session.add_all([
+            StoredCategory(code="FOOD", name="Продукты", aliases="еда,продукты,магнит", emoji_name=":shopping_cart:"),
+            StoredCategory(code="RESTAURANT", name="Рестораны", aliases="макдак,кофе.*", emoji_name=":fork_and_knife:"),
+            StoredCategory(code="TAXI", name="Такси", aliases="такси,яндекс такси", emoji_name=":taxi:"),
+            StoredCategory(code="OTHER", name="Другое", aliases="", emoji_name=":red_question_mark:"),
+            StoredFillScope(scope_id=1, scope_type="PRIVATE", chat_id=456),
+            StoredFillScope(scope_id=2, scope_type="GROUP", chat_id=-789),
+            StoredCurrencyRate(currency="RUB", rate=1.25),
+            StoredCurrencyRate(currency="EUR", rate=117.5),
+            StoredBudget(id=1, fill_scope=1, category_code="RESTAURANT", monthly_limit=10000),
+            StoredBudget(id=2, fill_scope=1, category_code="TAXI", monthly_limit=None, quarter_limit=9000),
+        ])
+        session.commit()
+
+
+@pytest.fixture
+def db_private_scope():
+    """Private scope 1 of the seeded test database"""
+    return FillScope(scope_id=1, scope_type="PRIVATE", chat_id=456)
+
+
+@pytest.fixture
+def db_group_scope():
+    """Group scope 2 of the seeded test database"""
+    return FillScope(scope_id=2, scope_type="GROUP", chat_id=-789)
+
+
+@pytest.fixture
+def make_fill(db_private_scope):
+    """Factory of unsaved fills, in the seeded private scope unless another one is given"""
+
+    def make(user, amount, description="такси", fill_date=datetime(2024, 3, 5), scope=None, currency=None):
+        return Fill(
+            id=None,
+            user=user,
+            fill_date=fill_date,
+            amount=amount,
+            description=description,
+            category=None,
+            scope=scope or db_private_scope,
+            currency=currency,
+        )
+
+    return make
+
+
+@pytest.fixture
+def card_fill_service(db_engine):
+    """CardFillService bound to the SQLite test database"""
+    from services.card_fill_service import CardFillService
+    return CardFillService(db_engine=db_engine)
+
+
+@pytest.fixture
+def db_file_uri(tmp_path):
+    """File-backed SQLite database shared by a sync and an async engine"""
+    from sqlalchemy import create_engine
+    from model import Base
+
+    db_path = tmp_path / "cardfillingbot.sqlite"
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(engine)
+    seed_reference_data(engine)
+    engine.dispose()
+    return f"sqlite+aiosqlite:///{db_path}"
@@ -0,0 +1,59 @@
+"""
+Test suite for bounded executor offloading
+"""
+
+import asyncio
+import threading
+import pytest
+
+from services.bounded_executor import BoundedExecutor, ExecutorOverloadedError, OffloadedService
+
+
+class TestBoundedExecutor:
+    """Test queue bounds and stats of BoundedExecutor"""
+
+    @pytest.mark.unit
+    def test_rejects_when_queue_is_full(self):
+        """Test that calls beyond workers + queue are rejected and counted"""
+        executor = BoundedExecutor("test", max_workers=1, max_queue=1)
+        release = threading.Event()
+
+        async def scenario():
+            running = asyncio.ensure_future(executor.run(release.wait))
+            queued = asyncio.ensure_future(executor.run(lambda: "queued"))
+            await asyncio.sleep(0.05)
+            stats_under_load = executor.stats()
+            with pytest.raises(ExecutorOverloadedError):
+                await executor.run(lambda: "rejected")
+            release.set()
+            return stats_under_load, await running, await queued
+
+        stats_under_load, running_result, queued_result = asyncio.run(scenario())
+        executor.shutdown()
+
+        assert stats_under_load.active == 1
+        assert stats_under_load.queued == 1
+        assert running_result is True
+        assert queued_result == "queued"
+        stats = executor.stats()
+        assert (stats.active, stats.queued, stats.rejected, stats.completed) == (0, 0, 1, 2)
+
+    @pytest.mark.unit
+    def test_offloaded_service_runs_methods_in_pool(self):
+        """Test that service methods become coroutines executed off the event loop thread"""
+
+        class BlockingService:
+            name = "blocking"
+
+            def whoami(self, suffix):
+                return threading.current_thread().name + suffix
+
+        executor = BoundedExecutor("svc", max_workers=1, max_queue=0)
+        service = OffloadedService(BlockingService(), executor)
+
+        thread_name = asyncio.run(service.whoami("!"))
+        executor.shutdown()
+
+        assert service.name == "blocking"
+        assert thread_name.startswith("svc-executor")
+        assert thread_name.endswith("!")
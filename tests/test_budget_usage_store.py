@@ -0,0 +1,182 @@
+"""
+Test suite for the redis budget usage counters
+"""
+
+import asyncio
+import threading
+import fakeredis
+import pytest
+from datetime import datetime
+
+from entities import Budget, Category, Month
+from formatters import format_fill_confirmed
+from services.budget_usage_store import BudgetUsageStore, UsageMiss
+from services.card_fill_service import CardFillService
+
+
+TAXI = Category(code="TAXI", name="Такси", aliases=(), emoji_name=":taxi:")
+
+
+@pytest.fixture
+def budget_usage():
+    return BudgetUsageStore(fakeredis.FakeRedis(decode_responses=True))
+
+
+class TestBudgetUsageStore:
+    """Test counters against the rollup through every write path"""
+
+    @pytest.mark.unit
+    def test_counters_are_trusted_only_after_rebuild(self, budget_usage):
+        """Test that increments alone do not make a hash readable"""
+        budget_usage.add([(1, 2024, 2, "TAXI", 10.0)])
+        assert budget_usage.get_usage([1], 2024, Month.february, "TAXI") == UsageMiss({(1, 2024): 1})
+
+        budget_usage.rebuild([(1, 2024)], [(1, 2024, 1, "TAXI", 5.0)])
+        budget_usage.add([(1, 2024, 2, "TAXI", 10.0), (1, 2024, 4, "TAXI", 1.5)])
+
+        assert budget_usage.get_usage([1], 2024, Month.february, "TAXI") == (10.0, 15.0, 16.5)
+        assert budget_usage.get_usage([1], 2024, Month.february, "FOOD") == (0.0, 0.0, 0.0)
+        assert isinstance(budget_usage.get_usage([1, 2], 2024, Month.february, "TAXI"), UsageMiss)
+
+    @pytest.mark.integration
+    def test_service_writes_keep_counters_exact(
+        self, db_engine, budget_usage, sample_user, make_fill, db_private_scope
+    ):
+        """Test new fill, category change, date change and delete against the rollup fallback"""
+        now = datetime.now()
+        service = CardFillService(db_engine=db_engine, budget_usage=budget_usage)
+        service.handle_new_fill(make_fill(sample_user, 30, "такси", now))
+        service.reconcile_budget_usage()
+
+        second = service.handle_new_fill(make_fill(sample_user, 20, "такси", now))
+        third = service.handle_new_fill(make_fill(sample_user, 70, "что-то", now))
+        service.change_category_for_fill(third.id, "TAXI")
+        service.change_date_for_fill(second, datetime(now.year, 1 if now.month != 1 else 2, 1))
+        service.delete_fill(service.get_fill_by_id(third.id))
+
+        from_counters = service.get_current_budget_usage_for_category(TAXI, db_private_scope)
+        from_rollup = CardFillService(db_engine=db_engine).get_current_budget_usage_for_category(TAXI, db_private_scope)
+        assert budget_usage.get_usage([1], now.year, Month(now.month), "TAXI") is not None
+        assert from_counters == from_rollup
+        assert (from_counters.amount, from_counters.year_amount) == (30, 50)
+
+    @pytest.mark.unit
+    def test_rebuild_missing_keeps_built_counters(self, budget_usage):
+        """Test that a rebuild after a miss only fills the hashes nobody built yet"""
+        budget_usage.rebuild([(1, 2024)], [(1, 2024, 2, "TAXI", 5.0)])
+        budget_usage.add([(1, 2024, 2, "TAXI", 10.0)])
+        miss = budget_usage.get_usage([1, 2], 2024, Month.february, "TAXI")
+
+        budget_usage.rebuild_missing(miss, [(1, 2024, 2, "TAXI", 1.0), (2, 2024, 2, "TAXI", 7.0)])
+
+        assert budget_usage.get_usage([1], 2024, Month.february, "TAXI") == (15.0, 15.0, 15.0)
+        assert budget_usage.get_usage([2], 2024, Month.february, "TAXI") == (7.0, 7.0, 7.0)
+
+    @pytest.mark.unit
+    def test_rebuild_missing_skips_hashes_written_after_the_miss(self, budget_usage):
+        """Test that an increment landing between the row read and the rebuild is not overwritten by the rows"""
+        budget_usage.add([(1, 2024, 2, "TAXI", 10.0)])
+        miss = budget_usage.get_usage([1], 2024, Month.february, "TAXI")
+        rows = [(1, 2024, 2, "TAXI", 10.0)]  # read from the database before the fill below committed
+        budget_usage.add([(1, 2024, 2, "TAXI", 4.0)])
+
+        budget_usage.rebuild_missing(miss, rows)
+        next_miss = budget_usage.get_usage([1], 2024, Month.february, "TAXI")
+        budget_usage.rebuild_missing(next_miss, [(1, 2024, 2, "TAXI", 14.0)])
+
+        assert next_miss == UsageMiss({(1, 2024): 2})
+        assert budget_usage.get_usage([1], 2024, Month.february, "TAXI") == (14.0, 14.0, 14.0)
+
+    @pytest.mark.integration
+    def test_fresh_scope_reads_counters_after_one_rebuild(
+        self, db_engine, budget_usage, sample_user, make_fill, db_private_scope
+    ):
+        """Test that the first budget check of a scope nobody reconciled builds its counters from the rollup"""
+        now = datetime.now()
+        service = CardFillService(db_engine=db_engine, budget_usage=budget_usage)
+        service.handle_new_fill(make_fill(sample_user, 30, "такси", now))
+        assert isinstance(budget_usage.get_usage([1], now.year, Month(now.month), "TAXI"), UsageMiss)
+
+        first = service.get_current_budget_usage_for_category(TAXI, db_private_scope)
+        service.handle_new_fill(make_fill(sample_user, 20, "такси", now))
+        status = service.handle_new_fill_with_budget_status(make_fill(sample_user, 5, "такси", now))
+
+        from_rollup = CardFillService(db_engine=db_engine).get_current_budget_usage_for_category(TAXI, db_private_scope)
+        assert first.amount == 30
+        assert budget_usage.get_usage([1], now.year, Month(now.month), "TAXI") == (
+            from_rollup.amount, from_rollup.quarter_amount, from_rollup.year_amount
+        )
+        assert (status.usage.amount, status.usage.year_amount) == (55, 55)
+
+    @pytest.mark.integration
+    def test_fill_committed_during_a_deferred_rebuild_is_kept(
+        self, db_engine, budget_usage, sample_user, make_fill, db_private_scope
+    ):
+        """Test a fill whose counters land after a miss read the rollup but before its rebuild ran"""
+        from services.redis_calls import collect_redis_calls, run_redis_calls
+
+        now = datetime.now()
+        service = CardFillService(db_engine=db_engine, budget_usage=budget_usage)
+        service.handle_new_fill(make_fill(sample_user, 30, "такси", now))
+        with collect_redis_calls() as rebuild:
+            service.get_current_budget_usage_for_category(TAXI, db_private_scope)
+        service.handle_new_fill(make_fill(sample_user, 20, "такси", now))
+        run_redis_calls(rebuild)
+
+        usage = service.get_current_budget_usage_for_category(TAXI, db_private_scope)
+        assert budget_usage.get_usage([1], now.year, Month(now.month), "TAXI") == (50, 50, 50)
+        assert (usage.amount, usage.year_amount) == (50, 50)
+
+
+class TestFillConfirmed:
+    """Test which usage is shown next to the limit"""
+
+    @pytest.mark.formatting
+    def test_usage_matches_limit_period(self, card_fill_service, sample_user, make_fill, db_private_scope):
+        """Test that a quarter limit is compared with the quarter usage"""
+        fill = card_fill_service.handle_new_fill(make_fill(sample_user, 20, "такси", datetime.now()))
+        usage = card_fill_service.get_current_budget_usage_for_category(TAXI, db_private_scope)
+        budget = Budget(id=2, scope=db_private_scope, category=TAXI, monthly_limit=None, quarter_limit=9000)
+
+        assert format_fill_confirmed(fill, budget, usage).endswith("Использовано 20 из 9000.")
+        assert "Использовано" not in format_fill_confirmed(fill, None, usage)
+
+
+class TestAsyncBudgetUsage:
+    """Test that the async service keeps redis work out of run_sync"""
+
+    @pytest.mark.integration
+    def test_counters_are_written_and_read_on_the_redis_executor(self, db_file_uri, sample_user, make_fill):
+        """Test a fill and its budget status through the async service against counters built on the first miss"""
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from services.async_card_fill_service import AsyncCardFillService
+        from services.bounded_executor import BoundedExecutor
+
+        redis_threads = set()
+
+        class RecordingRedis(fakeredis.FakeRedis):
+            def pipeline(self, *args, **kwargs):
+                redis_threads.add(threading.current_thread().name.split("_")[0])
+                return super().pipeline(*args, **kwargs)
+
+        budget_usage = BudgetUsageStore(RecordingRedis(decode_responses=True))
+        now = datetime.now()
+
+        async def scenario():
+            engine = create_async_engine(db_file_uri)
+            sync_service = CardFillService(db_engine=engine.sync_engine, budget_usage=budget_usage)
+            service = AsyncCardFillService(
+                sync_service, db_engine=engine, redis_executor=BoundedExecutor("redis", 1, 10)
+            )
+            try:
+                first = await service.handle_new_fill_with_budget_status(make_fill(sample_user, 30, "такси", now))
+                second = await service.handle_new_fill_with_budget_status(make_fill(sample_user, 20, "такси", now))
+                return first, second
+            finally:
+                await engine.dispose()
+
+        first, second = asyncio.run(scenario())
+
+        assert redis_threads == {"redis-executor"}
+        assert (first.usage.amount, second.usage.amount) == (30, 50)
+        assert budget_usage.get_usage([1], now.year, Month(now.month), "TAXI") == (50, 50, 50)
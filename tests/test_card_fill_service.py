@@ -0,0 +1,270 @@
+"""
+Test suite for CardFillService and AsyncCardFillService against SQLite
+"""
+
+import asyncio
+import pytest
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event
+
+from entities import Income, Currency, Month, User
+
+
+@contextmanager
+def captured_statements(engine):
+    """Collect the text of every statement executed on engine"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+class TestCardFillService:
+    """Test the sync service on an in-memory database"""
+
+    @pytest.mark.integration
+    def test_handle_new_fill_classifies_and_converts(self, card_fill_service, sample_user, make_fill):
+        """Test that a new fill gets a category and is converted to base currency"""
+        fill = card_fill_service.handle_new_fill(
+            make_fill(sample_user, 10, "кофе с собой", datetime(2024, 5, 3), currency=Currency.EUR)
+        )
+
+        assert fill.id is not None
+        assert fill.category.code == "RESTAURANT"
+        assert fill.amount == pytest.approx(1175.0)
+
+    @pytest.mark.integration
+    def test_monthly_report_by_category(self, card_fill_service, sample_user, make_fill, db_private_scope):
+        """Test month, quarter and year sums of the by-category report"""
+        card_fill_service.handle_new_fill(make_fill(sample_user, 100, "макдак", datetime(2024, 1, 10)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 200, "макдак", datetime(2024, 2, 10)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 50, "такси", datetime(2024, 2, 11)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 400, "макдак", datetime(2024, 5, 1)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 999, "макдак", datetime(2023, 2, 1)))
+
+        report = card_fill_service.get_monthly_report_by_category([Month.february], 2024, db_private_scope)
+        by_code = {row.category.code: row for row in report[Month.february]}
+
+        assert set(by_code) == {"RESTAURANT", "TAXI"}
+        assert by_code["RESTAURANT"].amount == 200
+        assert by_code["RESTAURANT"].quarter_amount == 300
+        assert by_code["RESTAURANT"].year_amount == 700
+        assert by_code["RESTAURANT"].monthly_limit == 10000
+        assert by_code["TAXI"].amount == 50
+        assert by_code["TAXI"].quarter_limit == 9000
+
+    @pytest.mark.integration
+    def test_reports_by_user_in_one_statement(
+        self, card_fill_service, db_engine, sample_user, make_fill, db_private_scope
+    ):
+        """Test per-user sums and debt balances come from one statement joined to telegram_user"""
+        other_user = User(
+            id=777, is_bot=False, first_name="Other", last_name=None, username="other", language_code="ru"
+        )
+        card_fill_service.handle_new_fill(make_fill(sample_user, 100, "макдак", datetime(2024, 1, 10)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 50, "такси", datetime(2024, 1, 11)))
+        card_fill_service.handle_new_fill(make_fill(other_user, 30, "такси", datetime(2024, 1, 12)))
+        with captured_statements(db_engine) as statements:
+            by_user = card_fill_service.get_monthly_report_by_user([Month.january], 2024, db_private_scope)
+            debt = card_fill_service.get_debt_monthly_report_by_user([Month.january], 2024, db_private_scope)
+
+        assert len(statements) == 2
+        assert {(r.user.username, r.amount) for r in by_user[Month.january]} == {("testuser", 150), ("other", 30)}
+        assert {(r.user.username, r.balance) for r in debt[Month.january]} == {("testuser", 60), ("other", -60)}
+
+    @pytest.mark.integration
+    def test_fill_with_budget_status(self, card_fill_service, db_engine, sample_user, make_fill, db_private_scope):
+        """Test that the budget status matches the full report and is read from the rollup only"""
+        now = datetime.now()
+        card_fill_service.handle_new_fill(make_fill(sample_user, 30, "такси", datetime(now.year, 1, 1)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 20, "такси", now))
+        card_fill_service.list_budgets(db_private_scope)
+        with captured_statements(db_engine) as statements:
+            status = card_fill_service.handle_new_fill_with_budget_status(make_fill(sample_user, 10, "такси", now))
+
+        assert not any("FROM card_fill " in statement or "FROM category" in statement for statement in statements)
+        month = Month(now.month)
+        expected = next(
+            r for r in card_fill_service.get_monthly_report_by_category([month], now.year, db_private_scope)[month]
+            if r.category.code == "TAXI"
+        )
+        assert status.usage == expected
+        assert status.budget.quarter_limit == 9000
+        assert status.fill.category.code == "TAXI"
+
+        changed = card_fill_service.change_category_for_fill_with_budget_status(status.fill.id, "FOOD")
+        assert (changed.fill.category.code, changed.usage.amount, changed.budget) == ("FOOD", 10, None)
+
+
+class TestStatementCounts:
+    """Test that entity-returning calls issue a fixed number of statements however many rows they return"""
+
+    @staticmethod
+    def count_statements(db_engine, fn):
+        with captured_statements(db_engine) as statements:
+            fn()
+        return len(statements)
+
+    @pytest.mark.integration
+    @pytest.mark.parametrize("rows", [1, 20])
+    def test_listing_statement_count(
+        self, card_fill_service, db_engine, sample_user, rows, make_fill, db_private_scope, db_group_scope
+    ):
+        """Test fills and incomes of a user, all fills and a single fill"""
+        for i in range(rows):
+            card_fill_service.handle_new_fill(make_fill(sample_user, 10 + i, "такси", datetime(2024, 1, 1 + i)))
+            other_user = User(
+                id=1000 + i, is_bot=False, first_name=None, last_name=None, username=None, language_code=None
+            )
+            card_fill_service.handle_new_fill(
+                make_fill(other_user, 5, "макдак", datetime(2024, 1, 1 + i), scope=db_group_scope)
+            )
+            card_fill_service.handle_new_income(
+                Income(
+                    id=None,
+                    user=sample_user,
+                    income_date=datetime(2024, 1, 1 + i),
+                    amount=100,
+                    description="зарплата",
+                    scope=db_private_scope,
+                )
+            )
+        months = [Month.january]
+        user_fills = lambda: card_fill_service.get_user_fills_in_months(sample_user, months, 2024, db_private_scope)
+        user_incomes = lambda: card_fill_service.get_user_income_in_months(sample_user, months, 2024, db_private_scope)
+
+        assert len(user_fills()) == rows
+        assert self.count_statements(db_engine, user_fills) == 3  # fills with users, categories, scopes
+        assert self.count_statements(db_engine, card_fill_service.get_all_fills) == 3
+        assert self.count_statements(db_engine, user_incomes) == 2  # incomes with users, scopes
+        assert self.count_statements(db_engine, lambda: card_fill_service.get_fill_by_id(1)) == 1
+
+    @pytest.mark.integration
+    def test_known_user_is_not_written_again(
+        self, card_fill_service, db_engine, sample_user, make_fill, db_private_scope
+    ):
+        """Test that only new or changed users reach telegram_user and renames show up in reports"""
+        from dataclasses import replace
+
+        renamed = replace(sample_user, username="renamed", first_name="New")
+        with captured_statements(db_engine) as statements:
+            card_fill_service.handle_new_fill(make_fill(sample_user, 100, "такси", datetime(2024, 3, 5)))
+            card_fill_service.handle_new_fill(make_fill(sample_user, 50, "такси", datetime(2024, 3, 6)))
+            card_fill_service.handle_new_fill(make_fill(renamed, 25, "такси", datetime(2024, 3, 7)))
+
+        user_statements = [s for s in statements if "telegram_user" in s]
+        assert len(user_statements) == 2
+        assert all(s.startswith("INSERT INTO telegram_user") for s in user_statements)
+        report = card_fill_service.get_monthly_report([Month.march], 2024, db_private_scope)
+        assert [(row.user.username, row.amount) for row in report[Month.march].by_user] == [("renamed", 175)]
+        stats = card_fill_service.user_cache_stats()
+        assert (stats.hits, stats.misses) == (2, 1)
+
+
+class TestCardFillRollup:
+    """Test that the monthly rollup follows every write and can be verified"""
+
+    @pytest.mark.integration
+    def test_rollup_follows_writes(self, card_fill_service, sample_user, make_fill, db_private_scope):
+        """Test new fill, category change, date change, delete and netting keep the rollup exact"""
+        first = card_fill_service.handle_new_fill(make_fill(sample_user, 100, "макдак", datetime(2024, 1, 10)))
+        second = card_fill_service.handle_new_fill(make_fill(sample_user, 40, "что-то", datetime(2024, 1, 11)))
+        third = card_fill_service.handle_new_fill(make_fill(sample_user, 70, "такси", datetime(2024, 2, 1)))
+
+        card_fill_service.change_category_for_fill(second.id, "FOOD")
+        card_fill_service.change_date_for_fill(first, datetime(2024, 3, 5))
+        card_fill_service.delete_fill(third)
+        card_fill_service.net_balances(db_private_scope)
+
+        assert card_fill_service.verify_rollup() == []
+        report = card_fill_service.get_monthly_report_by_category([Month.january, Month.march], 2024, db_private_scope)
+        assert {(r.category.code, r.amount) for r in report[Month.january] if r.amount} == {("FOOD", 40)}
+        assert {(r.category.code, r.amount) for r in report[Month.march] if r.amount} == {("RESTAURANT", 100)}
+        assert card_fill_service.get_debt_monthly_report_by_user([Month.january], 2024, db_private_scope) == {}
+
+    @pytest.mark.integration
+    def test_net_balances_and_rollback(self, card_fill_service, db_engine, sample_user, make_fill, db_private_scope):
+        """Test that netting is one UPDATE of card_fill and a recorded batch can be rolled back"""
+        card_fill_service.handle_new_fill(make_fill(sample_user, 100, "макдак", datetime(2024, 1, 10)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 40, "такси", datetime(2024, 2, 11)))
+        with captured_statements(db_engine) as statements:
+            batch = card_fill_service.net_balances(db_private_scope)
+
+        card_fill_statements = [s for s in statements if "card_fill " in s or s.rstrip().endswith("card_fill")]
+        assert len(card_fill_statements) == 1 and card_fill_statements[0].startswith("UPDATE card_fill")
+        assert batch.fill_count == 2 and batch.batch_id is not None
+        assert card_fill_service.get_debt_monthly_report_by_user([Month.january], 2024, db_private_scope) == {}
+
+        assert card_fill_service.rollback_netting(batch.batch_id) == 2
+        assert card_fill_service.verify_rollup() == []
+        debt = card_fill_service.get_debt_monthly_report_by_user([Month.january], 2024, db_private_scope)
+        assert [r.amount for r in debt[Month.january]] == [100]
+        assert card_fill_service.net_balances(db_private_scope, record_batch=False).batch_id is None
+        assert card_fill_service.verify_rollup() == []
+
+    @pytest.mark.integration
+    def test_rebuild_reports_and_fixes_drift(self, card_fill_service, db_engine, sample_user, make_fill):
+        """Test that drift is reported by verify and removed by rebuild"""
+        from sqlalchemy import text
+
+        card_fill_service.handle_new_fill(make_fill(sample_user, 100, "макдак", datetime(2024, 1, 10)))
+        with db_engine.begin() as conn:
+            conn.execute(text("update card_fill_rollup set amount_sum = amount_sum + 1"))
+
+        drift = card_fill_service.verify_rollup()
+        assert len(drift) == 1
+        assert (drift[0].category_code, drift[0].expected_amount, drift[0].actual_amount) == ("RESTAURANT", 100, 101)
+
+        assert card_fill_service.rebuild_rollup([1]) == drift
+        assert card_fill_service.verify_rollup() == []
+
+
+class TestAsyncCardFillService:
+    """Test that the async service runs the shared logic on an async engine"""
+
+    @pytest.mark.integration
+    def test_fill_and_report_roundtrip(self, db_file_uri, sample_user, make_fill):
+        """Test writing and reading through the async service"""
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from services.async_card_fill_service import AsyncCardFillService
+
+        async def scenario():
+            engine = create_async_engine(db_file_uri)
+            service = AsyncCardFillService(db_engine=engine)
+            try:
+                scope = await service.get_scope(456)
+                fill = await service.handle_new_fill(
+                    make_fill(sample_user, 300, "такси", datetime(2024, 3, 5), scope=scope)
+                )
+                income = await service.handle_new_income(
+                    Income(
+                        id=None,
+                        user=sample_user,
+                        income_date=datetime(2024, 3, 1),
+                        amount=1000,
+                        description="salary",
+                        scope=scope,
+                    )
+                )
+                report = await service.get_monthly_report([Month.march], 2024, scope)
+                income_report = await service.get_income_monthly_report_by_user([Month.march], 2024, scope)
+                fills = await service.get_user_fills_in_months(sample_user, [Month.march], 2024, scope)
+                return fill, income, report, income_report, fills
+            finally:
+                await engine.dispose()
+
+        fill, income, report, income_report, fills = asyncio.run(scenario())
+
+        assert fill.category.code == "TAXI"
+        assert income.id is not None
+        assert report[Month.march].by_user[0].amount == 300
+        assert report[Month.march].by_category[0].category.code == "TAXI"
+        assert income_report[Month.march][0].amount == 1000
+        assert [f.id for f in fills] == [fill.id]
@@ -0,0 +1,88 @@
+"""
+Test suite for the compiled category classifier
+"""
+
+import pytest
+from datetime import datetime
+
+from entities import Category, Fill, FillScope
+from model import StoredCategory
+from services.category_classifier import CategoryClassifier
+
+
+OTHER = Category(code="OTHER", name="Другое", aliases=(), emoji_name=":red_question_mark:")
+CATEGORIES = [
+    Category(code="TAXI", name="Такси", aliases=("такси", "яндекс.*"), emoji_name=":taxi:"),
+    Category(code="RESTAURANT", name="Рестораны", aliases=("макдак", "кофе.*", "яндекс еда"), emoji_name=":pizza:"),
+    Category(code="FOOD", name="Продукты", aliases=("кофе", "магнит"), emoji_name=":shopping_cart:"),
+    OTHER,
+]
+
+
+def by_desc(description, categories):
+    """Reference result of StoredCategory.by_desc for entity categories"""
+    stored = [
+        StoredCategory(code=c.code, name=c.name, aliases=",".join(c.aliases), emoji_name=c.emoji_name)
+        for c in categories
+    ]
+    default = next(s for s in stored if s.code == "OTHER")
+    return StoredCategory.by_desc(description, stored, default).code
+
+
+class TestCategoryClassifier:
+    """Test that the classifier gives the same answers as StoredCategory.by_desc"""
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("description", [
+        "такси",
+        "Такси домой",
+        "яндекс еда",  # literal alias of a later category, earlier regex wins
+        "кофе",  # literal alias of a later category, earlier regex wins
+        "КОФЕ с собой",
+        "магнит",
+        "неизвестно",
+        "",
+    ])
+    def test_first_match_wins(self, description):
+        """Test classification against the reference implementation"""
+        classifier = CategoryClassifier(CATEGORIES, OTHER)
+        assert classifier.classify(description).code == by_desc(description, CATEGORIES)
+
+    @pytest.mark.unit
+    def test_falls_back_to_separate_patterns(self):
+        """Test aliases that cannot be combined into one pattern"""
+        categories = [
+            Category(code="A", name="A", aliases=(r"(x)\1",), emoji_name=""),
+            Category(code="B", name="B", aliases=(r"(?P<c0>y)",), emoji_name=""),
+            OTHER,
+        ]
+        classifier = CategoryClassifier(categories, OTHER)
+
+        assert classifier.classify("xx").code == "A"
+        assert classifier.classify("y").code == "B"
+        assert classifier.classify("z").code == "OTHER"
+
+    @pytest.mark.integration
+    def test_service_rebuilds_classifier_after_alias_added(self, card_fill_service, sample_user):
+        """Test that a category change that adds an alias is picked up by the next fill"""
+        scope = FillScope(scope_id=1, scope_type="PRIVATE", chat_id=456)
+
+        def new_fill(description):
+            return card_fill_service.handle_new_fill(
+                Fill(
+                    id=None,
+                    user=sample_user,
+                    fill_date=datetime(2024, 4, 1),
+                    amount=10,
+                    description=description,
+                    category=None,
+                    scope=scope,
+                )
+            )
+
+        first = new_fill("пятерочка")
+        assert first.category.code == "OTHER"
+
+        card_fill_service.change_category_for_fill(first.id, "FOOD")
+
+        assert new_fill("Пятерочка").category.code == "FOOD"
@@ -0,0 +1,142 @@
+"""
+Test suite for the NumPy month matrix and the columnar fill store behind category reports
+"""
+
+import numpy as np
+import pytest
+from datetime import datetime
+from sqlalchemy import insert, update
+
+from entities import Income, Month, Quarter, User
+from model import StoredCardFill
+from services.card_fill_service import CardFillService
+from services.columnar_report import ColumnarFillStore, MonthMatrix
+from services.reference_data_cache import ReferenceDataCache
+
+
+def by_code(report, month):
+    return {r.category.code: (r.amount, r.quarter_amount, r.year_amount) for r in report[month]}
+
+
+class TestMonthMatrix:
+    """Test sums per month and their cumulative totals"""
+
+    @pytest.mark.unit
+    def test_quarter_year_to_date_and_order(self):
+        """Test period totals against a plain sum and groups ordered by their first month"""
+        months = np.array([0, 1, 1, 4, 11, 3])
+        groups = np.array([1, 1, 0, 0, 2, 0])
+        amounts = np.array([10.0, 5.0, 7.0, 1.0, 2.0, 3.0])
+
+        matrix = MonthMatrix(months, groups, amounts, group_count=4)
+
+        assert matrix.month(Month.february).tolist() == [7.0, 5.0, 0.0, 0.0]
+        assert matrix.quarter(Quarter.q1).tolist() == [7.0, 15.0, 0.0, 0.0]
+        assert matrix.quarter(Quarter.q2).tolist() == [4.0, 0.0, 0.0, 0.0]
+        assert matrix.year_to_date(Month.may).tolist() == [11.0, 15.0, 0.0, 0.0]
+        assert matrix.year().tolist() == [11.0, 15.0, 2.0, 0.0]
+        assert matrix.present() == [1, 0, 2]
+
+
+class TestColumnarFillStore:
+    """Test that columnar reports follow every write like the rollup does"""
+
+    @pytest.mark.integration
+    def test_reports_match_rollup_through_writes(self, db_engine, sample_user, make_fill, db_private_scope):
+        """Test appends above the high-water fill_id, edits through invalidate and late commits below it"""
+        from sqlalchemy import event
+
+        store = ColumnarFillStore(ReferenceDataCache())
+        columnar = CardFillService(db_engine=db_engine, fill_columns=store)
+        rollup = CardFillService(db_engine=db_engine)
+
+        def assert_same():
+            for month in (Month.january, Month.march):
+                expected = rollup.get_monthly_report_by_category([month], 2024, db_private_scope)
+                actual = columnar.get_monthly_report_by_category([month], 2024, db_private_scope)
+                assert by_code(actual, month) == by_code(expected, month)
+
+        def insert_fill(fill_id, amount):
+            with db_engine.begin() as conn:
+                conn.execute(
+                    insert(StoredCardFill),
+                    [dict(fill_id=fill_id, user_id=sample_user.id, fill_date=datetime(2024, 3, 1), amount=amount,
+                          category_code="TAXI", fill_scope=1, is_netted=False)],
+                )
+            rollup.rebuild_rollup()
+
+        taxi = columnar.handle_new_fill(make_fill(sample_user, 50, "такси", datetime(2024, 3, 5)))
+        columnar.handle_new_fill(make_fill(sample_user, 100, "макдак", datetime(2024, 1, 10)))
+        columnar.handle_new_fill(make_fill(sample_user, 999, "макдак", datetime(2023, 1, 10)))
+        assert_same()
+
+        latest = columnar.handle_new_fill(make_fill(sample_user, 30, "магнит", datetime(2024, 3, 6)))
+        loads = []
+        event.listen(
+            db_engine,
+            "before_cursor_execute",
+            lambda *args: loads.append(args[3]) if "card_fill.fill_id >" in args[2] else None,
+        )
+        assert_same()
+        assert loads[0][-1] == latest.id - 1  # only rows above the fills loaded by the first report
+
+        columnar.change_category_for_fill(taxi.id, "OTHER")
+        columnar.change_date_for_fill(latest, datetime(2024, 1, 2))
+        assert_same()
+
+        insert_fill(100, 7)
+        assert_same()
+        insert_fill(90, 11)  # committed after fill 100 was loaded
+        store.added(1, [90])
+        assert_same()
+        columnar.delete_fill(taxi)
+        assert_same()
+
+    @pytest.mark.integration
+    def test_scopes_are_reloaded_after_ttl_and_evicted_lru(self, db_engine, sample_user, make_fill, db_group_scope):
+        """Test that rows missed by the appending reads show up after ttl and only maxsize scopes are kept"""
+        now = [0.0]
+        store = ColumnarFillStore(ReferenceDataCache(), maxsize=1, ttl=60, clock=lambda: now[0])
+        service = CardFillService(db_engine=db_engine, fill_columns=store)
+        service.handle_new_fill(make_fill(sample_user, 50))
+        service.handle_new_fill(make_fill(sample_user, 20))
+
+        with service.db_session() as db_session:
+            assert store.columns(db_session, 1).amount.tolist() == [50, 20]
+            with db_engine.begin() as conn:
+                conn.execute(update(StoredCardFill).values(amount=StoredCardFill.amount + 1))
+            assert store.columns(db_session, 1).amount.tolist() == [50, 20]
+            now[0] = 61
+            assert store.columns(db_session, 1).amount.tolist() == [51, 21]
+
+            store.columns(db_session, db_group_scope.scope_id)
+            assert list(store._scopes) == [db_group_scope.scope_id]
+
+    @pytest.mark.integration
+    def test_income_report_by_user(self, card_fill_service, sample_user, db_private_scope):
+        """Test monthly income sums per user with months without income left out"""
+        other = User(id=777, is_bot=False, first_name="Other", last_name=None, username="other", language_code=None)
+        for user, amount, income_date in (
+            (sample_user, 100, datetime(2024, 3, 1)),
+            (sample_user, 50, datetime(2024, 3, 20)),
+            (other, 70, datetime(2024, 3, 2)),
+            (other, 30, datetime(2024, 4, 2)),
+        ):
+            card_fill_service.handle_new_income(
+                Income(
+                    id=None,
+                    user=user,
+                    income_date=income_date,
+                    amount=amount,
+                    description="зп",
+                    scope=db_private_scope,
+                )
+            )
+
+        report = card_fill_service.get_income_monthly_report_by_user(
+            [Month.march, Month.april, Month.may], 2024, db_private_scope
+        )
+
+        assert {(r.user.username, r.amount) for r in report[Month.march]} == {("testuser", 150), ("other", 70)}
+        assert [(r.user.username, r.amount) for r in report[Month.april]] == [("other", 30)]
+        assert report[Month.may] == []
@@ -0,0 +1,97 @@
+"""
+Test suite for the instrumented connection pool
+"""
+
+import asyncio
+import pytest
+from datetime import datetime
+from sqlalchemy import event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from entities import Fill, Month
+from services.db_pool import create_async_db_engine, create_db_engine
+from settings import settings
+
+
+class TestDbPool:
+    """Test pool configuration, pre-ping and checkout stats"""
+
+    @pytest.mark.unit
+    def test_pool_configured_from_settings(self, monkeypatch, tmp_path):
+        """Test that size, overflow, timeout, recycle and pre-ping come from settings"""
+        monkeypatch.setattr(settings, "db_pool_size", 3)
+        monkeypatch.setattr(settings, "db_max_overflow", 2)
+        monkeypatch.setattr(settings, "db_pool_timeout", 7.0)
+        monkeypatch.setattr(settings, "db_pool_recycle", 600)
+        monkeypatch.setattr(settings, "db_pool_pre_ping", True)
+
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'pool.sqlite'}")
+        pool = engine.pool
+
+        assert (pool.size(), pool._max_overflow, pool._timeout, pool._recycle, pool._pre_ping) == (3, 2, 7.0, 600, True)
+        engine.dispose()
+
+    @pytest.mark.integration
+    def test_pre_ping_replaces_stale_connection(self, tmp_path):
+        """Test that a connection closed behind the pool's back is replaced on checkout"""
+        engine = create_db_engine(f"sqlite:///{tmp_path / 'pool.sqlite'}", pool_size=1, max_overflow=0)
+        with engine.connect() as conn:
+            conn.connection.dbapi_connection.close()
+
+        with engine.connect() as conn:
+            assert conn.execute(text("select 1")).scalar() == 1
+        engine.dispose()
+
+    @pytest.mark.integration
+    def test_checkout_stats_and_timeout(self, tmp_path):
+        """Test checked-out count and that a checkout past the limit times out and is counted"""
+        engine = create_db_engine(
+            f"sqlite:///{tmp_path / 'pool.sqlite'}", pool_size=1, max_overflow=0, pool_timeout=0.05
+        )
+        held = engine.connect()
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+        stats = engine.pool.stats("db")
+        held.close()
+
+        assert (stats.checked_out, stats.checkouts, stats.timeouts) == (1, 2, 1)
+        assert stats.checkout_max_ms >= 50
+        assert engine.pool.stats("db").checked_out == 0
+        engine.dispose()
+
+    @pytest.mark.integration
+    def test_concurrent_handlers_stay_within_pool_limit(self, db_file_uri, sample_user):
+        """Test that concurrent handlers share a small pool without exceeding size + overflow"""
+        from services.async_card_fill_service import AsyncCardFillService
+
+        handlers = 20
+
+        async def scenario():
+            engine = create_async_db_engine(db_file_uri, pool_size=2, max_overflow=1)
+            checked_out = []
+            event.listen(
+                engine.sync_engine, "checkout", lambda *args: checked_out.append(engine.pool.checkedout())
+            )
+            service = AsyncCardFillService(db_engine=engine)
+            now = datetime.now()
+
+            async def handler():
+                scope = await service.get_scope(456)
+                await service.handle_new_fill_with_budget_status(
+                    Fill(id=None, user=sample_user, fill_date=now, amount=10, description="такси", category=None, scope=scope)
+                )
+                return await service.get_monthly_report([Month(now.month)], now.year, scope)
+
+            try:
+                await asyncio.gather(*(handler() for _ in range(handlers)))
+                report = await service.get_monthly_report([Month(now.month)], now.year, await service.get_scope(456))
+                return report, service.pool_stats(), max(checked_out)
+            finally:
+                await engine.dispose()
+
+        report, stats, max_checked_out = asyncio.run(scenario())
+
+        assert sum(row.amount for row in report[Month(datetime.now().month)].by_user) == 10 * handlers
+        assert max_checked_out <= 3
+        assert stats.checked_out == 0 and stats.timeouts == 0
+        assert stats.checkouts >= 2 * handlers
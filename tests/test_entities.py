@@ -0,0 +1,38 @@
+"""
+Test suite for interned entity objects
+"""
+
+import gc
+import pytest
+
+from entities import Category, FillScope, User
+
+
+class TestInternedEntities:
+    """Test sharing, replacement and hashing of interned entities"""
+
+    @pytest.mark.unit
+    def test_same_key_shares_instance_until_fields_change(self):
+        """Test that equal rows share one instance and a changed row replaces it"""
+        first = Category.interned("TEST_TAXI", "Такси", ("такси",), ":taxi:")
+        assert Category.interned("TEST_TAXI", "Такси", ("такси",), ":taxi:") is first
+
+        renamed = Category.interned("TEST_TAXI", "Такси и каршеринг", ("такси",), ":taxi:")
+        assert renamed is not first and renamed.name == "Такси и каршеринг"
+        assert Category.interned("TEST_TAXI", "Такси и каршеринг", ("такси",), ":taxi:") is renamed
+
+    @pytest.mark.unit
+    def test_hash_by_primary_key(self):
+        """Test that entities hash by key and keep value equality, also with a list field"""
+        scope = FillScope.interned(9001, "GROUP", -1, report_scopes=[9001, 9002])
+        assert {scope: 1}[FillScope(9001, "GROUP", -1, report_scopes=[9001, 9002])] == 1
+        assert hash(User(1, False, "a", "b", "c", "ru")) == hash(User(1, True, "x", "y", "z", "en"))
+        assert User(1, False, "a", "b", "c", "ru") != User(1, True, "x", "y", "z", "en")
+        assert not hasattr(scope, "__dict__")
+
+    @pytest.mark.unit
+    def test_unreferenced_instances_are_dropped(self):
+        """Test that the intern table does not keep instances alive"""
+        User.interned(424242, False, "Temp", None, "temp", "ru")
+        gc.collect()
+        assert 424242 not in User._interned
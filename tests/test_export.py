@@ -0,0 +1,100 @@
+"""
+Test suite for the streaming gzip CSV /dump export
+"""
+
+import asyncio
+import csv
+import gzip
+import io
+import pytest
+from datetime import date, datetime
+
+from entities import DumpTable, FillScope, Income
+from parsers.command import parse_dump_options
+from services.csv_export import SpooledInputFile, write_csv_gz
+
+
+def read_csv_gz(data: bytes) -> list[list[str]]:
+    return list(csv.reader(io.StringIO(gzip.decompress(data).decode())))
+
+
+class TestDumpOptions:
+    """Test parsing of /dump arguments"""
+
+    @pytest.mark.parsing
+    def test_defaults_and_filters(self):
+        """Test that both tables are exported by default and filters are parsed"""
+        assert parse_dump_options(()).tables == (DumpTable.FILLS, DumpTable.INCOME)
+
+        options = parse_dump_options(("income", "scope=2", "from=2024-01-01", "to=2024-03-31"))
+        assert options.tables == (DumpTable.INCOME,)
+        assert (options.scope_id, options.date_from, options.date_to) == (2, date(2024, 1, 1), date(2024, 3, 31))
+
+    @pytest.mark.parsing
+    @pytest.mark.parametrize("arguments", [("users",), ("scope=x",), ("from=2024-13-01",), ("limit=5",)])
+    def test_invalid_arguments(self, arguments):
+        """Test that bad arguments raise ValueError"""
+        with pytest.raises(ValueError):
+            parse_dump_options(arguments)
+
+
+    @pytest.mark.parsing
+    def test_dump_command_is_not_a_fill(self, card_fill_service, mock_message):
+        """Test that the scope number of a /dump command is not read as a fill amount"""
+        from parsers.fill import FillMessageParser
+
+        parser = FillMessageParser(card_fill_service)
+        assert parser.parse(mock_message("/dump scope=2")) is None
+        assert parser.parse(mock_message("150 такси")).data.amount == 150
+
+
+class TestCsvExport:
+    """Test export rows and the gzip CSV writer"""
+
+    @pytest.mark.integration
+    def test_fill_rows_filtered_by_scope_and_dates(
+        self, card_fill_service, sample_user, make_fill, db_group_scope
+    ):
+        """Test that the date range includes the whole last day and excludes other scopes"""
+        card_fill_service.handle_new_fill(make_fill(sample_user, 10, fill_date=datetime(2024, 1, 31, 23, 59)))
+        card_fill_service.handle_new_fill(make_fill(sample_user, 20, fill_date=datetime(2024, 2, 1)))
+        card_fill_service.handle_new_fill(
+            make_fill(sample_user, 30, fill_date=datetime(2024, 1, 15), scope=db_group_scope)
+        )
+
+        rows = list(card_fill_service.iter_fill_export_rows(1, date(2024, 1, 1), date(2024, 1, 31)))
+
+        assert [(row[1], row[3], row[4], row[5]) for row in rows] == [(1, datetime(2024, 1, 31, 23, 59), 10, "TAXI")]
+
+    @pytest.mark.integration
+    def test_income_dump_roundtrip(self, card_fill_service, sample_user):
+        """Test that income rows come back from the compressed file, also after spilling to disk"""
+        scope = FillScope(scope_id=1, scope_type="PRIVATE", chat_id=456)
+        for amount in (100, 200):
+            card_fill_service.handle_new_income(
+                Income(
+                    id=None,
+                    user=sample_user,
+                    income_date=datetime(2024, 5, 1, 12),
+                    amount=amount,
+                    description="зарплата",
+                    scope=scope,
+                )
+            )
+
+        dump = write_csv_gz(
+            card_fill_service.INCOME_EXPORT_COLUMNS, card_fill_service.iter_income_export_rows(), spool_max_size=16
+        )
+
+        async def read_all():
+            return b"".join([chunk async for chunk in SpooledInputFile(dump, "income.csv.gz", chunk_size=8).read(None)])
+
+        with dump:
+            assert dump._rolled  # past spool_max_size the data is on disk
+            rows = read_csv_gz(asyncio.run(read_all()))
+
+        assert rows[0] == list(card_fill_service.INCOME_EXPORT_COLUMNS)
+        assert [(row[3], row[4], row[5]) for row in rows[1:]] == [
+            ("2024-05-01T12:00:00", "100.0", "зарплата"),
+            ("2024-05-01T12:00:00", "200.0", "зарплата"),
+        ]
@@ -0,0 +1,194 @@
+"""
+Test suite for the write-behind fill queue and idempotent saving of queued fills
+"""
+
+import asyncio
+import logging
+import fakeredis
+import pytest
+from datetime import datetime
+
+from entities import Month, User
+from services.fill_ingest_queue import FillIngestQueue, FillIngestStats
+
+
+@pytest.fixture
+def queue():
+    queue = FillIngestQueue(fakeredis.FakeRedis(decode_responses=True), consumer="test", max_attempts=2, retry_after=0)
+    queue.ensure_group()
+    return queue
+
+
+class TestFillIngestQueue:
+    """Test claiming keys, delivery, retry and the dead-letter stream"""
+
+    @pytest.mark.unit
+    def test_enqueue_read_ack(self, queue, sample_user, make_fill):
+        """Test that a claimed key is queued once and an acked entry leaves the stream"""
+        user = User(id=1, is_bot=False, first_name="Anna", last_name=None, username=None, language_code=None)
+        assert queue.claim_key("456_10")
+        assert not queue.claim_key("456_10")
+        queue.enqueue("456_10", make_fill(sample_user, 150, "макдак"), 456, 11)
+        queue.enqueue("456_12", make_fill(user, 300, "такси"), 456, 13)
+
+        entries = queue.read(10)
+
+        assert [(e.key, e.fill.amount, e.fill.user, e.message_id) for e in entries] == [
+            ("456_10", 150, sample_user, 11),
+            ("456_12", 300, user, 13),
+        ]
+        assert queue.stats() == FillIngestStats(backlog=2, pending=2, dead=0)
+        queue.ack(entries)
+        assert queue.stats() == FillIngestStats(backlog=0, pending=0, dead=0)
+
+    @pytest.mark.unit
+    def test_failed_entries_are_retried_then_dead_lettered(self, queue, sample_user, make_fill):
+        """Test redelivery of a failed entry and the move to the dead-letter stream after max_attempts"""
+        queue.enqueue("456_10", make_fill(sample_user, 150, "макдак"), 456, 11)
+        queue.rdb.xadd(queue.stream, {"key": "456_12", "fill": "not json", "chat_id": "456", "message_id": "13"})
+
+        first = queue.read(10)
+        assert [e.key for e in first] == ["456_10"]  # the undecodable entry goes straight to dead letters
+        assert queue.fail(first, "OperationalError") == []
+
+        retried = queue.read(10)
+        assert [e.entry_id for e in retried] == [first[0].entry_id]
+        assert queue.fail(retried, "OperationalError") == retried
+
+        assert queue.read(10) == []
+        assert queue.stats() == FillIngestStats(backlog=0, pending=0, dead=2)
+        dead = queue.rdb.xrange(queue.dead_stream)
+        assert [(fields["key"], fields["error"]) for _, fields in dead][1] == ("456_10", "OperationalError")
+
+    @pytest.mark.unit
+    def test_claim_is_released_when_queueing_fails(self, queue, sample_user, mock_message, make_fill):
+        """Test that a fill whose confirmation could not be sent is queued when telegram delivers it again"""
+        from types import SimpleNamespace
+        from handlers.fill import FillMessageHandler
+        from parsers.fill import FillMessage
+        from services.bounded_executor import BoundedExecutor
+
+        class Bot:
+            def __init__(self):
+                self.sent = 0
+
+            async def send_message(self, chat_id, text, **kwargs):
+                self.sent += 1
+                if self.sent == 1:
+                    raise ConnectionError("telegram is unreachable")
+                return SimpleNamespace(message_id=100 + self.sent)
+
+        app = SimpleNamespace(
+            bot=Bot(), fill_ingest_queue=queue, redis_executor=BoundedExecutor("redis", 1, 10), logger=None
+        )
+        original_message = mock_message("150 макдак")
+        original_message.message_id = 10
+        message = FillMessage(original_message, make_fill(sample_user, 150, "макдак"))
+        handler = FillMessageHandler(app)
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(handler.handle(message))
+        assert queue.stats().backlog == 0
+        asyncio.run(handler.handle(message))
+
+        assert [(e.key, e.message_id) for e in queue.read(10)] == [("456_10", 102)]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("overloaded", ["claim_key", "enqueue"])
+    def test_fill_is_saved_right_away_when_the_redis_executor_is_overloaded(
+        self, queue, card_fill_service, sample_user, mock_message, make_fill, db_private_scope, overloaded
+    ):
+        """Test that a saturated redis executor at either queue step falls back to saving the fill in the handler"""
+        from types import SimpleNamespace
+        from handlers.fill import FillMessageHandler
+        from parsers.fill import FillMessage
+        from services.bounded_executor import ExecutorOverloadedError
+
+        class Executor:
+            async def run(self, fn, *args):
+                if fn.__name__ == overloaded:
+                    raise ExecutorOverloadedError("redis executor queue is full")
+                return fn(*args)
+
+        class Bot:
+            async def send_message(self, chat_id, text, **kwargs):
+                return SimpleNamespace(message_id=101)
+
+            async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+                return SimpleNamespace(message_id=message_id, text=text)
+
+        class Service:
+            async def handle_new_fill_with_budget_status(self, fill):
+                return card_fill_service.handle_new_fill_with_budget_status(fill)
+
+        class Cache:
+            async def set_fill_for_message(self, message, fill):
+                pass
+
+        app = SimpleNamespace(
+            bot=Bot(),
+            fill_ingest_queue=queue,
+            redis_executor=Executor(),
+            card_fill_service=Service(),
+            cache_service=Cache(),
+            logger=logging.getLogger(__name__),
+        )
+        original_message = mock_message("150 макдак")
+        original_message.message_id = 10
+
+        message = FillMessage(original_message, make_fill(sample_user, 150, "макдак"))
+
+        asyncio.run(FillMessageHandler(app).handle(message))
+
+        fills = card_fill_service.get_user_fills_in_months(sample_user, [Month.march], 2024, db_private_scope)
+        assert [f.amount for f in fills] == [150]
+        assert queue.stats().backlog == 0
+        assert queue.claim_key("456_10")  # no claim is left behind to hide a redelivery
+
+
+class TestIngestFills:
+    """Test that CardFillService.ingest_fills saves every key once"""
+
+    @pytest.mark.integration
+    def test_redelivered_batch_is_not_saved_twice(self, card_fill_service, sample_user, make_fill, db_private_scope):
+        """Test statuses of new, repeated and deleted keys against the stored fills"""
+        statuses = card_fill_service.ingest_fills(
+            [("456_10", make_fill(sample_user, 150, "макдак")), ("456_12", make_fill(sample_user, 300, "такси"))]
+        )
+        assert [statuses[key].fill.category.code for key in ("456_10", "456_12")] == ["RESTAURANT", "TAXI"]
+        assert statuses["456_12"].budget.quarter_limit == 9000
+
+        card_fill_service.delete_fill(statuses["456_10"].fill)
+        again = card_fill_service.ingest_fills(
+            [
+                ("456_10", make_fill(sample_user, 150, "макдак")),
+                ("456_12", make_fill(sample_user, 300, "такси")),
+                ("456_14", make_fill(sample_user, 20, "такси")),
+            ]
+        )
+
+        assert again["456_10"] is None
+        assert again["456_12"].fill.id == statuses["456_12"].fill.id
+        fills = card_fill_service.get_user_fills_in_months(sample_user, [Month.march], 2024, db_private_scope)
+        assert sorted(f.amount for f in fills) == [20, 300]
+
+    @pytest.mark.integration
+    def test_purge_keeps_recent_keys(self, card_fill_service, db_engine, sample_user, make_fill):
+        """Test that only keys older than the ttl are purged, a recent redelivery is still recognised"""
+        from datetime import timedelta
+        from sqlalchemy import update
+        from model import StoredFillIngestKey
+
+        statuses = card_fill_service.ingest_fills(
+            [("456_10", make_fill(sample_user, 150, "макдак")), ("456_12", make_fill(sample_user, 300, "такси"))]
+        )
+        with db_engine.begin() as conn:
+            conn.execute(
+                update(StoredFillIngestKey.__table__)
+                .where(StoredFillIngestKey.ingest_key == "456_10")
+                .values(created_at=datetime.now() - timedelta(days=8))
+            )
+
+        assert card_fill_service.purge_ingest_keys(timedelta(days=7)) == 1
+        again = card_fill_service.ingest_fills([("456_12", make_fill(sample_user, 300, "такси"))])
+        assert again["456_12"].fill.id == statuses["456_12"].fill.id
@@ -0,0 +1,127 @@
+"""
+Test suite for the /import command: file reading, batching and duplicates
+"""
+
+import io
+import pytest
+from datetime import datetime
+
+from entities import ImportOptions, Month, ServiceCommandType, User
+from parsers.command import ServiceCommandMessageParser, parse_import_options
+from services.csv_export import write_csv_gz
+from services.fill_import import FillImportReader, ImportMapping
+
+
+STATEMENT_MAPPING = ImportMapping(
+    date_column="Дата операции",
+    amount_column="Сумма",
+    description_column="Описание",
+    currency_column="Валюта",
+    base_currency="RSD",
+    date_format="%d.%m.%Y %H:%M",
+    delimiter=";",
+    decimal_comma=True,
+)
+
+STATEMENT = (
+    "Дата операции;Сумма;Валюта;Описание\n"
+    "05.03.2024 12:00;-1 500,50;RSD;Такси\n"
+    "05.03.2024 13:00;-10,00;EUR;кофе\n"
+    "06.03.2024 09:00;25 000,00;RSD;Зарплата\n"
+    "07.03.2024;-100,00;RSD;Магнит\n"
+    "08.03.2024 10:00;-300,00;USD;Отель\n"
+    "05.03.2024 12:00;-1 500,50;RSD;Такси\n"
+)
+
+
+class TestImportOptions:
+    """Test parsing of /import arguments"""
+
+    @pytest.mark.parsing
+    def test_options(self):
+        """Test defaults and named options"""
+        assert parse_import_options(()) == ImportOptions()
+        assert parse_import_options(("mapping=bank", "scope=2")) == ImportOptions(mapping="bank", scope_id=2)
+
+    @pytest.mark.parsing
+    def test_mapping_name_keeps_its_case(self, mock_message):
+        """Test that only the command and option names are case-insensitive, not the mapping name"""
+        message = mock_message("")
+        message.text = None
+        message.caption = "/Import Mapping=RaiffeisenRSD scope=2"
+
+        parsed = ServiceCommandMessageParser().parse(message)
+
+        assert parsed.data == ServiceCommandType.IMPORT
+        assert parse_import_options(parsed.arguments) == ImportOptions(mapping="RaiffeisenRSD", scope_id=2)
+
+    @pytest.mark.parsing
+    @pytest.mark.parametrize("arguments", [("bank",), ("scope=x",), ("from=2024-01-01",)])
+    def test_invalid_options(self, arguments):
+        """Test that bad arguments raise ValueError"""
+        with pytest.raises(ValueError):
+            parse_import_options(arguments)
+
+
+class TestFillImport:
+    """Test importing dumps and bank statements through CardFillService.import_fills"""
+
+    @pytest.mark.integration
+    def test_dump_reimport_reports_duplicates(
+        self, card_fill_service, db_engine, sample_user, make_fill, db_group_scope
+    ):
+        """Test that a dump imported back is all duplicates, and into another scope is inserted in batches"""
+        from sqlalchemy import event
+
+        for day, (amount, description) in enumerate([(100, "макдак"), (50, "такси"), (30, "магнит")], start=1):
+            card_fill_service.handle_new_fill(make_fill(sample_user, amount, description, datetime(2024, 3, day)))
+        card_fill_service.change_category_for_fill(1, "OTHER")
+        dump = write_csv_gz(card_fill_service.FILL_EXPORT_COLUMNS, card_fill_service.iter_fill_export_rows(), 1024)
+
+        with dump:
+            same_scope = card_fill_service.import_fills(FillImportReader(dump))
+            inserts = []
+            event.listen(
+                db_engine,
+                "before_cursor_execute",
+                lambda *args: inserts.append(args[2]) if args[2].startswith("INSERT INTO card_fill ") else None,
+            )
+            progress = []
+            other_scope = card_fill_service.import_fills(
+                FillImportReader(dump, scope_id=2), batch_size=2, on_progress=progress.append
+            )
+
+        assert (same_scope.processed, same_scope.imported, same_scope.duplicates) == (3, 0, 3)
+        assert same_scope.duplicate_lines == (2, 3, 4)
+        assert (other_scope.imported, other_scope.duplicates, len(inserts)) == (3, 0, 2)
+        assert [report.processed for report in progress] == [2, 3]
+        report = card_fill_service.get_monthly_report_by_category([Month.march], 2024, db_group_scope)
+        # Category codes in the file are kept, the changed category of the first fill too
+        assert {r.category.code: r.amount for r in report[Month.march]} == {"OTHER": 100, "TAXI": 50, "FOOD": 30}
+
+    @pytest.mark.integration
+    def test_statement_import(self, card_fill_service, db_private_scope):
+        """Test sign, decimal comma, conversion, skipped income, bad rows and a duplicate line"""
+        importer = User(id=999, is_bot=False, first_name="Admin", last_name=None, username="admin", language_code="ru")
+        reader = FillImportReader(
+            io.BytesIO(STATEMENT.encode()), STATEMENT_MAPPING, scope_id=1, user_id=importer.id
+        )
+
+        report = card_fill_service.import_fills(reader, users=[importer])
+
+        assert (report.imported, report.duplicates, report.duplicate_lines) == (2, 1, (7,))
+        assert (reader.skipped, reader.invalid, [line for line, _ in reader.errors]) == (1, 1, [5])
+        assert report.errors == ((6, "unknown currency USD"),)
+        fills = card_fill_service.get_user_fills_in_months(importer, [Month.march], 2024, db_private_scope)
+        assert sorted((f.description, f.amount, f.category.code) for f in fills) == [
+            ("Такси", 1500.5, "TAXI"),
+            ("кофе", pytest.approx(1175.0), "RESTAURANT"),
+        ]
+
+    @pytest.mark.unit
+    def test_wrong_layout_is_rejected(self):
+        """Test that a file without the dump columns or the mapping columns raises ValueError"""
+        with pytest.raises(ValueError):
+            list(FillImportReader(io.BytesIO(b"date,amount\n2024-01-01,10\n")))
+        with pytest.raises(ValueError):
+            list(FillImportReader(io.BytesIO(b"date;amount\n"), STATEMENT_MAPPING, scope_id=1, user_id=1))
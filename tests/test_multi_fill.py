@@ -0,0 +1,83 @@
+"""
+Test suite for messages with several fills
+"""
+
+import pytest
+from datetime import datetime
+
+from entities import Currency, Fill, Month
+from formatters import format_fills_confirmed
+from parsers.fill import FillMessage, MultiFillMessage
+
+
+class TestMultiFillParsing:
+    """Test splitting a message into fills"""
+
+    @pytest.mark.parsing
+    def test_one_fill_per_line(self, fill_parser, mock_message):
+        """Test that every line with one amount becomes a fill"""
+        parsed = fill_parser.parse(mock_message("150 макдак\n\n300 такси\n20e кофе"))
+
+        assert isinstance(parsed, MultiFillMessage)
+        assert [(f.amount, f.currency, f.description) for f in parsed.data] == [
+            (150.0, None, "макдак"),
+            (300.0, None, "такси"),
+            (20.0, Currency.EUR, "кофе"),
+        ]
+        assert {f.scope.chat_id for f in parsed.data} == {456}
+
+    @pytest.mark.parsing
+    def test_single_fill_over_lines_stays_single(self, fill_parser, mock_message):
+        """Test that a message with one amount is one fill even when it spans lines"""
+        parsed = fill_parser.parse(mock_message("150\nмакдак"))
+
+        assert isinstance(parsed, FillMessage)
+        assert (parsed.data.amount, parsed.data.description) == (150.0, "макдак")
+
+    @pytest.mark.parsing
+    @pytest.mark.parametrize("text", ["150 макдак 2 шт", "150 макдак\nтакси 300 и 20", "150 макдак\n2 такси 3 раза"])
+    def test_ambiguous_messages_are_rejected(self, fill_parser, mock_message, text):
+        """Test that a line without exactly one amount rejects the whole message"""
+        assert fill_parser.parse(mock_message(text)) is None
+
+
+class TestHandleNewFills:
+    """Test saving the fills of one message"""
+
+    @staticmethod
+    def make_fills(user, scope):
+        return [
+            Fill(id=None, user=user, fill_date=datetime(2024, 3, 5), amount=amount, description=description,
+                 category=None, scope=scope, currency=currency)
+            for amount, description, currency in ((150, "макдак", None), (300, "такси", None), (20, "кофе", Currency.EUR))
+        ]
+
+    @pytest.mark.integration
+    def test_bulk_insert_in_one_statement(self, card_fill_service, db_engine, sample_user, db_private_scope):
+        """Test classification, conversion, ids in input order and a single card_fill INSERT"""
+        from sqlalchemy import event
+
+        statements = []
+        event.listen(db_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        fills = card_fill_service.handle_new_fills(self.make_fills(sample_user, db_private_scope))
+
+        assert len([s for s in statements if s.startswith("INSERT INTO card_fill ")]) == 1
+        assert [f.category.code for f in fills] == ["RESTAURANT", "TAXI", "RESTAURANT"]
+        assert fills[2].amount == pytest.approx(2350.0)
+        assert [card_fill_service.get_fill_by_id(f.id).description for f in fills] == ["макдак", "такси", "кофе"]
+
+        report = card_fill_service.get_monthly_report_by_category([Month.march], 2024, db_private_scope)
+        assert {r.category.code: r.amount for r in report[Month.march]} == {"RESTAURANT": 2500, "TAXI": 300}
+
+    @pytest.mark.integration
+    def test_summary_after_deleting_one_fill(self, card_fill_service, sample_user, db_private_scope):
+        """Test the summary text before and after deleting one listed fill"""
+        fills = card_fill_service.handle_new_fills(self.make_fills(sample_user, db_private_scope))
+        card_fill_service.delete_fill(fills[1])
+        remaining = [fills[0], fills[2]]
+
+        assert "Принято записей: 3" in format_fills_confirmed(fills)
+        assert format_fills_confirmed(remaining).endswith("Итого: 2500.00 дин.")
+        assert len(card_fill_service.get_user_fills_in_months(sample_user, [Month.march], 2024, db_private_scope)) == 2
+        assert format_fills_confirmed([]) == "Все записи удалены."
@@ -0,0 +1,122 @@
+"""
+Test suite checking that report queries are served by date-range index scans
+"""
+
+import pytest
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event
+
+from entities import Month
+
+
+DATE_RANGE_COLUMNS = ("fill_date", "income_date")
+
+
+@contextmanager
+def captured_selects(engine):
+    """Collect SELECT statements with a date range filter executed on engine"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and any(
+            f"{column} >=" in statement for column in DATE_RANGE_COLUMNS
+        ):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def query_plan(engine, statement, parameters):
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+
+
+@pytest.fixture
+def service_with_fills(card_fill_service, sample_user, make_fill):
+    for month in (1, 2, 3, 5):
+        card_fill_service.handle_new_fill(make_fill(sample_user, 100, "макдак", datetime(2024, month, 10)))
+    return card_fill_service
+
+
+ROLLUP_REPORT_CALLS = {
+    "monthly_by_category": lambda s, u, scope: s.get_monthly_report_by_category([Month.february], 2024, scope),
+    "monthly_by_user": lambda s, u, scope: s.get_monthly_report_by_user([Month.february, Month.march], 2024, scope),
+    "debt_by_user": lambda s, u, scope: s.get_debt_monthly_report_by_user([Month.january, Month.may], 2024, scope),
+}
+
+
+REPORT_CALLS = {
+    "user_fills": lambda s, u, scope: s.get_user_fills_in_months(u, [Month.may], 2024, scope),
+    "user_income": lambda s, u, scope: s.get_user_income_in_months(u, [Month.may], 2024, scope),
+    "income_by_user": lambda s, u, scope: s.get_income_monthly_report_by_user([Month.may], 2024, scope),
+}
+
+
+class TestReportQueryPlans:
+    """Test that every report query uses an index range scan on the date column"""
+
+    @pytest.mark.integration
+    @pytest.mark.parametrize("report", REPORT_CALLS.keys())
+    def test_report_query_uses_index_range(
+        self, db_engine, service_with_fills, sample_user, db_private_scope, report
+    ):
+        """Test EXPLAIN of each captured report query"""
+        with captured_selects(db_engine) as statements:
+            REPORT_CALLS[report](service_with_fills, sample_user, db_private_scope)
+
+        assert statements, f"{report} issued no date-filtered query"
+        for statement, parameters in statements:
+            plan = query_plan(db_engine, statement, parameters)
+            table_steps = [step for step in plan if " card_fill" in step or " income" in step]
+            assert table_steps, plan
+            for step in table_steps:
+                assert step.startswith("SEARCH"), plan
+                assert "USING INDEX" in step or "USING COVERING INDEX" in step, plan
+                assert any(f"{column}>?" in step for column in DATE_RANGE_COLUMNS), plan
+
+    @pytest.mark.integration
+    @pytest.mark.parametrize("report", ROLLUP_REPORT_CALLS.keys())
+    def test_aggregate_report_reads_rollup_only(
+        self, db_engine, service_with_fills, sample_user, db_private_scope, report
+    ):
+        """Test that aggregate reports never touch card_fill and search the rollup by key"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            ROLLUP_REPORT_CALLS[report](service_with_fills, sample_user, db_private_scope)
+        finally:
+            event.remove(db_engine, "before_cursor_execute", before_cursor_execute)
+
+        assert not any("card_fill " in statement for statement, _ in statements)
+        rollup_statements = [(st, params) for st, params in statements if "card_fill_rollup" in st]
+        assert rollup_statements
+        for statement, parameters in rollup_statements:
+            plan = query_plan(db_engine, statement, parameters)
+            assert any(step.startswith("SEARCH card_fill_rollup USING INDEX") for step in plan), plan
+
+    @pytest.mark.unit
+    def test_period_filter_merges_adjacent_months(self, card_fill_service, db_engine):
+        """Test that adjacent months collapse into one half-open range"""
+        from model import StoredCardFill
+
+        criterion = card_fill_service._period_filter(
+            StoredCardFill.fill_date, 2024, [Month.december, Month.january, Month.february]
+        )
+        compiled = criterion.compile(db_engine)
+        bounds = sorted(set(compiled.params.values()))
+
+        assert bounds == [
+            datetime(2024, 1, 1),
+            datetime(2024, 3, 1),
+            datetime(2024, 12, 1),
+            datetime(2025, 1, 1),
+        ]
@@ -0,0 +1,169 @@
+"""
+Test suite for the versioned reference-data cache and its use in CardFillService
+"""
+
+import asyncio
+import threading
+import fakeredis
+import pytest
+from datetime import datetime
+from sqlalchemy import event
+
+from entities import Category, Currency, Fill, FillScope
+from services.card_fill_service import CardFillService
+from services.reference_data_cache import ReferenceDataCache
+from services.redis_calls import collect_redis_calls, run_redis_calls
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReferenceDataCache:
+    """Test version checks, ttl and sharing versions through redis"""
+
+    @pytest.mark.unit
+    def test_reloads_after_bump_and_ttl(self):
+        """Test that a snapshot is served until its version is bumped or it gets too old"""
+        clock = FakeClock()
+        cache = ReferenceDataCache(ttl=100, clock=clock)
+        loads = []
+
+        def load(version):
+            loads.append(version)
+            return ("snapshot", len(loads))
+
+        first = cache.get("categories", load)
+        assert cache.get("categories", load) is first
+        cache.bump("categories")
+        second = cache.get("categories", load)
+        clock.now = 100
+        cache.get("categories", load)
+
+        assert second == ("snapshot", 2)
+        assert loads == [0, 1, 1]
+
+    @pytest.mark.unit
+    def test_bump_invalidates_other_replicas(self):
+        """Test that a write on one replica is seen by another after its next version refresh"""
+        rdb = fakeredis.FakeRedis()
+        writer = ReferenceDataCache(rdb=rdb)
+        reader = ReferenceDataCache(rdb=rdb)
+        loads = []
+
+        def load(version):
+            loads.append(version)
+            return len(loads)
+
+        assert reader.get("budgets_1", load) == 1
+        # The first refresh cannot tell whether the snapshot is behind the counter
+        reader.refresh_versions()
+        assert reader.get("budgets_1", load) == 2
+        reader.refresh_versions()
+        assert reader.get("budgets_1", load) == 2
+
+        writer.bump("budgets_1")
+        assert reader.get("budgets_1", load) == 2
+        reader.refresh_versions()
+        assert reader.get("budgets_1", load) == 3
+        assert reader.version("budgets_1") == 2
+
+    @pytest.mark.unit
+    def test_bump_inside_collected_calls_waits_for_them(self):
+        """Test that a bump made inside collect_redis_calls drops the snapshot at once and writes redis later"""
+        rdb = fakeredis.FakeRedis()
+        cache = ReferenceDataCache(rdb=rdb)
+        cache.get("categories", lambda version: "old")
+
+        with collect_redis_calls() as redis_calls:
+            cache.bump("categories")
+
+        assert cache.get("categories", lambda version: "new") == "new"
+        assert rdb.get("reference_data_version_categories") is None
+        run_redis_calls(redis_calls)
+        assert int(rdb.get("reference_data_version_categories")) == 1
+
+
+class TestCardFillServiceReferenceData:
+    """Test that reference data is read from snapshots and refreshed on writes"""
+
+    @pytest.mark.integration
+    def test_lookups_query_once(self, db_engine, sample_user):
+        """Test that categories, budgets and currency rates are only loaded by the first round"""
+        service = CardFillService(db_engine=db_engine, reference_data=ReferenceDataCache())
+        scope = FillScope(scope_id=1, scope_type="PRIVATE", chat_id=456)
+        statements = []
+        event.listen(db_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        for round_number in range(3):
+            if round_number == 1:
+                statements.clear()
+            service.list_categories()
+            service.list_budgets(scope)
+            assert service.get_budget_for_category(
+                Category(code="RESTAURANT", name="", aliases=(), emoji_name=""), scope
+            ).monthly_limit == 10000
+            service.handle_new_fill(
+                Fill(
+                    id=None,
+                    user=sample_user,
+                    fill_date=datetime(2024, 4, 1),
+                    amount=10,
+                    description="такси",
+                    category=None,
+                    scope=scope,
+                    currency=Currency.EUR,
+                )
+            )
+
+        assert statements
+        for table in ("category", "budget", "currency_rate"):
+            assert not any(f"FROM {table}" in statement for statement in statements), table
+
+    @pytest.mark.integration
+    def test_new_category_bumps_version(self, card_fill_service):
+        """Test that a created category shows up in the next snapshot"""
+        before = card_fill_service.get_category_snapshot()
+        card_fill_service.create_new_category(Category(code="CAFE", name="Кафе", aliases=(), emoji_name=":coffee:"))
+        after = card_fill_service.get_category_snapshot()
+
+        assert after.version == before.version + 1
+        assert "CAFE" in {category.code for category in after.categories}
+
+    @pytest.mark.integration
+    def test_async_service_bumps_versions_off_the_event_loop(self, db_file_uri):
+        """Test that the version bump of a write made through run_sync reaches redis from the redis executor"""
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from services.async_card_fill_service import AsyncCardFillService
+        from services.bounded_executor import BoundedExecutor
+
+        incr_threads = []
+
+        class RecordingRedis(fakeredis.FakeRedis):
+            def incr(self, name, amount=1):
+                incr_threads.append(threading.current_thread())
+                return super().incr(name, amount)
+
+        rdb = RecordingRedis()
+
+        async def scenario():
+            engine = create_async_engine(db_file_uri)
+            sync_service = CardFillService(db_engine=engine.sync_engine, reference_data=ReferenceDataCache(rdb=rdb))
+            service = AsyncCardFillService(
+                sync_service, db_engine=engine, redis_executor=BoundedExecutor("redis", 1, 10)
+            )
+            try:
+                await service.create_new_category(
+                    Category(code="CAFE", name="Кафе", aliases=(), emoji_name=":coffee:")
+                )
+            finally:
+                await engine.dispose()
+
+        asyncio.run(scenario())
+
+        assert int(rdb.get("reference_data_version_categories")) == 1
+        assert [thread.name.startswith("redis-executor") for thread in incr_threads] == [True]
@@ -0,0 +1,119 @@
+"""
+Test suite for routing report reads to a replica database
+"""
+
+import asyncio
+import shutil
+import pytest
+from sqlalchemy import create_engine
+
+from entities import Month
+from services.card_fill_service import CardFillService
+from services.replica_router import ReplicaRouter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def march_total(report):
+    return sum(row.amount for row in report[Month.march].by_user)
+
+
+@pytest.fixture
+def replica_uri(db_file_uri):
+    """Copy of the seeded primary file, which then lags behind every write to the primary"""
+    primary_path = db_file_uri.split(":///", 1)[1]
+    replica_path = primary_path.replace(".sqlite", "-replica.sqlite")
+    shutil.copy(primary_path, replica_path)
+    return f"sqlite+aiosqlite:///{replica_path}"
+
+
+def sync_uri(uri):
+    return uri.replace("sqlite+aiosqlite", "sqlite")
+
+
+class TestReplicaRouting:
+    """Test read-your-own-writes, routing per scope and fallback to the primary"""
+
+    @pytest.mark.integration
+    def test_reports_follow_writes_of_their_scope(
+        self, db_file_uri, replica_uri, sample_user, make_fill, db_private_scope, db_group_scope
+    ):
+        """Test that a scope reads the primary right after its write and the replica afterwards"""
+        clock = FakeClock()
+        service = CardFillService(
+            db_engine=create_engine(sync_uri(db_file_uri)),
+            replica_db_engine=create_engine(sync_uri(replica_uri)),
+        )
+        service.replica_router = ReplicaRouter(read_after_write_window=10, retry_interval=30, clock=clock)
+
+        service.handle_new_fill(make_fill(sample_user, 300))
+        service.handle_new_fill(make_fill(sample_user, 50, scope=db_group_scope))
+        clock.now = 5
+        service.handle_new_fill(make_fill(sample_user, 100))
+
+        assert march_total(service.get_monthly_report([Month.march], 2024, db_private_scope)) == 400
+        # The group scope was written earlier, past the window its reads go to the stale replica
+        clock.now = 12
+        assert march_total(service.get_monthly_report([Month.march], 2024, db_group_scope)) == 0
+        clock.now = 16
+        assert march_total(service.get_monthly_report([Month.march], 2024, db_private_scope)) == 0
+
+        stats = service.replica_router.stats()
+        assert (stats.primary_reads, stats.replica_reads, stats.fallbacks) == (1, 2, 0)
+
+    @pytest.mark.integration
+    def test_falls_back_to_primary_when_replica_is_down(
+        self, db_file_uri, tmp_path, sample_user, make_fill, db_private_scope
+    ):
+        """Test that a failed replica read is repeated on the primary and the replica is skipped until retry"""
+        clock = FakeClock()
+        service = CardFillService(
+            db_engine=create_engine(sync_uri(db_file_uri)),
+            replica_db_engine=create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.sqlite'}"),
+        )
+        service.replica_router = ReplicaRouter(read_after_write_window=10, retry_interval=30, clock=clock)
+        service.handle_new_fill(make_fill(sample_user, 300))
+        clock.now = 11
+
+        assert march_total(service.get_monthly_report([Month.march], 2024, db_private_scope)) == 300
+        assert len(service.get_user_fills_in_months(sample_user, [Month.march], 2024, db_private_scope)) == 1
+
+        stats = service.replica_router.stats()
+        assert (stats.replica_reads, stats.primary_reads, stats.fallbacks, stats.available) == (1, 1, 1, False)
+        clock.now = 42
+        assert service.replica_router.stats().available
+
+    @pytest.mark.integration
+    def test_async_reports_use_replica_engine(self, db_file_uri, replica_uri, sample_user, make_fill, db_private_scope):
+        """Test the same routing through AsyncCardFillService with async engines"""
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from services.async_card_fill_service import AsyncCardFillService
+
+        clock = FakeClock()
+
+        async def scenario():
+            engine, replica_engine = create_async_engine(db_file_uri), create_async_engine(replica_uri)
+            service = AsyncCardFillService(db_engine=engine, replica_db_engine=replica_engine)
+            service._card_fill_service.replica_router = ReplicaRouter(
+                read_after_write_window=10, retry_interval=30, clock=clock
+            )
+            try:
+                await service.handle_new_fill(make_fill(sample_user, 300))
+                right_after_write = await service.get_monthly_report([Month.march], 2024, db_private_scope)
+                clock.now = 11
+                after_window = await service.get_monthly_report([Month.march], 2024, db_private_scope)
+                return right_after_write, after_window
+            finally:
+                await engine.dispose()
+                await replica_engine.dispose()
+
+        right_after_write, after_window = asyncio.run(scenario())
+
+        assert march_total(right_after_write) == 300
+        assert march_total(after_window) == 0
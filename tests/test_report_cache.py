@@ -0,0 +1,155 @@
+"""
+Test suite for the redis snapshots of finished monthly reports
+"""
+
+import asyncio
+import fakeredis
+import pytest
+from datetime import datetime
+
+from entities import Income, Month
+from services.card_fill_service import CardFillService
+from services.report_cache import ReportCache, ReportSnapshot
+
+
+@pytest.fixture
+def report_cache():
+    return ReportCache(fakeredis.FakeRedis(decode_responses=True), ttl=60, past_year_ttl=3600)
+
+
+class TestReportCache:
+    """Test snapshot keys against the writes that outdate them"""
+
+    @pytest.mark.unit
+    def test_snapshot_round_trip_and_ttl(self, report_cache, db_private_scope):
+        """Test that the diagram survives the text-decoding client and past years are kept longer"""
+        this_year = datetime.now().year
+        diagram = bytes(range(256))
+        current = report_cache.snapshot_key(db_private_scope, this_year, [Month.march])
+        past = report_cache.snapshot_key(db_private_scope, this_year - 1, [Month.march, Month.april])
+        report_cache.set(current, ReportSnapshot(text="*март*", diagram=diagram), this_year)
+        report_cache.set(past, ReportSnapshot(text="март и апрель"), this_year - 1)
+
+        assert report_cache.get(current) == ReportSnapshot(text="*март*", diagram=diagram)
+        assert report_cache.get(past) == ReportSnapshot(text="март и апрель")
+        assert 0 < report_cache.rdb.ttl(current) <= 60
+        assert 60 < report_cache.rdb.ttl(past) <= 3600
+
+    @pytest.mark.integration
+    def test_writes_outdate_only_their_scope_and_year(
+        self, db_engine, sample_user, report_cache, make_fill, db_private_scope, db_group_scope
+    ):
+        """Test fill, income and budget writes against the keys of current and previous year reports"""
+        service = CardFillService(db_engine=db_engine, report_cache=report_cache)
+        months = [Month.march]
+
+        def keys():
+            return (
+                report_cache.snapshot_key(db_private_scope, 2024, months),
+                report_cache.snapshot_key(db_private_scope, 2023, months),
+                report_cache.snapshot_key(db_group_scope, 2024, months),
+            )
+
+        before = keys()
+        fill = service.handle_new_fill(make_fill(sample_user, 150, "макдак", datetime(2024, 3, 5)))
+        after_fill = keys()
+        assert [a != b for a, b in zip(before, after_fill)] == [True, False, False]
+
+        service.change_date_for_fill(fill, datetime(2023, 3, 5))
+        after_move = keys()
+        assert [a != b for a, b in zip(after_fill, after_move)] == [True, True, False]
+
+        income = service.handle_new_income(
+            Income(
+                id=None,
+                user=sample_user,
+                income_date=datetime(2023, 3, 1),
+                amount=100,
+                description="зп",
+                scope=db_private_scope,
+            )
+        )
+        after_income = keys()
+        assert [a != b for a, b in zip(after_move, after_income)] == [False, True, False]
+        service.delete_income(income)
+        assert keys()[1] != after_income[1]
+
+        service.invalidate_budgets(db_group_scope)
+        assert [a != b for a, b in zip(after_income, keys())] == [False, True, True]
+
+    @pytest.mark.integration
+    def test_async_writes_bump_versions_on_the_redis_executor(
+        self, db_file_uri, sample_user, make_fill, db_private_scope
+    ):
+        """Test that the version bumps of a fill and a budget change leave run_sync for the redis executor"""
+        import threading
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from services.async_card_fill_service import AsyncCardFillService
+        from services.bounded_executor import BoundedExecutor
+
+        bump_threads = []
+
+        class RecordingRedis(fakeredis.FakeRedis):
+            def pipeline(self, *args, **kwargs):
+                bump_threads.append(threading.current_thread().name.split("_")[0])
+                return super().pipeline(*args, **kwargs)
+
+        report_cache = ReportCache(RecordingRedis(decode_responses=True))
+        before = report_cache.snapshot_key(db_private_scope, 2024, [Month.march])
+
+        async def scenario():
+            engine = create_async_engine(db_file_uri)
+            sync_service = CardFillService(db_engine=engine.sync_engine, report_cache=report_cache)
+            service = AsyncCardFillService(
+                sync_service, db_engine=engine, redis_executor=BoundedExecutor("redis", 1, 10)
+            )
+            try:
+                await service.handle_new_fill(make_fill(sample_user, 150, "макдак", datetime(2024, 3, 5)))
+                await service.invalidate_budgets(db_private_scope)
+            finally:
+                await engine.dispose()
+
+        asyncio.run(scenario())
+
+        assert bump_threads == ["redis-executor", "redis-executor"]
+        after = report_cache.snapshot_key(db_private_scope, 2024, [Month.march])
+        assert before.split("_")[-1] == "0-0-0" and after.split("_")[-1] == "0-1-1"
+
+    @pytest.mark.integration
+    def test_category_rename_outdates_cached_reports(
+        self, db_engine, sample_user, report_cache, make_fill, db_group_scope
+    ):
+        """Test that a report cached before a category was renamed is built again with the new name"""
+        from types import SimpleNamespace
+        from sqlalchemy import update
+        from handlers.report import _monthly_report_snapshot
+        from model import StoredCategory
+
+        class Async:
+            def __init__(self, service):
+                self.service = service
+
+            def __getattr__(self, name):
+                async def call(*args):
+                    return getattr(self.service, name)(*args)
+
+                return call
+
+        service = CardFillService(db_engine=db_engine, report_cache=report_cache)
+        handler = SimpleNamespace(card_fill_service=Async(service), report_cache=Async(report_cache))
+        service.handle_new_fill(make_fill(sample_user, 150, "такси", datetime(2024, 3, 5), scope=db_group_scope))
+
+        def report_text():
+            return asyncio.run(
+                _monthly_report_snapshot(handler, [Month.march, Month.april], 2024, db_group_scope)
+            ).text
+
+        before = report_text()
+        with db_engine.begin() as conn:
+            conn.execute(update(StoredCategory).where(StoredCategory.code == "TAXI").values(name="Извоз"))
+        assert report_text() == before  # served from the cache
+
+        service.invalidate_categories()
+
+        after = report_text()
+        assert "Извоз" not in before and "Извоз" in after
@@ -0,0 +1,86 @@
+"""
+Test suite for statement fingerprints and SQL stats per telegram update
+"""
+
+import asyncio
+import logging
+import pytest
+
+from services.bounded_executor import BoundedExecutor
+from services.card_fill_service import CardFillService
+from services.sql_stats import SqlStats, fingerprint
+
+
+class TestFingerprint:
+    """Test that runs of one statement with different values share a fingerprint"""
+
+    @pytest.mark.unit
+    def test_literals_and_lists_collapse(self):
+        """Test placeholders, literals, IN lists and multi-row VALUES"""
+        assert fingerprint("SELECT *\n  FROM card_fill WHERE fill_id IN (?, ?, ?) AND description = 'a''b'") == (
+            "SELECT * FROM card_fill WHERE fill_id IN (?...) AND description = ?"
+        )
+        assert fingerprint("SELECT * FROM card_fill WHERE fill_id IN (%s) AND amount > 15.5") == (
+            "SELECT * FROM card_fill WHERE fill_id IN (?) AND amount > ?"
+        )
+        assert fingerprint("INSERT INTO t (a, b) VALUES (%(a_m0)s, %(b_m0)s), (%(a_m1)s, %(b_m1)s)") == (
+            "INSERT INTO t (a, b) VALUES (?...), ..."
+        )
+        assert fingerprint("SELECT card_fill_1.fill_id FROM card_fill AS card_fill_1 LIMIT :param_1") == (
+            "SELECT card_fill_1.fill_id FROM card_fill AS card_fill_1 LIMIT ?"
+        )
+
+
+class TestSqlStats:
+    """Test that statements are attributed to the update and handler that ran them"""
+
+    @pytest.mark.integration
+    def test_statements_per_update_and_handler(self, db_engine, sample_user, caplog, make_fill, db_private_scope):
+        """Test counts through an executor thread, statements outside updates and the slow update log"""
+        sql_stats = SqlStats(slow_update_ms=0)
+        service = CardFillService(db_engine=db_engine, sql_stats=sql_stats)
+        executor = BoundedExecutor("db", 1, 1)
+        fill = make_fill(sample_user, 150, "макдак")
+
+        async def update():
+            with sql_stats.track_update(1, "message") as trace:
+                sql_stats.name_handler("FillMessageHandler")
+                await executor.run(service.handle_new_fill, fill)
+            return trace
+
+        service.get_scope(db_private_scope.chat_id)  # outside any update
+        outside = sum(s.count for s in sql_stats.statement_stats())
+        with caplog.at_level(logging.WARNING, logger="services.sql_stats"):
+            trace = asyncio.run(update())
+        executor.shutdown()
+
+        [handler] = sql_stats.handler_stats()
+        assert handler.handler == "FillMessageHandler"
+        assert handler.updates == 1
+        assert handler.statements == trace.statement_count > 0
+        assert sum(s.count for s in sql_stats.statement_stats()) == outside + handler.statements
+        assert any(
+            s.fingerprint.startswith("INSERT INTO card_fill ") and s.rows == 1 for s in sql_stats.statement_stats()
+        )
+        assert "Slow update 1 in FillMessageHandler" in caplog.text
+
+        sql_stats.reset()
+        assert sql_stats.handler_stats() == [] and sql_stats.statement_stats() == []
+
+    @pytest.mark.integration
+    def test_failed_statement_leaves_no_state_on_the_connection(self, db_engine):
+        """Test that a statement raising in the driver is not counted and is not kept on the pooled connection"""
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError
+
+        sql_stats = SqlStats()
+        sql_stats.instrument(db_engine)
+
+        with db_engine.connect() as conn:
+            info = dict(conn.info)
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+            assert conn.info == info
+            conn.execute(text("SELECT 1"))
+
+        assert [(s.fingerprint, s.count) for s in sql_stats.statement_stats()] == [("SELECT ?", 1)]
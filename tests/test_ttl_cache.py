@@ -0,0 +1,69 @@
+"""
+Test suite for the TTL-bounded LRU cache and the scope cache built on it
+"""
+
+import pytest
+from sqlalchemy import event
+
+from services.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    """Test expiry, LRU eviction and counters"""
+
+    @pytest.mark.unit
+    def test_expiry_and_eviction(self):
+        """Test that entries expire after ttl and the least recently used one is evicted"""
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # "b" is now least recently used
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+        clock.now = 10
+        assert cache.get("a") is None
+
+        stats = cache.stats()
+        assert (stats.hits, stats.misses, stats.size) == (2, 2, 1)
+
+    @pytest.mark.unit
+    def test_invalidate(self):
+        """Test dropping one key and all keys"""
+        cache = TTLCache(maxsize=10, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.invalidate("a")
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+        cache.invalidate()
+        assert cache.get("b") is None
+
+
+class TestScopeCache:
+    """Test that repeated get_scope calls stop hitting the database"""
+
+    @pytest.mark.integration
+    def test_get_scope_queries_once(self, card_fill_service, db_engine):
+        """Test hits, misses and explicit invalidation"""
+        statements = []
+        event.listen(db_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        for _ in range(3):
+            assert card_fill_service.get_scope(456).scope_id == 1
+        card_fill_service.invalidate_scope(456)
+        card_fill_service.get_scope(456)
+
+        assert sum("fill_scope" in statement for statement in statements) == 2
+        stats = card_fill_service.scope_cache_stats()
+        assert (stats.hits, stats.misses) == (2, 2)